@@ -0,0 +1,195 @@
+"""asyncio API of the Yao protocol.
+
+Messages are sent and received by zmq.asyncio sockets on the event loop,
+while the protocol code (garbling, oblivious transfers, evaluation) runs
+in executor threads. That code, the oblivious transfers of every OT mode
+and streamed chunks included, talks to the other party through a
+BlockingSocket, which hands every send and receive over to the loop, so
+many protocol runs can be in flight on one event loop without blocking
+it. Each run in flight holds one executor thread.
+
+Example:
+    alice = await aio.AsyncAlice.create("src/circuits/4bit_max.json",
+                                        filename="src/data/alice.in")
+    await alice.start()
+"""
+import asyncio
+import functools
+import logging
+import zmq
+import zmq.asyncio
+import codec
+import util
+from alice import Alice
+from bob import Bob
+
+
+class AsyncSocket:
+    """A zmq.asyncio socket exchanging messages encoded by the codec
+    module, with coroutine send and receive.
+
+    Args:
+        socket_type: The ZMQ socket type.
+        serializer: Optional; "binary" (the default) or "pickle".
+    """
+    def __init__(self, socket_type, serializer="binary"):
+        if serializer not in codec.FORMATS:
+            raise ValueError(f"Unknown serializer '{serializer}', "
+                             f"must be in {list(codec.FORMATS.keys())}")
+        self.socket = zmq.asyncio.Context.instance().socket(socket_type)
+        self.serializer = serializer
+
+    async def send(self, msg):
+        await self.socket.send_multipart(codec.encode(msg, self.serializer),
+                                         copy=False)
+
+    async def receive(self):
+        return codec.decode(await self.socket.recv_multipart(copy=False))
+
+    async def send_wait(self, msg):
+        await self.send(msg)
+        return await self.receive()
+
+    def close(self):
+        self.socket.close(linger=0)
+
+
+class AsyncEvaluatorSocket(AsyncSocket):
+    def __init__(self, endpoint=f"tcp://*:{util.LOCAL_PORT}", serializer="binary"):
+        super().__init__(zmq.REP, serializer)
+        self.socket.bind(endpoint)
+
+
+class AsyncGarblerSocket(AsyncSocket):
+    def __init__(self,
+                 endpoint=f"tcp://{util.SERVER_HOST}:{util.SERVER_PORT}",
+                 serializer="binary"):
+        super().__init__(zmq.REQ, serializer)
+        self.socket.connect(endpoint)
+
+
+class BlockingSocket:
+    """Blocking view of an AsyncSocket, with the interface of util.Socket.
+
+    Each call waits for the matching coroutine to complete on the event
+    loop, so it must only be used from executor threads, never from the
+    loop itself.
+
+    Args:
+        socket: The AsyncSocket.
+        loop: Optional; the event loop of the socket, set by run_blocking.
+    """
+    def __init__(self, socket, loop=None):
+        self.socket = socket
+        self.loop = loop
+
+    def _wait(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def send(self, msg):
+        self._wait(self.socket.send(msg))
+
+    def receive(self):
+        return self._wait(self.socket.receive())
+
+    def send_wait(self, msg):
+        return self._wait(self.socket.send_wait(msg))
+
+    def poll_socket(self):
+        while True:
+            yield self.receive()
+
+
+async def run_blocking(socket, func, *args, executor=None, **kwargs):
+    """Run blocking protocol code in an executor thread.
+
+    Args:
+        socket: The BlockingSocket used by 'func'.
+        func: The function to run.
+        executor: Optional; the concurrent.futures executor
+            (the default executor of the loop by default).
+
+    Returns:
+        The value returned by 'func'.
+    """
+    socket.loop = asyncio.get_running_loop()
+    return await socket.loop.run_in_executor(
+        executor, functools.partial(func, *args, **kwargs))
+
+
+class AsyncAlice(Alice):
+    """Alice running the protocol on an event loop.
+
+    Create instances with 'await AsyncAlice.create(...)', which garbles the
+    circuits in an executor.
+
+    Args:
+        circuits: the JSON file containing circuits
+        socket: Optional; the AsyncSocket connected to Bob (by default a
+            new AsyncGarblerSocket).
+        executor: Optional; the executor running the protocol code.
+        **kwargs: The options of alice.Alice.
+    """
+    def __init__(self, circuits, socket=None, executor=None, **kwargs):
+        socket = socket or AsyncGarblerSocket(
+            serializer=kwargs.get("serializer", "binary"))
+        super().__init__(circuits, socket=BlockingSocket(socket), **kwargs)
+        self.async_socket = socket
+        self.thread_executor = executor
+
+    @classmethod
+    async def create(cls, circuits, socket=None, executor=None, **kwargs):
+        """Create an AsyncAlice, garbling the circuits in an executor."""
+        # the socket is created on the loop it is used on
+        socket = socket or AsyncGarblerSocket(
+            serializer=kwargs.get("serializer", "binary"))
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor, functools.partial(cls, circuits, socket=socket,
+                                        executor=executor, **kwargs))
+
+    async def start(self):
+        """Start Yao protocol."""
+        await run_blocking(self.socket, super().start,
+                           executor=self.thread_executor)
+
+
+class AsyncBob(Bob):
+    """Bob serving Alice's messages on an event loop.
+
+    Args:
+        socket: Optional; the AsyncSocket connected to Alice (by default a
+            new AsyncEvaluatorSocket).
+        executor: Optional; the executor running the protocol code.
+        **kwargs: The options of bob.Bob.
+    """
+    def __init__(self, socket=None, executor=None, **kwargs):
+        socket = socket or AsyncEvaluatorSocket(
+            serializer=kwargs.get("serializer", "binary"))
+        super().__init__(socket=BlockingSocket(socket), **kwargs)
+        self.async_socket = socket
+        self.thread_executor = executor
+
+    async def listen(self):
+        """Start listening for Alice messages, until cancelled."""
+        logging.info("Start listening")
+        try:
+            while True:
+                entry = await self.async_socket.receive()
+                await run_blocking(self.socket, self.handle, entry,
+                                   executor=self.thread_executor)
+        except asyncio.CancelledError:
+            logging.info("Stop listening")
+            raise
+
+
+async def run_alice(circuits, **kwargs):
+    """Garble the circuits and run the protocol as an AsyncAlice."""
+    alice = await AsyncAlice.create(circuits, **kwargs)
+    await alice.start()
+    alice.close()
+
+
+async def run_bob(**kwargs):
+    """Serve Alice's messages as an AsyncBob, until cancelled."""
+    await AsyncBob(**kwargs).listen()
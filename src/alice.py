@@ -1,6 +1,9 @@
 import logging
+import time
 import garbler
 import ot
+import simd
+import simulator
 import util
 import utli_karol
 
@@ -17,58 +20,131 @@ class Alice(garbler.YaoGarbler):
     a specific order.
 
     Attributes:
-        circuits: the JSON file containing circuits
+        circuits: the JSON file containing circuits, or its content
         oblivious_transfer: Optional; enable the Oblivious Transfer protocol
             (True by default)
         print_mode: Optional; if set to anything but "none", would result in evaluation and printing out the circuit table;
+            "local" prints the table computed in clear by Alice alone, without any exchange with Bob;
+            "batch" gets all combinations evaluated by Bob in a single round trip.
             Note that print_mode has to be set to the same value on both parts.
         filename: Optional; path to the file, from which to read data;
             Default is empty string, and data is read from console.
         bit_size: Optional; size of input numbers in bits (i.e. the max of the number is 2^bit_size-1);
-            Default is 4, max is 15;
-            Note that the size has to correspond with circuit used.
+            Default is 4;
+            Note that the size has to correspond with circuit used,
+            circuits of any size are made by the generator module (e.g. 32 or 64 bits).
+        scheme: Optional; a dict of garbling options for the circuits
+            (the cipher and Free-XOR), see yao.GarbledCircuit.
+        ot_mode: Optional; "wire" for one OT per Bob's wire (the default),
+            "batch" for the OTs of all Bob's wires in parallel, "extension"
+            for OT extension. Bob uses the mode chosen by Alice.
+        group: Optional; the ID of the prime group of the OTs, see util.GROUPS.
+        serializer: Optional; the encoding of the messages sent to Bob,
+            "binary" (the default) or "pickle", see codec.
+        stream: Optional; garble the circuit by chunks of gates sent to Bob
+            as soon as they are ready, Bob evaluating each chunk on arrival
+            (False by default). Needs print_mode "none" or "local".
+        socket: Optional; the socket connected to Bob (by default a new
+            util.GarblerSocket), e.g. an aio.BlockingSocket.
+        pool_options: Optional; a dict of options of pool.GarbledPool
+            (depth, workers, refill_rate). If set, circuits are garbled
+            offline in the background and each run of start takes fresh
+            instances, so that its latency does not include garbling.
+        executor: Optional; a process pool garbling the wide levels of the
+            circuits in parallel (see pool.new_executor).
+        optimize: Optional; optimize the circuits before garbling them,
+            see optimizer.optimize (False by default).
+        simd: Optional; answer one query per number of Alice's data instead
+            of the max of the data (False by default). The circuits are
+            replicated once per number (see simd.replicate), Bob using his
+            numbers in the same order, and the results are lists. Needs
+            print_mode "none".
     """
 
-    def __init__(self, circuits, oblivious_transfer=True, print_mode="none", filename="", bit_size=4):
-        super().__init__(circuits)
-        self.socket = util.GarblerSocket()
-        self.ot = ot.ObliviousTransfer(self.socket, enabled=oblivious_transfer)
+    def __init__(self, circuits, oblivious_transfer=True, print_mode="none", filename="", bit_size=4,
+                 scheme=None, ot_mode="wire", group=util.DEFAULT_GROUP, serializer="binary",
+                 stream=False, socket=None, pool_options=None, executor=None,
+                 optimize=False, simd=False):
+        if stream and print_mode not in ("none", "local"):
+            raise ValueError("Streaming needs print mode 'none' or 'local'")
+        if simd and print_mode != "none":
+            raise ValueError("SIMD batches need print mode 'none'")
+        data = self.read_data(filename, bit_size, simd)
+        super().__init__(circuits, scheme=scheme, stream=stream,
+                         pool_options=pool_options, executor=executor,
+                         optimize=optimize, copies=len(data) if simd else 1)
+        self.socket = socket or util.GarblerSocket(serializer=serializer)
+        self.ot = ot.ObliviousTransfer(self.socket, enabled=oblivious_transfer,
+                                       mode=ot_mode, group=group)
         # Couple more fields:
         # pm defines, if the printing of the garbled tables (and their evaluation) should be performed
         # general_max stores the value obtained from the OT to further use
         # private_value is equal to max of input, obtained through private_func
-        # (either from console or from file)
-        # bitlen is length of numbers from input, saved for later use
+        # (either from console or from file), read before garbling (see read_data)
         self.pm = print_mode
+        self.stream = stream
         self.general_max = -1
-        self.bitlen = bit_size
+
+    def read_data(self, filename="", bit_size=4, simd=False):
+        """Read Alice's data for the next runs of start, e.g. the data of
+        a new query of a session (see session.py).
+
+        Args:
+            filename: Optional; path to the file, from which to read data,
+                data is read from console if empty.
+            bit_size: Optional; size of input numbers in bits.
+            simd: Optional; keep all the numbers of the data, one per query
+                of a SIMD batch, instead of their max only.
+
+        Returns:
+            The numbers of the data, or None if only their max is kept.
+        """
         if filename == "":
-            _, self.private_value = utli_karol.private_func("Alice", bit_size=bit_size)
+            data, self.private_value = utli_karol.private_func("Alice", bit_size=bit_size)
         else:
-            _, self.private_value = utli_karol.private_func("Alice", bit_size=bit_size, file_read=True,
-                                                            filename=filename)
+            # without SIMD, only the max of the file is kept
+            data, self.private_value = utli_karol.private_func("Alice", bit_size=bit_size, file_read=True,
+                                                               filename=filename, keep_values=simd)
+        # the numbers of the queries of a SIMD batch, one per copy of the circuits
+        self.values = [int(num) for num in data] if simd else None
+        # bitlen is length of numbers from input, saved for later use
+        self.bitlen = bit_size
+        return data
 
     def start(self):
         """Start Yao protocol."""
 
-        for circuit in self.circuits:
+        for circuit in self.get_circuits():
             to_send = {
                 "circuit": circuit["circuit"],
                 "garbled_tables": circuit["garbled_tables"],
+                "scheme": circuit["scheme"],
                 "pbits_out": circuit["pbits_out"],
                 "printout": self.pm,
                 "bitlength": self.bitlen,
+                "ot": self.ot.mode,
+                "group": self.ot.group,
+                "stream": self.stream,
+                "simd": len(self.values) if self.values is not None else 0,
             }
             logging.debug(f"Sending {circuit['circuit']['id']}")
             self.socket.send_wait(to_send)
             # evaluation
-            if self.pm != "none":
+            if self.pm == "local":
+                simulator.print_truth_table(circuit["program"])
+            elif self.pm == "batch":
+                self.print_batch(circuit)
+            elif self.pm != "none":
                 self.print(circuit)
 
             # main part of communication
             print("-------------")
+            start_time = time.perf_counter()
             self.calculate_response(circuit)
+            logging.info(f"Query on {circuit['circuit']['id']} answered in "
+                         f"{(time.perf_counter() - start_time) * 1000:.1f} ms")
             self.verify()
+        self.report_pools()
 
     def print(self, entry):
         """Print circuit evaluation for all Bob and Alice inputs.
@@ -85,14 +161,11 @@ class Alice(garbler.YaoGarbler):
             w: self._get_encr_bits(pbits[w], key0, key1)
             for w, (key0, key1) in keys.items() if w in b_wires
         }
-        N = len(a_wires) + len(b_wires)
 
         print(f"======== {circuit['id']} ========")
 
         # Generate all inputs for both Alice and Bob
-        for bits in [format(n, 'b').zfill(N) for n in range(2 ** N)]:
-            bits_a = [int(b) for b in bits[:len(a_wires)]]  # Alice's inputs
-
+        for bits_a, bits_b in util.input_combinations(len(a_wires), len(b_wires)):
             # Map Alice's wires to (key, encr_bit)
             for i in range(len(a_wires)):
                 a_inputs[a_wires[i]] = (keys[a_wires[i]][bits_a[i]],
@@ -102,8 +175,8 @@ class Alice(garbler.YaoGarbler):
             result = self.ot.get_result(a_inputs, b_keys)
 
             # Format output
-            str_bits_a = ' '.join(bits[:len(a_wires)])
-            str_bits_b = ' '.join(bits[len(a_wires):])
+            str_bits_a = ' '.join(map(str, bits_a))
+            str_bits_b = ' '.join(map(str, bits_b))
             str_result = ' '.join([str(result[w]) for w in outputs])
 
             print(f"  Alice{a_wires} = {str_bits_a} "
@@ -112,6 +185,39 @@ class Alice(garbler.YaoGarbler):
 
         print()
 
+    def print_batch(self, entry):
+        """Print circuit evaluation for all Bob and Alice inputs,
+        evaluated by Bob in a single round trip.
+
+        Args:
+            entry: A dict representing the circuit to evaluate.
+        """
+        circuit, pbits, keys = entry["circuit"], entry["pbits"], entry["keys"]
+        outputs = circuit["out"]
+        a_wires = circuit.get("alice", [])  # Alice's wires
+        b_wires = circuit.get("bob", [])  # Bob's wires
+        # maps from each wire to a pair (key, encr_bit)
+        a_keys = {w: self._get_encr_bits(pbits[w], *keys[w]) for w in a_wires}
+        b_keys = {w: self._get_encr_bits(pbits[w], *keys[w]) for w in b_wires}
+
+        print(f"======== {circuit['id']} ========")
+
+        results = self.ot.get_batch_result(a_keys, b_keys)
+        combinations = util.input_combinations(len(a_wires), len(b_wires))
+        for n, (bits_a, bits_b) in enumerate(combinations):
+            result = results[n * len(outputs):(n + 1) * len(outputs)]
+
+            # Format output
+            str_bits_a = ' '.join(map(str, bits_a))
+            str_bits_b = ' '.join(map(str, bits_b))
+            str_result = ' '.join(map(str, result))
+
+            print(f"  Alice{a_wires} = {str_bits_a} "
+                  f"Bob{b_wires} = {str_bits_b}  "
+                  f"Outputs{outputs} = {str_result}")
+
+        print()
+
     def calculate_response(self, entry):
         """Proceeds with OT on real data.
         Function based on the original print function.
@@ -132,22 +238,44 @@ class Alice(garbler.YaoGarbler):
             for w, (key0, key1) in keys.items() if w in b_wires
         }
 
-        # Circuit input generated based on private value obtained while initialisation
-        bits_a = [int(b) for b in self.private_value]  # Alice's inputs
+        # Circuit input generated based on private value obtained while initialisation,
+        # or on all the numbers of a SIMD batch
+        if self.values is not None:
+            bits_a = simd.input_bits(self.values, self.bitlen)
+        else:
+            bits_a = [int(b) for b in self.private_value]  # Alice's inputs
 
         # Map Alice's wires to (key, encr_bit), no changes here
         for i in range(len(a_wires)):
             a_inputs[a_wires[i]] = (keys[a_wires[i]][bits_a[i]],
                                     pbits[a_wires[i]] ^ bits_a[i])
 
-        # Send Alice's encrypted inputs and keys to Bob
-        result = self.ot.get_result(a_inputs, b_keys)
+        # Send Alice's encrypted inputs and keys to Bob,
+        # then the garbled tables if they are streamed
+        chunks = self._stream_chunks(entry) if self.stream else None
+        result = self.ot.get_result(a_inputs, b_keys, chunks=chunks)
 
         # Format output, save for further use, and print
+        if self.values is not None:
+            self.general_max = simd.split_result(result, circuit["out"],
+                                                 len(self.values))
+            print(f"Results of function are {self.general_max}")
+            return
         int_result = utli_karol.circuit_output_to_int(result)
         self.general_max = int_result
         print(f"Result of function is {int_result}")
 
+    def _stream_chunks(self, entry):
+        """Garble a circuit by chunks and yield the messages streaming it
+        to Bob, see ot.ObliviousTransfer.send_stream_result."""
+        garbled_circuit = entry["garbled_circuit"]
+        for num_gates, garbled_tables in garbled_circuit.gen_garbled_chunks():
+            logging.debug(f"Sending {len(garbled_tables)} garbled tables")
+            yield {"gates": num_gates, "garbled_tables": garbled_tables}
+        pbits = garbled_circuit.get_pbits()
+        entry["pbits_out"] = {w: pbits[w] for w in entry["circuit"]["out"]}
+        yield {"pbits_out": entry["pbits_out"]}
+
     def _get_encr_bits(self, pbit, key0, key1):
         return ((key0, 0 ^ pbit), (key1, 1 ^ pbit))
 
@@ -157,7 +285,9 @@ class Alice(garbler.YaoGarbler):
         Prints a verification result
         """
         to_send = {
-            "alice_max": int(self.private_value, 2),
+            # the numbers of a SIMD batch are checked one by one
+            "alice_max": (self.values if self.values is not None
+                          else int(self.private_value, 2)),
             "general_max": self.general_max
         }
         logging.debug(f"Sending data for verification")
@@ -0,0 +1,418 @@
+"""Benchmarks of garbling, evaluation, oblivious transfers and whole runs.
+
+For each circuit of the shipped circuits/*.json files and of larger
+generated circuits (see GENERATED), the benchmark measures:
+
+* garbling speed in gates per second (yao.GarbledCircuit),
+* evaluation speed in gates per second (yao.evaluate),
+* the size in bytes of the message sending the garbled circuit to Bob,
+  as encoded by codec,
+* the end-to-end latency of a run of the protocol (Alice.start, Alice and
+  Bob exchanging messages over a local ZMQ socket), for circuits whose
+  parties have inputs of the same size.
+
+It also measures the oblivious transfers of Bob's keys, in OTs per second
+for each OT mode (ot.OT_MODES).
+
+Timings are the best of several repeats, each of them long enough to be
+measured (see timeit). Results are written as JSON, and compared to a
+saved baseline with --compare, which flags the metrics worse than the
+baseline by more than a threshold.
+
+Example:
+    python bench.py -o baseline.json
+    python bench.py --compare baseline.json
+"""
+import contextlib
+import datetime
+import glob
+import io
+import json
+import logging
+import os
+import platform
+import secrets
+import tempfile
+import threading
+import time
+import timeit
+import zmq
+import ciphers
+import codec
+import compiler
+import cache
+import generator
+import ot
+import util
+import yao
+from alice import Alice
+from bob import Bob
+
+CIRCUITS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "circuits", "*.json")
+# (operation, bit size) of the generated circuits
+GENERATED = (("max", 32), ("add", 64), ("max", 128), ("cmp", 256))
+OT_WIRES = 128  # number of Bob's wires transferred by the OT benchmarks
+THRESHOLD = 0.2  # relative change flagged as a regression by compare
+# Metrics of the results, as (name, True if higher is better)
+METRICS = (
+    ("garble_gates_per_s", True),
+    ("evaluate_gates_per_s", True),
+    ("message_bytes", False),
+    ("latency_ms", False),
+    ("ots_per_s", True),
+)
+
+
+def _best_time(func, repeat):
+    """Return the best time in seconds of a call of func, over 'repeat'
+    measures of as many calls as needed to last 0.2 seconds."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def _local_sockets(serializer="binary"):
+    """Return a pair (garbler socket, evaluator socket) connected over a
+    free local port."""
+    evaluator = util.EvaluatorSocket(endpoint="tcp://127.0.0.1:*",
+                                     serializer=serializer)
+    endpoint = evaluator.socket.getsockopt_string(zmq.LAST_ENDPOINT)
+    return util.GarblerSocket(endpoint=endpoint, serializer=serializer), evaluator
+
+
+def bench_circuit(circuit, scheme, repeat=3, serializer="binary"):
+    """Benchmark the garbling and evaluation of a circuit.
+
+    Args:
+        circuit: A dict containing circuit spec, or the compiled circuit.
+        scheme: A dict of garbling options passed to yao.GarbledCircuit.
+        repeat: Optional; the number of measures of each timing.
+        serializer: Optional; the encoding of the messages, see codec.
+
+    Returns:
+        A dict of the gate and garbled table counts, the garbling and
+        evaluation speeds and the size of the message sent to Bob.
+    """
+    program = compiler.compile_circuit(circuit)
+    garbled_circuit = yao.GarbledCircuit(program, **scheme)
+    pbits, keys = garbled_circuit.get_pbits(), garbled_circuit.get_keys()
+    garbled_tables = garbled_circuit.get_garbled_tables()
+    pbits_out = {w: pbits[w] for w in program.out}
+    inputs = {  # random inputs of both parties
+        w: (keys[w][bit], pbits[w] ^ bit)
+        for w, bit in ((w, secrets.randbits(1))
+                       for w in program.alice + program.bob)
+    }
+    a_inputs = {w: inputs[w] for w in program.alice}
+    b_inputs = {w: inputs[w] for w in program.bob}
+    message = {
+        "circuit": compiler.circuit_spec(program),
+        "garbled_tables": garbled_tables,
+        "scheme": garbled_circuit.get_scheme(),
+        "pbits_out": pbits_out,
+    }
+
+    num_gates = len(program.ops)
+    garble_time = _best_time(lambda: yao.GarbledCircuit(program, **scheme),
+                             repeat)
+    evaluate_time = _best_time(
+        lambda: yao.evaluate(program, garbled_tables, pbits_out, a_inputs,
+                             b_inputs, **garbled_circuit.get_scheme()),
+        repeat)
+    return {
+        "gates": num_gates,
+        "tables": len(garbled_tables),
+        "garble_gates_per_s": num_gates / garble_time,
+        "evaluate_gates_per_s": num_gates / evaluate_time,
+        "message_bytes": sum(len(frame) for frame in
+                             codec.encode(message, serializer)),
+    }
+
+
+def bench_run(circuit, scheme, repeat=3, ot_mode="wire",
+              group=util.DEFAULT_GROUP, serializer="binary"):
+    """Benchmark a run of the protocol on a circuit, Alice and Bob
+    exchanging messages over a local socket.
+
+    Bob runs in a thread of this process, on random numbers as large as
+    his inputs. Alice garbles the circuit beforehand, so that the latency
+    covers the transfer of the garbled circuit, the oblivious transfers,
+    the evaluation and the verification.
+
+    Args:
+        circuit: A dict containing circuit spec, or the compiled circuit.
+            Alice's and Bob's inputs must have the same size.
+        scheme: A dict of garbling options passed to yao.GarbledCircuit.
+        repeat: Optional; the number of runs, the best one being kept.
+        ot_mode: Optional; the OT mode of the runs, see ot.OT_MODES.
+        group: Optional; the ID of the prime group of the OTs.
+        serializer: Optional; the encoding of the messages, see codec.
+
+    Returns:
+        The latency of the best run in milliseconds.
+    """
+    program = compiler.compile_circuit(circuit)
+    bit_size = len(program.alice)
+    numbers = [secrets.randbelow(2**bit_size) for _ in range(2)]
+    circuits = {"name": program.id, "circuits": [program]}
+    best = None
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt") as data, \
+            contextlib.redirect_stdout(io.StringIO()):
+        data.write(" ".join(map(str, numbers)))
+        data.flush()
+        for _ in range(repeat):
+            alice_socket, bob_socket = _local_sockets(serializer)
+            bob = Bob(socket=bob_socket, data=numbers)
+            # a run is a circuit message and a verification message
+            bob_thread = threading.Thread(
+                target=lambda: [bob.handle(bob_socket.receive())
+                                for _ in range(2)])
+            bob_thread.start()
+            alice = Alice(circuits, filename=data.name, bit_size=bit_size,
+                          scheme=scheme, ot_mode=ot_mode, group=group,
+                          socket=alice_socket)
+            start = time.perf_counter()
+            alice.start()
+            latency = time.perf_counter() - start
+            bob_thread.join()
+            alice_socket.socket.close()
+            bob_socket.socket.close()
+            best = latency if best is None else min(best, latency)
+    return best * 1000
+
+
+def bench_ot(mode, wires=OT_WIRES, repeat=3, group=util.DEFAULT_GROUP):
+    """Benchmark the oblivious transfers of Bob's keys.
+
+    Args:
+        mode: The OT mode, see ot.OT_MODES.
+        wires: Optional; the number of Bob's wires.
+        repeat: Optional; the number of transfers, the best one being kept.
+        group: Optional; the ID of the prime group of the OTs.
+
+    Returns:
+        The number of OTs per second of the best transfer.
+    """
+    cipher = ciphers.get_cipher(ciphers.DEFAULT_CIPHER)
+    b_keys = {
+        w: ((cipher.gen_key(), 0), (cipher.gen_key(), 1))
+        for w in range(1, wires + 1)
+    }
+    b_inputs = {w: secrets.randbits(1) for w in b_keys}
+    best = None
+
+    for _ in range(repeat):
+        alice_socket, bob_socket = _local_sockets()
+        alice_ot = ot.ObliviousTransfer(alice_socket, mode=mode, group=group)
+        bob_ot = ot.ObliviousTransfer(bob_socket, mode=mode, group=group)
+
+        def receive():
+            bob_ot.receive_inputs(b_inputs)
+            bob_socket.send(True)
+
+        bob_thread = threading.Thread(target=receive)
+        bob_thread.start()
+        start = time.perf_counter()
+        alice_ot.send_inputs({}, b_keys)
+        alice_socket.receive()
+        duration = time.perf_counter() - start
+        bob_thread.join()
+        alice_socket.socket.close()
+        bob_socket.socket.close()
+        best = duration if best is None else min(best, duration)
+    return wires / best
+
+
+def gen_circuits(pattern=CIRCUITS, generated=GENERATED):
+    """Yield the circuits to benchmark, as pairs (name, circuit).
+
+    Circuits of the files are named after the file and their index in
+    it (e.g. "bool[3]"), generated circuits after their file name
+    (e.g. "32bit_max").
+    """
+    for path in sorted(glob.glob(pattern)):
+        name = os.path.splitext(os.path.basename(path))[0]
+        for i, circuit in enumerate(cache.load_circuits(path)["circuits"]):
+            yield f"{name}[{i}]", circuit
+    for operation, bit_size in generated:
+        circuits = generator.generate(operation, bit_size)
+        yield circuits["name"], circuits["circuits"][0]
+
+
+def run(scheme, repeat=3, ot_mode="wire", group=util.DEFAULT_GROUP,
+        serializer="binary", pattern=CIRCUITS, generated=GENERATED):
+    """Run all benchmarks.
+
+    Args:
+        scheme: A dict of garbling options passed to yao.GarbledCircuit.
+        repeat: Optional; the number of measures of each timing.
+        ot_mode: Optional; the OT mode of the end-to-end runs.
+        group: Optional; the ID of the prime group of the OTs.
+        serializer: Optional; the encoding of the messages, see codec.
+        pattern: Optional; the glob pattern of the circuit files.
+        generated: Optional; the (operation, bit size) of the generated
+            circuits.
+
+    Returns:
+        A dict of the results, as written by main: the settings of the
+        benchmark, the results of each circuit and of each OT mode.
+    """
+    results = {
+        "settings": {
+            "scheme": scheme,
+            "ot_mode": ot_mode,
+            "group": group,
+            "serializer": serializer,
+            "repeat": repeat,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        },
+        "circuits": {},
+        "ot": {},
+    }
+    for name, circuit in gen_circuits(pattern, generated):
+        program = compiler.compile_circuit(circuit)
+        logging.info(f"Benchmarking {name} ({program.id})")
+        result = {"id": program.id}
+        result.update(bench_circuit(program, scheme, repeat=repeat,
+                                    serializer=serializer))
+        if len(program.alice) == len(program.bob):
+            result["latency_ms"] = bench_run(program, scheme, repeat=repeat,
+                                             ot_mode=ot_mode, group=group,
+                                             serializer=serializer)
+        results["circuits"][name] = result
+    for mode in ot.OT_MODES:
+        logging.info(f"Benchmarking OT mode {mode}")
+        results["ot"][mode] = {"ots_per_s": bench_ot(mode, repeat=repeat,
+                                                     group=group)}
+    return results
+
+
+def compare(baseline, results, threshold=THRESHOLD):
+    """Compare results to a baseline.
+
+    Args:
+        baseline: The results of a previous run, as returned by run.
+        results: The results to check.
+        threshold: Optional; the relative change of a metric, in the bad
+            direction, flagged as a regression.
+
+    Returns:
+        A list of (section, name, metric, baseline value, value, relative
+        change) tuples, one per metric present in both results, and the
+        list of the regressions among them.
+    """
+    changes, regressions = [], []
+    if baseline.get("settings", {}).get("scheme") != results["settings"]["scheme"]:
+        logging.warning("The baseline was run with another garbling scheme")
+    for section in ("circuits", "ot"):
+        old_section = baseline.get(section, {})
+        for name, result in results[section].items():
+            old = old_section.get(name, {})
+            for metric, higher_is_better in METRICS:
+                if metric not in result or not old.get(metric):
+                    continue
+                change = result[metric] / old[metric] - 1
+                row = (section, name, metric, old[metric], result[metric], change)
+                changes.append(row)
+                if (-change if higher_is_better else change) > threshold:
+                    regressions.append(row)
+    return changes, regressions
+
+
+def print_results(results):
+    """Print the results in a table."""
+    print(f"{'circuit':<14} {'gates':>7} {'tables':>7} {'garble/s':>11} "
+          f"{'eval/s':>11} {'bytes':>9} {'latency ms':>10}")
+    for name, result in results["circuits"].items():
+        latency = result.get("latency_ms")
+        print(f"{name:<14} {result['gates']:>7} {result['tables']:>7} "
+              f"{result['garble_gates_per_s']:>11.0f} "
+              f"{result['evaluate_gates_per_s']:>11.0f} "
+              f"{result['message_bytes']:>9} "
+              f"{'-' if latency is None else f'{latency:.1f}':>10}")
+    for mode, result in results["ot"].items():
+        print(f"OT {mode:<11} {result['ots_per_s']:.0f} OTs/s")
+
+
+def main(output=None, baseline=None, threshold=THRESHOLD, **kwargs):
+    """Run the benchmarks, write and compare their results.
+
+    Args:
+        output: Optional; the path of the JSON file of the results.
+        baseline: Optional; the path of the JSON results to compare to.
+        threshold: Optional; the relative change flagged as a regression.
+        **kwargs: The options of run.
+
+    Returns:
+        The number of regressions against the baseline.
+    """
+    results = run(**kwargs)
+    print_results(results)
+    if output:
+        with open(output, "w") as file:
+            json.dump(results, file, indent=2)
+        logging.info(f"Results written to {output}")
+    if not baseline:
+        return 0
+
+    with open(baseline) as file:
+        changes, regressions = compare(json.load(file), results, threshold)
+    print(f"\nCompared to {baseline}: {len(changes)} metrics, "
+          f"{len(regressions)} regressions (threshold {threshold:.0%})")
+    for section, name, metric, old, new, change in regressions:
+        print(f"  REGRESSION {section} {name} {metric}: "
+              f"{old:.6g} -> {new:.6g} ({change:+.1%})")
+    return len(regressions)
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Benchmark Yao protocol.")
+    parser.add_argument("-o", "--output", metavar="results.json",
+                        help="write the results to a JSON file")
+    parser.add_argument("--compare", metavar="baseline.json",
+                        help="flag regressions against saved results "
+                             "(exit status 1 if any)")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help=f"relative change flagged as a regression "
+                             f"(default {THRESHOLD})")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of measures of each timing (default 3)")
+    parser.add_argument("--cipher", choices=ciphers.CIPHERS.keys(),
+                        default=ciphers.DEFAULT_CIPHER,
+                        help="the garbling cipher")
+    parser.add_argument("--free-xor", action="store_true",
+                        help="garble XOR and XNOR gates with Free-XOR")
+    parser.add_argument("--reduction", choices=["grr3", "halfgates"],
+                        default=None, help="compress garbled tables")
+    parser.add_argument("--ot", choices=ot.OT_MODES, default="wire",
+                        help="the OT mode of the end-to-end runs")
+    parser.add_argument("--serializer", choices=codec.FORMATS.keys(),
+                        default="binary", help="the encoding of the messages")
+    parser.add_argument("--circuits", metavar="pattern", default=CIRCUITS,
+                        help="glob pattern of the circuit files")
+    parser.add_argument("--seed", default=None,
+                        help="derive the wire labels from this seed, so that "
+                             "runs garble the same circuits (see prg.py)")
+    parser.add_argument("-l", "--loglevel", default="warning",
+                        choices=["debug", "info", "warning", "error"],
+                        help="the log level (default 'warning')")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="[%(levelname)s] %(message)s",
+                        level=args.loglevel.upper())
+    scheme = {"cipher": args.cipher, "free_xor": args.free_xor,
+              "reduction": args.reduction}
+    if args.seed is not None:
+        scheme["seed"] = args.seed
+    sys.exit(1 if main(output=args.output, baseline=args.compare,
+                       threshold=args.threshold, scheme=scheme,
+                       repeat=args.repeat, ot_mode=args.ot,
+                       serializer=args.serializer,
+                       pattern=args.circuits) else 0)
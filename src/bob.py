@@ -1,6 +1,9 @@
 import logging
 
+import compiler
 import ot
+import simd
+import simulator
 import util
 import utli_karol
 
@@ -16,46 +19,103 @@ class Bob:
             (True by default).
         filename: Optional; path to the file, from which to read data.
             Default is empty string, and data is read from console.
+        serializer: Optional; the encoding of the messages sent to Alice,
+            "binary" (the default) or "pickle", see codec.
+        socket: Optional; the socket connected to Alice (by default a new
+            util.EvaluatorSocket), e.g. a session of server.BobServer.
+        data: Optional; the list of inputs, if already read.
+        private_values: Optional; a dict caching the private value of the
+            data per bit length, may be shared by Bobs with the same data.
+        executor: Optional; a process pool evaluating the wide levels of
+            the circuits in parallel (see pool.new_executor).
     """
 
-    def __init__(self, oblivious_transfer=True, filename=""):
+    def __init__(self, oblivious_transfer=True, filename="", serializer="binary",
+                 socket=None, data=None, private_values=None, executor=None):
 
-        self.socket = util.EvaluatorSocket()
-        self.ot = ot.ObliviousTransfer(self.socket, enabled=oblivious_transfer)
+        self.socket = socket or util.EvaluatorSocket(serializer=serializer)
+        self.ot = ot.ObliviousTransfer(self.socket, enabled=oblivious_transfer,
+                                       executor=executor)
         # data is equal to list of inputs, obtained through private_func
         # (either from console or from file)
         # private value will be max of input, when data will be cleaned up during communication
         self.private_value = "0"
-        if filename == "":
+        self.private_values = {} if private_values is None else private_values
+        self.program = None  # last compiled circuit received from Alice
+        self.values = None  # numbers of the last SIMD batch, if any
+        self.bitlength = None  # bit length of the numbers of the last circuit
+        if data is not None:
+            self.data = data
+        elif filename == "":
             self.data, _ = utli_karol.private_func("Bob")
         else:
             self.data, _ = utli_karol.private_func("Bob", file_read=True, filename=filename)
 
-
-
     def listen(self):
         """Start listening for Alice messages."""
         logging.info("Start listening")
         try:
             for entry in self.socket.poll_socket():
-                self.socket.send(True)
-                # this part was adjusted to the requirements of task: verification
-                # length of the entry dict is 5 for calculation and 2 for verification
-                # "else" is a safeguard, should never occur.
-                if len(entry) == 5:
-                    # calculate private value (local max) based on saved data and max len obtained through communication
-                    _, self.private_value = utli_karol.private_func(data=self.data, bit_size=entry["bitlength"])
-                    if entry["printout"] != "none":
-                        self.send_evaluation(entry)
-                    self.send_response(entry)
-                elif len(entry) == 2:
-                    self.verify(entry)
-                else:
-                    logging.info("Stop listening")
-                    exit(1)
+                self.handle(entry)
         except KeyboardInterrupt:
             logging.info("Stop listening")
 
+    def handle(self, entry):
+        """Answer a message from Alice starting an exchange.
+
+        Args:
+            entry: A dict containing either a circuit to evaluate or the
+                values for verification.
+        """
+        self.socket.send(True)
+        # this part was adjusted to the requirements of task: verification
+        # the entry dict contains the circuit for calculation and 2 values for verification
+        # "else" is a safeguard, should never occur.
+        if isinstance(entry, dict) and "circuit" in entry:
+            # private value (local max) based on saved data and max len obtained through communication
+            self.private_value = self.get_private_value(entry["bitlength"])
+            self.bitlength = entry["bitlength"]
+            # or the numbers of each query of a SIMD batch
+            self.values = (self.get_batch_values(entry["bitlength"], entry["simd"])
+                           if entry.get("simd") else None)
+            # compile the circuit once for all evaluations
+            entry["program"] = compiler.compile_circuit(entry["circuit"])
+            # OT mode and group chosen by Alice
+            self.ot.mode = entry["ot"]
+            self.ot.group = entry["group"]
+            # kept to verify the result of the last circuit
+            self.program = entry["program"]
+            # "local" tables are computed by Alice alone
+            if entry["printout"] == "batch":
+                self.send_batch_evaluation(entry)
+            elif entry["printout"] not in ("none", "local"):
+                self.send_evaluation(entry)
+            self.send_response(entry)
+        elif isinstance(entry, dict) and len(entry) == 2:
+            self.verify(entry)
+        else:
+            logging.warning(f"Ignoring unexpected message {entry!r:.80}")
+
+    def get_private_value(self, bit_size):
+        """Return the private value (local max) of the data for numbers of
+        'bit_size' bits, computed once per bit length."""
+        if bit_size not in self.private_values:
+            _, self.private_values[bit_size] = utli_karol.private_func(
+                data=self.data, bit_size=bit_size)
+        return self.private_values[bit_size]
+
+    def get_batch_values(self, bit_size, copies):
+        """Return the numbers of 'bit_size' bits of the queries of a SIMD
+        batch of 'copies' queries, the first numbers of the data.
+
+        Missing numbers are replaced by zeros.
+        """
+        line, _ = utli_karol.private_func(data=self.data, bit_size=bit_size)
+        if len(line) < copies:
+            logging.warning(f"Batch of {copies} queries but only {len(line)} "
+                            f"numbers, padding with zeros")
+        return ([int(num) for num in line[:copies]] + [0] * copies)[:copies]
+
     def send_evaluation(self, entry):
         """Evaluate yao circuit for all Bob and Alice's inputs and
         send back the results.
@@ -67,14 +127,11 @@ class Bob:
         garbled_tables = entry["garbled_tables"]
         a_wires = circuit.get("alice", [])  # list of Alice's wires
         b_wires = circuit.get("bob", [])  # list of Bob's wires
-        N = len(a_wires) + len(b_wires)
 
         print(f"Received {circuit['id']}")
 
         # Generate all possible inputs for both Alice and Bob
-        for bits in [format(n, 'b').zfill(N) for n in range(2 ** N)]:
-            bits_b = [int(b) for b in bits[N - len(b_wires):]]  # Bob's inputs
-
+        for _, bits_b in util.input_combinations(len(a_wires), len(b_wires)):
             # Create dict mapping each wire of Bob to Bob's input
             b_inputs_clear = {
                 b_wires[i]: bits_b[i]
@@ -82,8 +139,19 @@ class Bob:
             }
 
             # Evaluate and send result to Alice
-            self.ot.send_result(circuit, garbled_tables, pbits_out,
-                                b_inputs_clear)
+            self.ot.send_result(entry["program"], garbled_tables, pbits_out,
+                                b_inputs_clear, scheme=entry["scheme"])
+
+    def send_batch_evaluation(self, entry):
+        """Evaluate yao circuit for all Bob and Alice's inputs at once and
+        send back all the results in a single message.
+
+        Args:
+            entry: A dict representing the circuit to evaluate.
+        """
+        print(f"Received {entry['circuit']['id']}")
+        self.ot.send_batch_result(entry["program"], entry["garbled_tables"],
+                                  entry["pbits_out"], scheme=entry["scheme"])
 
     def send_response(self, entry):
         """Cased on a circuit and input from Alice calculate the result.
@@ -101,8 +169,12 @@ class Bob:
 
         print(f"Received {circuit['id']}")
 
-        # Generate input to circuit based on the value obtained on init
-        bits_b = [int(b) for b in self.private_value]  # Bob's inputs
+        # Generate input to circuit based on the value obtained on init,
+        # or on all the numbers of a SIMD batch
+        if self.values is not None:
+            bits_b = simd.input_bits(self.values, entry["bitlength"])
+        else:
+            bits_b = [int(b) for b in self.private_value]  # Bob's inputs
 
         # Create dict mapping each wire of Bob to Bob's input, no changes here
         b_inputs_clear = {
@@ -112,8 +184,16 @@ class Bob:
 
         # Evaluate and send result to Alice,
         # also obtain the result for yourself and print
-        result = self.ot.send_result(circuit, garbled_tables, pbits_out,
-                                     b_inputs_clear)
+        if entry["stream"]:
+            result = self.ot.send_stream_result(entry["program"], b_inputs_clear,
+                                                scheme=entry["scheme"])
+        else:
+            result = self.ot.send_result(entry["program"], garbled_tables, pbits_out,
+                                         b_inputs_clear, scheme=entry["scheme"])
+        if self.values is not None:
+            results = simd.split_result(result, circuit["out"], len(self.values))
+            print(f"Results of function are {results}")
+            return
         int_result = utli_karol.circuit_output_to_int(result)
         print(f"Result of function is {int_result}")
 
@@ -122,6 +202,7 @@ class Bob:
         Function verifies if the yao works correctly.
         This also compromises the secrecy of data between parties
         Since to obtain verification we send the plaintext values and check if the circuit worked
+        The expected value is the evaluation in clear of the last circuit on both plaintext values
         The result is printed in readable form and is transferred back to Alice
 
         Args:
@@ -133,7 +214,21 @@ class Bob:
         self.socket.receive()  # for establishing communication between parties
         alice_max = entry["alice_max"]
         general_max = entry["general_max"]
-        verification_max = max(alice_max, int(self.private_value, 2))
+        # the input bits are those the parties fed to the circuit: the first
+        # bits of their numbers of 'bitlength' bits, one bit per wire
+        num_a, num_b = len(self.program.alice), len(self.program.bob)
+        if self.values is not None:  # SIMD batch, one value per query
+            a_bits = simd.input_bits(alice_max, self.bitlength)[:num_a]
+            b_bits = simd.input_bits(self.values, self.bitlength)[:num_b]
+            verification_max = simd.split_result(
+                simulator.evaluate(self.program, a_bits, b_bits),
+                self.program.out, len(self.values))
+            general_max = list(general_max)
+        else:
+            a_bits = [int(b) for b in bin(alice_max)[2:].zfill(self.bitlength)[:num_a]]
+            b_bits = [int(b) for b in self.private_value[:num_b]]
+            verification_max = utli_karol.circuit_output_to_int(
+                simulator.evaluate(self.program, a_bits, b_bits))
         res = verification_max == general_max
         if res:
             print("Verified correctly")
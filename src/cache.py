@@ -0,0 +1,208 @@
+"""Binary format of compiled circuits, and cache of compiled circuit files.
+
+A compiled circuit file starts with MAGIC, the format version and the
+length of a small JSON header, which holds the name of the circuits, the
+size and modification time of their source file, and for each circuit
+its ID, the lists of Alice's, Bob's and output wires, its number of
+gates, levels and slots, and the offset of its arrays. The arrays follow,
+8-byte aligned and little-endian: the compiled gates in evaluation order
+(IDs, input wires, slots, opcodes), then the end of each level and the
+slots of the input and output wires.
+
+Files are loaded with mmap, the arrays being read in place by NumPy
+without any parsing, see load.
+
+Example:
+    circuits = cache.load_circuits("src/circuits/4bit_max.json")
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import numpy as np
+import compiler
+import util
+
+MAGIC = b"YP"
+VERSION = 1
+HEADER = struct.Struct("<2sBxI")  # magic, version, length of the JSON header
+CACHE_DIR = "__circuitcache__"  # directory of the compiled files of a source
+ALIGNMENT = 8
+
+
+def _arrays(num_gates, num_levels, num_inputs, num_outputs):
+    """Return the (name, dtype, shape) of the arrays of a circuit, in
+    file order."""
+    return (
+        ("ids", "<i8", (num_gates, )),
+        ("in_a", "<i8", (num_gates, )),
+        ("in_b", "<i8", (num_gates, )),
+        ("slots", "<i4", (num_gates, 3)),
+        ("opcodes", "u1", (num_gates, )),
+        ("level_stops", "<i8", (num_levels, )),
+        ("input_slots", "<i4", (num_inputs, )),
+        ("output_slots", "<i4", (num_outputs, )),
+    )
+
+
+def _align(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def dump(circuits, path, source=None):
+    """Write compiled circuits to a file.
+
+    Args:
+        circuits: A dict in the format of the JSON circuit files, whose
+            circuits are specs or compiled Programs.
+        path: The path of the file.
+        source: Optional; the os.stat_result of the source of the
+            circuits, for load_circuits to check that it did not change.
+    """
+    programs = [compiler.compile_circuit(c) for c in circuits["circuits"]]
+    header = {
+        "name": circuits["name"],
+        "source": ([source.st_size, source.st_mtime_ns] if source else None),
+        "circuits": [],
+    }
+    blobs = []
+    offset = 0
+    for program in programs:
+        gates = list(program.gates)
+        values = {
+            "ids": [op[1] for op in program.ops],
+            "in_a": [gate["in"][0] for gate in gates],
+            "in_b": [gate["in"][1] if len(gate["in"]) > 1 else compiler.NO_WIRE
+                     for gate in gates],
+            "slots": [op[2:] for op in program.ops],
+            "opcodes": [op[0] for op in program.ops],
+            "level_stops": [stop for _, stop in program.levels],
+            "input_slots": [slot for _, slot in program.input_slots],
+            "output_slots": [slot for _, slot in program.output_slots],
+        }
+        header["circuits"].append({
+            "id": program.id,
+            "alice": program.alice,
+            "bob": program.bob,
+            "out": program.out,
+            "gates": len(program.ops),
+            "levels": len(program.levels),
+            "slots": program.num_slots,
+            "offset": offset,
+        })
+        for name, dtype, shape in _arrays(len(program.ops), len(program.levels),
+                                          len(program.input_slots),
+                                          len(program.output_slots)):
+            data = np.array(values[name], dtype=dtype).reshape(shape).tobytes()
+            data += bytes(_align(len(data)) - len(data))
+            blobs.append(data)
+            offset += len(data)
+
+    header = json.dumps(header).encode()
+    header += b" " * (_align(HEADER.size + len(header)) - HEADER.size - len(header))
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(header)))
+        file.write(header)
+        for data in blobs:
+            file.write(data)
+
+
+def read_header(path):
+    """Return the JSON header of a compiled circuit file, and the offset
+    of its arrays."""
+    with open(path, "rb") as file:
+        magic, version, length = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a compiled circuit file "
+                             f"of version {VERSION}")
+        return json.loads(file.read(length)), HEADER.size + length
+
+
+def load(path):
+    """Load a compiled circuit file, with mmap.
+
+    The arrays of the circuits are views on the mapped file, read by the
+    operating system on access.
+
+    Args:
+        path: The path of the file.
+
+    Returns:
+        A dict in the format of the JSON circuit files, holding the
+        compiled Programs of the circuits.
+    """
+    header, start = read_header(path)
+    with open(path, "rb") as file:
+        # the mapping stays open as long as arrays use it
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    programs = []
+    for circuit in header["circuits"]:
+        arrays = {}
+        offset = start + circuit["offset"]
+        num_inputs = len(circuit["alice"]) + len(circuit["bob"])
+        for name, dtype, shape in _arrays(circuit["gates"], circuit["levels"],
+                                          num_inputs, len(circuit["out"])):
+            count = int(np.prod(shape))
+            arrays[name] = np.frombuffer(buffer, dtype, count,
+                                         offset).reshape(shape)
+            offset += _align(count * np.dtype(dtype).itemsize)
+        gates = compiler.GateList(arrays["ids"], arrays["opcodes"],
+                                  arrays["in_a"], arrays["in_b"])
+        programs.append(compiler.Program.from_arrays(
+            circuit["id"], circuit["alice"], circuit["bob"], circuit["out"],
+            gates, arrays["slots"], arrays["level_stops"],
+            arrays["input_slots"], arrays["output_slots"], circuit["slots"]))
+    return {"name": header["name"], "circuits": programs}
+
+
+def cache_path(json_path):
+    """Return the path of the compiled file of a JSON circuit file."""
+    directory, filename = os.path.split(json_path)
+    return os.path.join(directory, CACHE_DIR,
+                        os.path.splitext(filename)[0] + ".bin")
+
+
+def load_circuits(json_path):
+    """Load a JSON circuit file through its compiled file.
+
+    The compiled file is (re)written when missing, or when the size or
+    modification time of the JSON file changed since it was written.
+
+    Args:
+        json_path: The path of the JSON circuit file.
+
+    Returns:
+        A dict in the format of the JSON circuit files, holding the
+        compiled Programs of the circuits.
+    """
+    source = os.stat(json_path)
+    path = cache_path(json_path)
+    try:
+        header, _ = read_header(path)
+        if header["source"] == [source.st_size, source.st_mtime_ns]:
+            logging.debug(f"Loading compiled circuits from {path}")
+            return load(path)
+    except (OSError, ValueError, struct.error):
+        pass
+
+    logging.info(f"Compiling {json_path} into {path}")
+    circuits = util.parse_json(json_path)
+    circuits["circuits"] = [compiler.compile_circuit(c)
+                            for c in circuits["circuits"]]
+    tmp_path = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written aside then renamed, so that readers never see half a file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        os.close(fd)
+        os.chmod(tmp_path, source.st_mode & 0o666)
+        dump(circuits, tmp_path, source)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.warning(f"Cannot write compiled circuits to {path}: {e}")
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return circuits
@@ -0,0 +1,133 @@
+import base64
+import hashlib
+import pickle
+import secrets
+from abc import abstractmethod, ABC
+from cryptography.fernet import Fernet
+import util
+
+LABEL_SIZE = 16  # size of a raw wire label in bytes (128 bits)
+
+
+class Cipher(ABC):
+    """An abstract class for the garbling cipher of a yao circuit.
+
+    A cipher encrypts the (key, encr_bit) pair of an output wire under the
+    keys of the input wires of a gate. The tweak (the gate ID) makes sure
+    that two gates sharing the same input keys never produce the same rows.
+    """
+    name = None
+    # True if the keys are raw byte strings that can be XORed together,
+    # raw ciphers also provide pad(keys, tweak)
+    raw = False
+    key_size = LABEL_SIZE  # number of random bytes of a key
+
+    def gen_key(self):
+        """Return a fresh random key for a wire."""
+        return self.make_key(secrets.token_bytes(self.key_size))
+
+    def make_key(self, data):
+        """Return the key made of 'key_size' random bytes (e.g. generated
+        by prg.LabelGenerator)."""
+        return bytes(data)
+
+    @abstractmethod
+    def encrypt(self, keys, tweak, key_out, encr_bit):
+        """Encrypt an output key along with its encrypted bit.
+
+        Args:
+            keys: The input keys of the gate, in the order of its inputs.
+            tweak: An int unique to the gate (its ID).
+            key_out: The output key to encrypt.
+            encr_bit: The encrypted bit of the output key.
+
+        Returns:
+            The ciphertext as a byte stream.
+        """
+        pass
+
+    @abstractmethod
+    def decrypt(self, keys, tweak, data):
+        """Decrypt a row of a garbled table.
+
+        Args:
+            keys: The input keys of the gate, in the order of its inputs.
+            tweak: An int unique to the gate (its ID).
+            data: The ciphertext to decrypt.
+
+        Returns:
+            A pair (key_out, encr_bit).
+        """
+        pass
+
+
+class HashCipher(Cipher):
+    """Garbling cipher based on a hash function over raw 128-bit labels.
+
+    A row is the XOR of the output label and its encrypted bit with the
+    digest H(tweak || key_a || key_b), computed with BLAKE2b. Only the
+    lowest bit of the last byte carries the encrypted bit, so that a row
+    of zeros decrypts to a valid pair (see garbled row reduction).
+    """
+    name = "hash"
+    raw = True
+
+    def pad(self, keys, tweak):
+        """Return the one-time pad of a row (LABEL_SIZE + 1 bytes)."""
+        h = hashlib.blake2b(tweak.to_bytes(8, "little", signed=True),
+                            digest_size=LABEL_SIZE + 1)
+        for key in keys:
+            h.update(key)
+        return h.digest()
+
+    def encrypt(self, keys, tweak, key_out, encr_bit):
+        return util.xor_bytes(key_out + bytes((encr_bit, )),
+                              self.pad(keys, tweak))
+
+    def decrypt(self, keys, tweak, data):
+        msg = util.xor_bytes(data, self.pad(keys, tweak))
+        return msg[:LABEL_SIZE], msg[LABEL_SIZE] & 1
+
+
+class FernetCipher(Cipher):
+    """Legacy garbling cipher, each row is encrypted once per input key.
+
+    Keys are base64 Fernet keys and rows are Fernet tokens of the pickled
+    (key_out, encr_bit) pair. The tweak is not needed since Fernet uses a
+    random IV.
+    """
+    name = "fernet"
+    key_size = 32
+
+    def make_key(self, data):
+        return base64.urlsafe_b64encode(data)
+
+    def encrypt(self, keys, tweak, key_out, encr_bit):
+        data = pickle.dumps((key_out, encr_bit))
+        for key in reversed(keys):
+            data = Fernet(key).encrypt(data)
+        return data
+
+    def decrypt(self, keys, tweak, data):
+        data = bytes(data)  # rows may be received as memoryviews
+        for key in keys:
+            data = Fernet(key).decrypt(data)
+        return pickle.loads(data)
+
+
+CIPHERS = {cipher.name: cipher for cipher in (HashCipher(), FernetCipher())}
+DEFAULT_CIPHER = HashCipher.name
+
+
+def get_cipher(cipher):
+    """Return the cipher backend registered under the given name.
+
+    Args:
+        cipher: The name of the cipher, or a Cipher instance.
+    """
+    if isinstance(cipher, Cipher):
+        return cipher
+    if cipher not in CIPHERS:
+        raise ValueError(f"Unknown cipher '{cipher}', "
+                         f"must be in {list(CIPHERS.keys())}")
+    return CIPHERS[cipher]
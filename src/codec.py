@@ -0,0 +1,209 @@
+"""Binary encoding of the messages exchanged by Alice and Bob.
+
+A message is encoded as a list of frames sent as one ZMQ multipart
+message. The first frame starts with a header (magic, version, format)
+followed by the encoded structure. Large byte strings and the rows of
+garbled tables are stored in the next frames, so that the receiver reads
+them without copy (as memoryviews on the received frames).
+
+Garbled tables (see tables.GarbledTables) are encoded as their buffers:
+one header byte per gate, the offsets of their rows and the rows.
+Objects the binary encoding does not support are pickled.
+"""
+import pickle
+import struct
+import tables
+
+MAGIC = b"YC"
+VERSION = 2
+BINARY, PICKLE = 0, 1  # formats of a message
+FORMATS = {"binary": BINARY, "pickle": PICKLE}
+FRAME_MIN_SIZE = 1024  # byte strings sent in their own frame
+
+# Tags of the encoded values
+(NONE, TRUE, FALSE, INT, BIG_INT, FLOAT, STR, BYTES, FRAME, LIST, TUPLE,
+ DICT, TABLES) = range(13)
+BYTES_TYPES = (bytes, bytearray, memoryview)
+
+
+def encode(msg, serializer="binary"):
+    """Encode a message into a list of frames.
+
+    Args:
+        msg: The message to encode.
+        serializer: Optional; "binary" (the default) or "pickle". Binary
+            encoding falls back to pickle for unsupported objects.
+
+    Returns:
+        A list of bytes-like frames.
+    """
+    if serializer == "binary":
+        encoder = _Encoder()
+        try:
+            encoder.encode(msg)
+        except TypeError:
+            pass
+        else:
+            header = bytearray(MAGIC + bytes((VERSION, BINARY)))
+            return [header + encoder.out] + encoder.frames
+    header = MAGIC + bytes((VERSION, PICKLE))
+    return [header + pickle.dumps(msg, protocol=pickle.HIGHEST_PROTOCOL)]
+
+
+def decode(frames):
+    """Decode a list of frames into a message.
+
+    Args:
+        frames: A list of bytes-like frames, or of zmq.Frame.
+
+    Returns:
+        The decoded message.
+    """
+    frames = [
+        frame.buffer if hasattr(frame, "buffer") else memoryview(frame)
+        for frame in frames
+    ]
+    head = frames[0]
+    if bytes(head[:2]) != MAGIC or head[2] != VERSION:
+        raise ValueError("Unknown message encoding")
+    if head[3] == PICKLE:
+        return pickle.loads(head[4:])
+    decoder = _Decoder(head, frames)
+    decoder.pos = 4
+    return decoder.decode()
+
+
+class _Encoder:
+    def __init__(self):
+        self.out = bytearray()
+        self.frames = []
+
+    def uint(self, num):
+        out = self.out
+        while num >= 0x80:
+            out.append((num & 0x7f) | 0x80)
+            num >>= 7
+        out.append(num)
+
+    def sint(self, num):
+        self.uint(num << 1 if num >= 0 else ((-num) << 1) - 1)
+
+    def encode(self, obj):
+        out = self.out
+        if obj is None:
+            out.append(NONE)
+        elif obj is True:
+            out.append(TRUE)
+        elif obj is False:
+            out.append(FALSE)
+        elif isinstance(obj, int):
+            if -2**63 <= obj < 2**63:
+                out.append(INT)
+                self.sint(obj)
+            else:
+                data = obj.to_bytes((obj.bit_length() + 8) // 8, "big",
+                                    signed=True)
+                out.append(BIG_INT)
+                self.uint(len(data))
+                out += data
+        elif isinstance(obj, float):
+            out.append(FLOAT)
+            out += struct.pack("<d", obj)
+        elif isinstance(obj, str):
+            data = obj.encode()
+            out.append(STR)
+            self.uint(len(data))
+            out += data
+        elif isinstance(obj, BYTES_TYPES):
+            if len(obj) >= FRAME_MIN_SIZE:
+                out.append(FRAME)
+                self.uint(len(self.frames) + 1)
+                self.frames.append(obj)
+            else:
+                out.append(BYTES)
+                self.uint(len(obj))
+                out += obj
+        elif isinstance(obj, (list, tuple)):
+            out.append(LIST if isinstance(obj, list) else TUPLE)
+            self.uint(len(obj))
+            for item in obj:
+                self.encode(item)
+        elif isinstance(obj, dict):
+            out.append(DICT)
+            self.uint(len(obj))
+            for key, value in obj.items():
+                self.encode(key)
+                self.encode(value)
+        elif isinstance(obj, tables.GarbledTables):
+            out.append(TABLES)
+            self.sint(obj.start)
+            self.encode(obj.headers)
+            self.encode(obj.offsets_bytes())
+            self.encode(obj.rows)
+        else:
+            raise TypeError(f"Cannot encode {type(obj).__name__}")
+
+
+class _Decoder:
+    def __init__(self, data, frames):
+        self.data = data
+        self.frames = frames
+        self.pos = 0
+
+    def uint(self):
+        data, pos = self.data, self.pos
+        num = shift = 0
+        while True:
+            byte = data[pos]
+            pos += 1
+            num |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        self.pos = pos
+        return num
+
+    def sint(self):
+        num = self.uint()
+        return num >> 1 if not num & 1 else -((num + 1) >> 1)
+
+    def read(self, size):
+        self.pos += size
+        return self.data[self.pos - size:self.pos]
+
+    def decode(self):
+        tag = self.data[self.pos]
+        self.pos += 1
+        if tag == NONE:
+            return None
+        if tag == TRUE:
+            return True
+        if tag == FALSE:
+            return False
+        if tag == INT:
+            return self.sint()
+        if tag == BIG_INT:
+            return int.from_bytes(self.read(self.uint()), "big", signed=True)
+        if tag == FLOAT:
+            return struct.unpack("<d", self.read(8))[0]
+        if tag == STR:
+            return str(self.read(self.uint()), "utf-8")
+        if tag == BYTES:
+            return bytes(self.read(self.uint()))
+        if tag == FRAME:
+            return self.frames[self.uint()]
+        if tag in (LIST, TUPLE):
+            items = [self.decode() for _ in range(self.uint())]
+            return items if tag == LIST else tuple(items)
+        if tag == DICT:
+            return {self.decode(): self.decode() for _ in range(self.uint())}
+        if tag == TABLES:
+            return self.decode_tables()
+        raise ValueError(f"Unknown tag {tag}")
+
+    def decode_tables(self):
+        start = self.sint()
+        headers = bytes(self.decode())
+        offsets, rows = self.decode(), self.decode()
+        return tables.GarbledTables.from_buffers(start, headers, offsets,
+                                                 rows)
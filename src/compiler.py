@@ -0,0 +1,268 @@
+import collections.abc
+
+# Gate opcodes of a compiled circuit
+GATE_TYPES = ("NOT", "AND", "OR", "XOR", "NAND", "NOR", "XNOR")
+OPCODES = {gate_type: opcode for opcode, gate_type in enumerate(GATE_TYPES)}
+NO_WIRE = -1  # second input slot of a 1-input gate
+
+
+def levelize(gates):
+    """Group the gates by depth in the circuit.
+
+    A gate reading only input wires has depth 0, any other gate is one
+    level deeper than its deepest input, so the gates of a level never
+    read each other and can be processed in parallel.
+
+    Args:
+        gates: A list of dicts containing gate specs.
+
+    Returns:
+        The list of levels, each a list of gates sorted by ID.
+    """
+    outputs = {gate["id"] for gate in gates}
+    pending = {}  # gate ID -> number of inputs not computed yet
+    consumers = {}  # wire -> list of gates using it
+    level = []
+
+    for gate in gates:
+        inputs = [w for w in set(gate["in"]) if w in outputs]
+        pending[gate["id"]] = len(inputs)
+        for wire in inputs:
+            consumers.setdefault(wire, []).append(gate)
+        if not inputs:
+            level.append(gate)
+
+    levels = []
+    num_gates = 0
+    while level:
+        level.sort(key=lambda gate: gate["id"])
+        levels.append(level)
+        num_gates += len(level)
+        next_level = []
+        for gate in level:
+            for consumer in consumers.get(gate["id"], []):
+                pending[consumer["id"]] -= 1
+                if pending[consumer["id"]] == 0:
+                    next_level.append(consumer)
+        level = next_level
+
+    if num_gates != len(gates):
+        raise ValueError("Circuit contains a cycle")
+    return levels
+
+
+def topological_order(gates):
+    """Return the gates sorted so that each gate comes after its inputs.
+
+    Gates are sorted by level (see levelize), then by ID.
+
+    Args:
+        gates: A list of dicts containing gate specs.
+
+    Returns:
+        The list of gates in evaluation order.
+    """
+    return [gate for level in levelize(gates) for gate in level]
+
+
+class GateList(collections.abc.Sequence):
+    """Read-only list of gate specs, made on access from arrays of gate
+    IDs, opcodes and input wires (e.g. mapped from a cache file).
+
+    Args:
+        ids: The array of gate IDs.
+        opcodes: The array of gate opcodes.
+        in_a: The array of the first input wires.
+        in_b: The array of the second input wires (NO_WIRE for 1-input
+            gates).
+    """
+    def __init__(self, ids, opcodes, in_a, in_b):
+        self.ids = ids
+        self.opcodes = opcodes
+        self.in_a = in_a
+        self.in_b = in_b
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return _gate_spec(int(self.ids[index]), int(self.opcodes[index]),
+                          int(self.in_a[index]), int(self.in_b[index]))
+
+    def __iter__(self):
+        for gate in zip(self.ids.tolist(), self.opcodes.tolist(),
+                        self.in_a.tolist(), self.in_b.tolist()):
+            yield _gate_spec(*gate)
+
+
+def _gate_spec(gate_id, opcode, in_a, in_b):
+    return {"id": gate_id, "type": GATE_TYPES[opcode],
+            "in": [in_a] if in_b == NO_WIRE else [in_a, in_b]}
+
+
+class Program:
+    """A compiled circuit, ready for repeated evaluation.
+
+    Wires are mapped to dense slot indices. A slot is reused as soon as
+    the label it holds is not needed anymore, so that evaluation only
+    keeps alive the labels of wires still to be read and of the outputs.
+
+    Attributes:
+        id: The circuit ID.
+        alice: The list of Alice's wires.
+        bob: The list of Bob's wires.
+        out: The list of output wires.
+        gates: The gate specs in evaluation order.
+        ops: A list of (opcode, gate ID, slot_a, slot_b, slot_out) tuples,
+            one per gate in evaluation order.
+        levels: A list of (start, stop) ranges of ops, one per level of
+            the circuit (see levelize).
+        input_slots: A list of (wire, slot) pairs for Alice's and Bob's
+            wires.
+        output_slots: A list of (wire, slot) pairs for the output wires.
+        num_slots: The number of slots needed to evaluate the circuit.
+    """
+    def __init__(self, circuit):
+        self.id = circuit["id"]
+        self.alice = circuit.get("alice", [])
+        self.bob = circuit.get("bob", [])
+        self.out = circuit["out"]
+        levels = levelize(circuit["gates"])
+        self.gates = [gate for level in levels for gate in level]
+        self.levels = []
+        start = 0
+        for level in levels:
+            self.levels.append((start, start + len(level)))
+            start += len(level)
+        self.ops = []
+        self.input_slots = []
+        self.output_slots = []
+        self.num_slots = 0
+
+        self._compile()
+
+    def _compile(self):
+        """Assign slots to wires and build the list of operations."""
+        pinned = set(self.out)  # output wires are never freed
+        last_use = {}  # wire -> index of the last gate reading it
+        for index, gate in enumerate(self.gates):
+            for wire in gate["in"]:
+                last_use[wire] = index
+
+        slots = {}  # wire -> slot currently holding its label
+        free_slots = []
+
+        def allocate(wire):
+            slots[wire] = free_slots.pop() if free_slots else self._new_slot()
+            return slots[wire]
+
+        def release(wire):
+            if wire not in pinned:
+                free_slots.append(slots.pop(wire))
+
+        for wire in self.alice + self.bob:
+            self.input_slots.append((wire, allocate(wire)))
+        for wire in self.alice + self.bob:
+            if wire not in last_use:
+                release(wire)
+
+        for index, gate in enumerate(self.gates):
+            inputs = gate["in"]
+            missing = [w for w in inputs if w not in slots]
+            if missing:
+                raise ValueError(f"Gate {gate['id']} reads undefined "
+                                 f"wires {missing}")
+            slot_a = slots[inputs[0]]
+            slot_b = slots[inputs[1]] if len(inputs) > 1 else NO_WIRE
+            # Inputs are read before the output is written, so the output
+            # may reuse the slot of an input read for the last time
+            for wire in set(inputs):
+                if last_use[wire] == index:
+                    release(wire)
+            slot_out = allocate(gate["id"])
+            if gate["id"] not in last_use:
+                release(gate["id"])
+            self.ops.append((OPCODES[gate["type"]], gate["id"], slot_a,
+                             slot_b, slot_out))
+
+        for wire in self.out:
+            if wire not in slots:
+                raise ValueError(f"Output wire {wire} is never computed")
+            self.output_slots.append((wire, slots[wire]))
+
+    @classmethod
+    def from_arrays(cls, circuit_id, alice, bob, out, gates, slots,
+                    level_stops, input_slots, output_slots, num_slots):
+        """Create a Program from its compiled arrays, as stored by cache.
+
+        Args:
+            circuit_id: The circuit ID.
+            alice: The list of Alice's wires.
+            bob: The list of Bob's wires.
+            out: The list of output wires.
+            gates: The GateList of the gates, in evaluation order.
+            slots: An array of (slot_a, slot_b, slot_out) rows, one per
+                gate.
+            level_stops: The array of the op index ending each level.
+            input_slots: The array of the slots of Alice's and Bob's wires.
+            output_slots: The array of the slots of the output wires.
+            num_slots: The number of slots.
+        """
+        program = cls.__new__(cls)
+        program.id = circuit_id
+        program.alice = alice
+        program.bob = bob
+        program.out = out
+        program.gates = gates
+        stops = level_stops.tolist()
+        program.levels = list(zip([0] + stops[:-1], stops))
+        program.ops = list(zip(gates.opcodes.tolist(), gates.ids.tolist(),
+                               *slots.T.tolist()))
+        program.input_slots = list(zip(alice + bob, input_slots.tolist()))
+        program.output_slots = list(zip(out, output_slots.tolist()))
+        program.num_slots = num_slots
+        return program
+
+    def spec(self):
+        """Return the circuit spec of the program, as a dict."""
+        return {
+            "id": self.id,
+            "alice": self.alice,
+            "bob": self.bob,
+            "out": self.out,
+            "gates": list(self.gates),
+        }
+
+    def _new_slot(self):
+        self.num_slots += 1
+        return self.num_slots - 1
+
+
+def compile_circuit(circuit):
+    """Compile a circuit spec, or return it as is if already compiled.
+
+    Args:
+        circuit: A dict containing circuit spec, or a Program.
+
+    Returns:
+        The compiled Program.
+    """
+    if isinstance(circuit, Program):
+        return circuit
+    return Program(circuit)
+
+
+def circuit_spec(circuit):
+    """Return the spec of a circuit, as is if not compiled.
+
+    Args:
+        circuit: A dict containing circuit spec, or a Program.
+
+    Returns:
+        The dict containing circuit spec.
+    """
+    if isinstance(circuit, Program):
+        return circuit.spec()
+    return circuit
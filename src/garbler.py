@@ -1,29 +1,151 @@
 import logging
+import time
 from abc import abstractmethod, ABC
+import cache
+import compiler
+import optimizer
+import pool
+import prg
+import simd
+import simulator
 import util
 import yao
 
 
+def garble_circuit(circuit, scheme=None, stream=False, executor=None):
+    """Garble a circuit and return its entry, as in YaoGarbler.circuits.
+
+    Args:
+        circuit: A dict containing circuit spec, or the compiled circuit.
+        scheme: Optional; a dict of garbling options passed to
+            yao.GarbledCircuit.
+        stream: Optional; only create the input keys, see YaoGarbler.
+        executor: Optional; a process pool garbling the wide levels of the
+            circuit in parallel.
+
+    Returns:
+        A dict with the circuit, its compiled program, the garbled circuit
+        and its tables, scheme, keys and p-bits.
+    """
+    program = compiler.compile_circuit(circuit)
+    garbled_circuit = yao.GarbledCircuit(program, **(scheme or {}),
+                                         garble=not stream, executor=executor)
+    pbits = garbled_circuit.get_pbits()
+    if stream:
+        logging.info(f"Keys of {program.id} generated, "
+                     f"gates garbled on the fly")
+    else:
+        logging.info(f"Garbled {program.id}: "
+                     f"{len(garbled_circuit.get_garbled_tables())} tables, "
+                     f"{garbled_circuit.get_table_size()} bytes")
+    return {
+        "circuit": compiler.circuit_spec(circuit),  # as sent to Bob
+        "program": program,
+        "garbled_circuit": garbled_circuit,
+        "garbled_tables": (None if stream else
+                           garbled_circuit.get_garbled_tables()),
+        "scheme": garbled_circuit.get_scheme(),
+        "keys": garbled_circuit.get_keys(),
+        "pbits": pbits,
+        "pbits_out": (None if stream else
+                      {w: pbits[w] for w in program.out}),
+    }
+
+
 class YaoGarbler(ABC):
-    """An abstract class for Yao garblers (e.g. Alice)."""
-    def __init__(self, circuits):
-        circuits = util.parse_json(circuits)
+    """An abstract class for Yao garblers (e.g. Alice).
+
+    Args:
+        circuits: the JSON file containing circuits, loaded through its
+            compiled file (see cache.load_circuits), or its content
+            (e.g. a circuit made by generator.generate)
+        scheme: Optional; a dict of garbling options passed to
+            yao.GarbledCircuit (e.g. {"cipher": "hash", "free_xor": True}).
+            A "seed" is derived into one seed per circuit (see
+            prg.derive_seed), and cannot be used with pools.
+        stream: Optional; if True, only the input keys are created here and
+            the circuits are garbled by chunks while they are sent, the
+            garbled tables and p-bits of outputs of the entries are then None.
+        pool_options: Optional; a dict of options of pool.GarbledPool
+            (depth, workers, refill_rate). If set, circuits are not garbled here but
+            taken from pools of instances garbled in the background, a fresh
+            instance for each run (see get_circuits).
+        executor: Optional; a process pool garbling the wide levels of the
+            circuits in parallel (see pool.new_executor).
+        optimize: Optional; optimize the circuits before garbling them
+            (see optimizer.optimize), False by default.
+        copies: Optional; replicate each circuit into this many independent
+            copies garbled as one circuit (see simd.replicate), 1 by default.
+    """
+    def __init__(self, circuits, scheme=None, stream=False, pool_options=None,
+                 executor=None, optimize=False, copies=1):
+        if isinstance(circuits, str):
+            circuits = cache.load_circuits(circuits)
+        if optimize:
+            free_xor = (scheme or {}).get("free_xor", False)
+            circuits = dict(circuits, circuits=[
+                optimizer.optimize(compiler.circuit_spec(circuit),
+                                   free_xor=free_xor)
+                for circuit in circuits["circuits"]
+            ])
+        if copies > 1:
+            circuits = dict(circuits, circuits=[
+                simd.replicate(circuit, copies)
+                for circuit in circuits["circuits"]
+            ])
         self.name = circuits["name"]
         self.circuits = []
+        self.pools = []
+        self.executor = None  # garbling the instances of the pools
+
+        seed = (scheme or {}).get("seed")
+        if pool_options:
+            if stream:
+                raise ValueError("Streamed circuits cannot be garbled in advance")
+            if seed is not None:
+                raise ValueError("Pooled instances need fresh labels, "
+                                 "not a fixed seed")
+            self.executor = pool.new_executor(pool_options.get("workers"))
+            self.pools = [
+                pool.GarbledPool(circuit, scheme=scheme, executor=self.executor,
+                                 **pool_options)
+                for circuit in circuits["circuits"]
+            ]
+        else:
+            self.circuits = [
+                garble_circuit(circuit, scheme=(
+                    scheme if seed is None else
+                    dict(scheme, seed=prg.derive_seed(seed, index))),
+                    stream=stream, executor=executor)
+                for index, circuit in enumerate(circuits["circuits"])
+            ]
+
+    def get_circuits(self):
+        """Return the entries of the circuits for a run of the protocol.
+
+        With pools, each call takes fresh instances out of the pools, so
+        that no garbled circuit is used twice.
+        """
+        if not self.pools:
+            return self.circuits
+        self.circuits = [circuit_pool.get() for circuit_pool in self.pools]
+        return self.circuits
 
-        for circuit in circuits["circuits"]:
-            garbled_circuit = yao.GarbledCircuit(circuit)
-            pbits = garbled_circuit.get_pbits()
-            entry = {
-                "circuit": circuit,
-                "garbled_circuit": garbled_circuit,
-                "garbled_tables": garbled_circuit.get_garbled_tables(),
-                "keys": garbled_circuit.get_keys(),
-                "pbits": pbits,
-                "pbits_out": {w: pbits[w]
-                              for w in circuit["out"]},
-            }
-            self.circuits.append(entry)
+    def report_pools(self):
+        """Log the hits and misses of the pools."""
+        for circuit_pool in self.pools:
+            stats = circuit_pool.stats()
+            logging.info(f"Pool of {circuit_pool.circuit.id}: "
+                         f"{stats['hits']} hits, {stats['misses']} misses, "
+                         f"{stats['ready']} ready, {stats['pending']} being garbled")
+
+    def close(self):
+        """Stop garbling instances in the background, cancelling pending
+        instances and joining the worker processes."""
+        for circuit_pool in self.pools:
+            circuit_pool.close()
+        if self.executor:
+            self.executor.shutdown(wait=True, cancel_futures=True)
 
     @abstractmethod
     def start(self):
@@ -37,16 +159,25 @@ class LocalTest(YaoGarbler):
 
     Args:
         circuits: the JSON file containing circuits
-        print_mode: Print a clear version of the garbled tables or
-            the circuit evaluation (the default).
+        print_mode: Print a clear version of the garbled tables,
+            the circuit evaluation (the default) or the circuit evaluation
+            in clear, without garbling ("local").
             <adjusted to new default>
+        scheme: Optional; a dict of garbling options for the circuits.
+        executor: Optional; a process pool garbling the circuits in
+            parallel.
+        optimize: Optional; optimize the circuits before garbling them.
     """
-    def __init__(self, circuits, print_mode="circuit"):
-        super().__init__(circuits)
+    def __init__(self, circuits, print_mode="circuit", scheme=None,
+                 executor=None, optimize=False):
+        super().__init__(circuits, scheme=scheme, executor=executor,
+                         optimize=optimize)
         self._print_mode = print_mode
         self.modes = {
             "circuit": self._print_evaluation,
             "table": self._print_tables,
+            "local": self._print_clear_evaluation,
+            "batch": self._print_evaluation,
             "none": self._print_evaluation
         }
         logging.info(f"Print mode: {print_mode}")
@@ -60,8 +191,13 @@ class LocalTest(YaoGarbler):
         """Print garbled tables."""
         entry["garbled_circuit"].print_garbled_tables()
 
+    def _print_clear_evaluation(self, entry):
+        """Print circuit evaluation computed in clear."""
+        simulator.print_truth_table(entry["program"])
+
     def _print_evaluation(self, entry):
-        """Print circuit evaluation."""
+        """Print circuit evaluation, checked against the evaluation in
+        clear."""
         circuit, pbits, keys = entry["circuit"], entry["pbits"], entry["keys"]
         garbled_tables = entry["garbled_tables"]
         outputs = circuit["out"]
@@ -71,14 +207,15 @@ class LocalTest(YaoGarbler):
         b_inputs = {}  # map from Bob's wires to (key, encr_bit) inputs
         pbits_out = {w: pbits[w] for w in outputs}  # p-bits of outputs
         N = len(a_wires) + len(b_wires)
+        combinations = util.input_combinations(len(a_wires), len(b_wires))
+        expected = simulator.truth_table(entry["program"]).tolist()
+        errors = 0  # number of garbled results differing from clear results
 
         print(f"======== {circuit['id']} ========")
+        start = time.perf_counter()
 
         # Generate all possible inputs for both Alice and Bob
-        for bits in [format(n, 'b').zfill(N) for n in range(2**N)]:
-            bits_a = [int(b) for b in bits[:len(a_wires)]]  # Alice's inputs
-            bits_b = [int(b) for b in bits[N - len(b_wires):]]  # Bob's inputs
-
+        for n, (bits_a, bits_b) in enumerate(combinations):
             # Map Alice's wires to (key, encr_bit)
             for i in range(len(a_wires)):
                 a_inputs[a_wires[i]] = (keys[a_wires[i]][bits_a[i]],
@@ -89,18 +226,25 @@ class LocalTest(YaoGarbler):
                 b_inputs[b_wires[i]] = (keys[b_wires[i]][bits_b[i]],
                                         pbits[b_wires[i]] ^ bits_b[i])
 
-            result = yao.evaluate(circuit, garbled_tables, pbits_out, a_inputs,
-                                  b_inputs)
+            result = yao.evaluate(entry["program"], garbled_tables, pbits_out,
+                                  a_inputs, b_inputs, **entry["scheme"])
+            if [result[w] for w in outputs] != expected[n]:
+                errors += 1
 
             # Format output
-            str_bits_a = ' '.join(bits[:len(a_wires)])
-            str_bits_b = ' '.join(bits[len(a_wires):])
+            str_bits_a = ' '.join(map(str, bits_a))
+            str_bits_b = ' '.join(map(str, bits_b))
             str_result = ' '.join([str(result[w]) for w in outputs])
 
             print(f"  Alice{a_wires} = {str_bits_a} "
                   f"Bob{b_wires} = {str_bits_b}  "
                   f"Outputs{outputs} = {str_result}")
 
+        logging.info(f"Evaluated {2**N} inputs in "
+                     f"{time.perf_counter() - start:.4f} s")
+        if errors:
+            logging.error(f"{errors} garbled evaluations of {circuit['id']} "
+                          f"differ from the evaluation in clear")
         print()
 
     @property
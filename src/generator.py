@@ -0,0 +1,192 @@
+"""Generator of n-bit circuits, optimized for garbling.
+
+The circuits use as few AND (or OR) gates as possible, all other gates
+being XOR gates, which need no garbled table with Free-XOR. An n-bit
+circuit has n AND gates (addition), n AND and n - 1 OR gates (comparison)
+or 2n AND gates (MAX and MIN), so that its garbling cost grows linearly
+with the bit size.
+
+As in the hand-written circuits, Alice's number is on wires 1 to n and
+Bob's on wires n+1 to 2n, most significant bit first, and the outputs are
+listed most significant bit first.
+
+The checks of the circuit transformations (optimizer.check, simd.check)
+run on the shipped circuits and on generated ones, see check_circuits.
+
+Example:
+    python generator.py max 32 > circuits/32bit_max.json
+"""
+import glob
+import json
+import os
+
+OPERATIONS = ("max", "min", "cmp", "add")
+# The shipped circuit files
+CIRCUIT_FILES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "circuits", "*.json")
+
+
+class _CircuitBuilder:
+    """Gates of a circuit being generated, with fresh wire IDs."""
+    def __init__(self, bit_size):
+        self.alice = list(range(1, bit_size + 1))
+        self.bob = list(range(bit_size + 1, 2 * bit_size + 1))
+        self.gates = []
+        self.next_id = 2 * bit_size + 1
+
+    def add(self, gate_type, *inputs):
+        """Add a gate and return its output wire."""
+        self.gates.append({"id": self.next_id, "type": gate_type,
+                           "in": list(inputs)})
+        self.next_id += 1
+        return self.next_id - 1
+
+    def greater_than(self):
+        """Add a comparator of Alice's and Bob's numbers, one AND gate per
+        bit, and return the wire set when Alice's number is greater.
+
+        The carry c of the bits below i is updated to
+        a_i XOR ((a_i XOR c) AND (b_i XOR c)), the bits of the numbers being
+        processed from the least significant one.
+        """
+        a, b = self.alice[::-1], self.bob[::-1]  # least significant first
+        # no carry yet: a_0 AND NOT b_0
+        carry = self.add("XOR", a[0], self.add("AND", a[0], b[0]))
+        for a_i, b_i in zip(a[1:], b[1:]):
+            both = self.add("AND", self.add("XOR", a_i, carry),
+                            self.add("XOR", b_i, carry))
+            carry = self.add("XOR", a_i, both)
+        return carry
+
+    def select(self, choice, if_zero, if_one):
+        """Add multiplexers, one AND gate per bit, and return the wires of
+        'if_one' when 'choice' is set, else the wires of 'if_zero'."""
+        return [
+            self.add("XOR", w0, self.add("AND", choice,
+                                         self.add("XOR", w0, w1)))
+            for w0, w1 in zip(if_zero, if_one)
+        ]
+
+
+def max_circuit(bit_size):
+    """Return the n-bit MAX circuit, with 2n AND gates."""
+    builder = _CircuitBuilder(bit_size)
+    greater = builder.greater_than()
+    out = builder.select(greater, builder.bob, builder.alice)
+    return _circuit(builder, f"{bit_size}-bit MAX", out)
+
+
+def min_circuit(bit_size):
+    """Return the n-bit MIN circuit, with 2n AND gates."""
+    builder = _CircuitBuilder(bit_size)
+    greater = builder.greater_than()
+    out = builder.select(greater, builder.alice, builder.bob)
+    return _circuit(builder, f"{bit_size}-bit MIN", out)
+
+
+def cmp_circuit(bit_size):
+    """Return the n-bit comparison circuit, with n AND and n - 1 OR gates.
+
+    As in cmp.json, the outputs are set when Alice's number is lower than
+    Bob's, and when the numbers differ.
+    """
+    builder = _CircuitBuilder(bit_size)
+    # Alice's number is lower when Bob's is greater
+    builder.alice, builder.bob = builder.bob, builder.alice
+    lower = builder.greater_than()
+    builder.alice, builder.bob = builder.bob, builder.alice
+    # the numbers differ when one of their bits differs
+    differ = builder.add("XOR", builder.alice[0], builder.bob[0])
+    for a_i, b_i in zip(builder.alice[1:], builder.bob[1:]):
+        differ = builder.add("OR", differ, builder.add("XOR", a_i, b_i))
+    return _circuit(builder, f"{bit_size}-bit CMP", [lower, differ])
+
+
+def add_circuit(bit_size):
+    """Return the n-bit adder, with n AND gates and n + 1 output bits."""
+    builder = _CircuitBuilder(bit_size)
+    a, b = builder.alice[::-1], builder.bob[::-1]  # least significant first
+    out = [builder.add("XOR", a[0], b[0])]
+    carry = builder.add("AND", a[0], b[0])
+    for a_i, b_i in zip(a[1:], b[1:]):
+        a_carry = builder.add("XOR", a_i, carry)
+        out.append(builder.add("XOR", a_carry, b_i))
+        # the carry changes when both a_i and b_i differ from it
+        both = builder.add("AND", a_carry, builder.add("XOR", b_i, carry))
+        carry = builder.add("XOR", carry, both)
+    out.append(carry)
+    return _circuit(builder, f"{bit_size}-bit ADD", out[::-1])
+
+
+def _circuit(builder, circuit_id, out):
+    return {
+        "id": circuit_id,
+        "alice": builder.alice,
+        "bob": builder.bob,
+        "out": out,
+        "gates": builder.gates,
+    }
+
+
+GENERATORS = {
+    "max": max_circuit,
+    "min": min_circuit,
+    "cmp": cmp_circuit,
+    "add": add_circuit,
+}
+
+
+def generate(operation, bit_size):
+    """Generate a circuit file content.
+
+    Args:
+        operation: One of OPERATIONS.
+        bit_size: The size of the numbers in bits.
+
+    Returns:
+        A dict in the format of the JSON circuit files, holding one
+        circuit.
+    """
+    if operation not in GENERATORS:
+        raise ValueError(f"Unknown operation '{operation}', "
+                         f"must be in {list(OPERATIONS)}")
+    if bit_size < 1:
+        raise ValueError(f"Bit size must be at least 1, not {bit_size}")
+    return {
+        "name": f"{bit_size}bit_{operation}",
+        "circuits": [GENERATORS[operation](bit_size)],
+    }
+
+
+def check_circuits(paths=None, bit_sizes=range(1, 9)):
+    """Return the circuits checked by the circuit transformations.
+
+    Args:
+        paths: Optional; the JSON circuit files, the shipped ones
+            (CIRCUIT_FILES) by default.
+        bit_sizes: Optional; the bit sizes of the circuits generated for
+            each operation.
+
+    Returns:
+        A list of circuit specs: those of the files, then the generated
+        ones, operation after operation.
+    """
+    circuits = []
+    for path in sorted(glob.glob(CIRCUIT_FILES)) if paths is None else paths:
+        with open(path) as json_file:
+            circuits += json.load(json_file)["circuits"]
+    circuits += [generate(operation, bit_size)["circuits"][0]
+                 for operation in OPERATIONS for bit_size in bit_sizes]
+    return circuits
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate an n-bit circuit.")
+    parser.add_argument("operation", choices=OPERATIONS,
+                        help="the operation of the circuit")
+    parser.add_argument("bitsize", type=int,
+                        help="size of input numbers in bits")
+    args = parser.parse_args()
+    print(json.dumps(generate(args.operation, args.bitsize), indent=2))
@@ -0,0 +1,284 @@
+"""Streaming ingestion of the parties' data files with NumPy.
+
+Data files hold integers in one of FORMATS, chosen by the extension of
+the file (see file_format):
+
+* "text": numbers separated by any whitespace (spaces, tabs, newlines),
+* "int64": a raw array of little-endian 8-byte integers (".i64"),
+* "npy": a NumPy array file of integers (".npy"), read with mmap.
+
+Files are read by chunks of CHUNK_SIZE bytes, each chunk being parsed
+into an array at once, so that reducing a file to its local max or min
+(see reduce_file) needs memory for one chunk only, whatever the size of
+the file. Files of at least PARALLEL_MIN_SIZE bytes are split into
+ranges reduced by several processes. Text numbers too large for 8-byte
+integers are parsed as Python ints, in arrays of objects.
+
+Run as a script to reduce a file and report the throughput:
+
+    python ingest.py data/alice.in -b 16 [--min] [--workers n]
+"""
+import logging
+import os
+import re
+import time
+import warnings
+import numpy as np
+import metrics
+import pool
+
+FORMATS = ("text", "int64", "npy")
+EXTENSIONS = {".i64": "int64", ".npy": "npy"}  # other files are text
+CHUNK_SIZE = 1 << 24  # number of bytes read at once (16 MiB)
+# Files smaller than this are reduced in one process, since spawning
+# processes would take longer than reading them
+PARALLEL_MIN_SIZE = 1 << 28
+OPERATIONS = ("max", "min")
+INT64_SIZE = 8
+_INT64 = np.iinfo(np.int64)
+WHITESPACE = b" \t\n\r\v\f"
+_SPACE = re.compile(rb"\s")
+
+
+def file_format(path):
+    """Return the format of a data file, from its extension."""
+    return EXTENSIONS.get(os.path.splitext(path)[1], "text")
+
+
+def parse_text(data):
+    """Parse whitespace-separated integers.
+
+    Args:
+        data: A bytes-like object holding whole numbers only.
+
+    Returns:
+        An array of 8-byte integers, or of Python ints if some numbers
+        are out of the range of 8-byte integers.
+
+    Raises:
+        ValueError: if the data holds something else than integers.
+    """
+    if not data.strip():
+        return np.empty(0, dtype=np.int64)
+    try:
+        with warnings.catch_warnings():
+            # data left unparsed is a warning of NumPy
+            warnings.simplefilter("error", DeprecationWarning)
+            values = np.fromstring(data, dtype=np.int64, sep=" ")
+    except (ValueError, DeprecationWarning):
+        raise ValueError("Data files must only hold integers") from None
+    # out of range numbers are clipped to the limits of int64
+    if values.size and (values.max() == _INT64.max
+                        or values.min() == _INT64.min):
+        values = np.array([int(num) for num in data.split()], dtype=object)
+    return values
+
+
+def clean(values, lim):
+    """Return the values of an array in range(lim), as utli_karol.cleanup."""
+    if values.dtype != object and lim > _INT64.max:
+        return values[values >= 0]
+    return values[(values >= 0) & (values < lim)]
+
+
+def _text_chunks(path, start, stop, chunk_size):
+    """Yield the arrays of the numbers starting in bytes start to stop of
+    a text file."""
+    with open(path, "rb") as file:
+        # a number cut by 'start' belongs to the previous range
+        skip = False
+        if start:
+            file.seek(start - 1)
+            skip = not file.read(1).isspace()
+        pos = start
+        rest = b""
+        while pos < stop:
+            data = file.read(min(chunk_size, stop - pos))
+            if not data:
+                break
+            pos += len(data)
+            if skip:
+                space = _SPACE.search(data)
+                if space is None:
+                    continue
+                data = data[space.start():]
+                skip = False
+            data = rest + data
+            # the last number of the chunk may go on in the next one
+            tail = max(data.rfind(space) for space in WHITESPACE) + 1
+            rest = data[tail:]
+            yield parse_text(data[:tail])
+        # the last number may end after 'stop'
+        while rest:
+            data = file.read(chunk_size)
+            space = _SPACE.search(data)
+            if space is None:
+                rest += data
+                if data:
+                    continue
+            else:
+                rest += data[:space.start()]
+            break
+        if rest:
+            yield parse_text(rest)
+
+
+def _array_chunks(array, start, stop, chunk_size):
+    """Yield the values start to stop of an array, by chunks."""
+    step = max(1, chunk_size // INT64_SIZE)
+    for pos in range(start, stop, step):
+        yield np.asarray(array[pos:min(pos + step, stop)], dtype=np.int64)
+
+
+def _load_array(path, fmt):
+    """Return the array of an "int64" or "npy" file, mapped in memory."""
+    if fmt == "npy":
+        return np.load(path, mmap_mode="r").reshape(-1)
+    if not os.path.getsize(path):
+        return np.empty(0, dtype="<i8")
+    return np.memmap(path, dtype="<i8", mode="r")
+
+
+def _size(path, fmt):
+    """Return the size of a file, in bytes for text and in values for
+    arrays."""
+    if fmt == "text":
+        return os.path.getsize(path)
+    return len(_load_array(path, fmt))
+
+
+def chunks(path, start=0, stop=None, chunk_size=CHUNK_SIZE):
+    """Yield the numbers of a data file, by arrays of about 'chunk_size'
+    bytes.
+
+    Args:
+        path: The path of the file.
+        start: Optional; the first byte of a text file, or the first value
+            of an array file, to read.
+        stop: Optional; the end of the range to read, the end of the file
+            by default.
+        chunk_size: Optional; the number of bytes read at once.
+    """
+    fmt = file_format(path)
+    if stop is None:
+        stop = _size(path, fmt)
+    if fmt == "text":
+        yield from _text_chunks(path, start, stop, chunk_size)
+    else:
+        yield from _array_chunks(_load_array(path, fmt), start, stop,
+                                 chunk_size)
+
+
+def read_values(path, chunk_size=CHUNK_SIZE):
+    """Return all numbers of a data file in one array.
+
+    The file is parsed by chunks, the array taking 8 bytes per number (or
+    a Python int for numbers out of the range of 8-byte integers).
+    """
+    start = time.perf_counter()
+    with metrics.timer("ingest"):
+        parts = list(chunks(path, chunk_size=chunk_size))
+        values = (np.concatenate(parts) if parts
+                  else np.empty(0, dtype=np.int64))
+    _report(path, len(values), time.perf_counter() - start)
+    return values
+
+
+def _reduce_range(path, start, stop, bit_size, operation, chunk_size):
+    """Return (extreme, number of values kept, number of values read) of a
+    range of a file, extreme being None if no value is kept."""
+    lim = 2 ** bit_size
+    extreme, kept, read = None, 0, 0
+    for values in chunks(path, start, stop, chunk_size):
+        read += len(values)
+        values = clean(values, lim)
+        if not len(values):
+            continue
+        kept += len(values)
+        value = int(values.max() if operation == "max" else values.min())
+        if extreme is None:
+            extreme = value
+        else:
+            extreme = (max if operation == "max" else min)(extreme, value)
+    return extreme, kept, read
+
+
+def reduce_file(path, bit_size, operation="max", workers=None,
+                chunk_size=CHUNK_SIZE):
+    """Reduce a data file to the max or min of its numbers of 'bit_size'
+    bits, in bounded memory.
+
+    Args:
+        path: The path of the file.
+        bit_size: The size of the numbers in bits, other numbers (e.g.
+            negative ones) are ignored.
+        operation: Optional; "max" (the default) or "min".
+        workers: Optional; the number of processes reading ranges of the
+            file. By default, files of at least PARALLEL_MIN_SIZE bytes are
+            read by one process per CPU, and smaller ones in this process.
+        chunk_size: Optional; the number of bytes read at once.
+
+    Returns:
+        A pair (max or min, number of values kept), the max or min being
+        None if the file holds no number of 'bit_size' bits.
+    """
+    if operation not in OPERATIONS:
+        raise ValueError(f"Unknown operation '{operation}', "
+                         f"must be in {list(OPERATIONS)}")
+    fmt = file_format(path)
+    size = _size(path, fmt)
+    if workers is None:
+        workers = (os.cpu_count() or 1
+                   if os.path.getsize(path) >= PARALLEL_MIN_SIZE else 1)
+    workers = max(1, min(workers, size))
+
+    start = time.perf_counter()
+    with metrics.timer("ingest"):
+        bounds = [size * i // workers for i in range(workers + 1)]
+        if workers == 1:
+            results = [_reduce_range(path, 0, size, bit_size, operation,
+                                     chunk_size)]
+        else:
+            with pool.new_executor(workers) as executor:
+                results = list(executor.map(
+                    _reduce_range, [path] * workers, bounds[:-1], bounds[1:],
+                    [bit_size] * workers, [operation] * workers,
+                    [chunk_size] * workers))
+    extremes = [extreme for extreme, _, _ in results if extreme is not None]
+    extreme = ((max if operation == "max" else min)(extremes)
+               if extremes else None)
+    _report(path, sum(read for _, _, read in results),
+            time.perf_counter() - start, workers)
+    return extreme, sum(kept for _, kept, _ in results)
+
+
+def _report(path, count, seconds, workers=1):
+    """Log the throughput of reading a file."""
+    megabytes = os.path.getsize(path) / 1e6
+    seconds = max(seconds, 1e-9)
+    metrics.count("values_read", count)
+    logging.info(f"Read {count} values from {path} ({megabytes:.1f} MB) in "
+                 f"{seconds:.3f}s by {workers} process(es): "
+                 f"{count / seconds:.0f} values/s, {megabytes / seconds:.1f} MB/s")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Reduce a data file to its local max or min.")
+    parser.add_argument("path", help="the data file (text, .i64 or .npy)")
+    parser.add_argument("-b", "--bitsize", type=int, default=16,
+                        help="the size of the numbers in bits (default 16)")
+    parser.add_argument("--min", action="store_true",
+                        help="compute the min instead of the max")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="the number of processes (default depends on "
+                             "the size of the file)")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="[%(levelname)s] %(message)s",
+                        level=logging.INFO)
+    value, kept = reduce_file(args.path, args.bitsize,
+                              "min" if args.min else "max", args.workers)
+    print(f"{'min' if args.min else 'max'} of {kept} values: {value}")
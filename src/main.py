@@ -1,8 +1,20 @@
 #!/usr/bin/env python3
+import asyncio
 import logging
+import sys
+import aio
+import ciphers
+import codec
+import generator
+import metrics
+import ot
+import pool
+import session
+import util
 from garbler import LocalTest
 from alice import Alice
 from bob import Bob
+from server import BobServer
 
 # File is kept as received, only cleaned up for convenience
 # Class YaoGarbler and LocalTest moved to file garbler.py (with no changes applied)
@@ -19,24 +31,113 @@ def main(
         print_mode=PRINTOUT,
         loglevel=logging.WARNING,
         filename="",
-        bitsize=4
+        bitsize=4,
+        cipher=ciphers.DEFAULT_CIPHER,
+        free_xor=False,
+        reduction=None,
+        ot_mode="wire",
+        group=util.DEFAULT_GROUP,
+        serializer="binary",
+        stream=False,
+        workers=None,
+        use_asyncio=False,
+        pool_depth=0,
+        refill_rate=None,
+        parallel=False,
+        operation=None,
+        optimize=False,
+        simd=False,
+        metrics_path=None,
+        metrics_format="json",
+        seed=None,
+        session_path=None
 ):
     logging.getLogger().setLevel(loglevel)
+    scheme = {"cipher": cipher, "free_xor": free_xor, "reduction": reduction}
+    if seed is not None:
+        # same keys and p-bits at each run, see prg.py
+        logging.warning("--seed makes the wire labels predictable, for tests only")
+        scheme["seed"] = seed
+    # garbling and evaluating the wide levels of the circuits in parallel
+    executor = pool.new_executor(workers) if parallel else None
+    if operation:
+        # a generated circuit of the size of the inputs
+        circuit_path = generator.generate(operation, int(bitsize))
+    # circuit files run one after the other, e.g. over one session of alice
+    circuit_paths = (list(circuit_path) if isinstance(circuit_path, (list, tuple))
+                     else [circuit_path])
+    if executor and (use_asyncio or party == "server"):
+        logging.warning("--parallel is ignored with --asyncio and by the server")
+    # metrics of the run, the server records one collector per session
+    collector = (metrics.Metrics(party)
+                 if metrics_path and party != "server" else None)
+    if collector and use_asyncio:
+        logging.warning("--metrics does not record runs with --asyncio")
 
     if party == "alice":
-        alice = Alice(circuit_path, oblivious_transfer=oblivious_transfer,
-                      print_mode=print_mode, filename=filename,
-                      bit_size=int(bitsize))
-        alice.start()
+        # options common to all queries of a session
+        alice_args = dict(oblivious_transfer=oblivious_transfer,
+                          print_mode=print_mode, scheme=scheme, ot_mode=ot_mode, group=group,
+                          serializer=serializer, stream=stream, optimize=optimize,
+                          simd=simd)
+        if pool_depth:
+            alice_args["pool_options"] = {"depth": pool_depth, "workers": workers,
+                                          "refill_rate": refill_rate}
+        if session_path or len(circuit_paths) > 1:
+            # many queries over one connection to bob, see session.py
+            if use_asyncio:
+                logging.warning("--asyncio is ignored by sessions of alice")
+            with metrics.session(collector):
+                alice_session = session.AliceSession(**alice_args, executor=executor,
+                                                     console=session_path != "-")
+                if session_path is None:
+                    alice_session.run(circuit_paths, filename, int(bitsize))
+                elif session_path == "-":
+                    alice_session.run_all(session.read_queries(
+                        sys.stdin, circuit_paths, filename, int(bitsize)))
+                else:
+                    with open(session_path) as file:
+                        alice_session.run_all(session.read_queries(
+                            file, circuit_paths, filename, int(bitsize)))
+            alice_session.close()
+        elif use_asyncio:
+            asyncio.run(aio.run_alice(circuit_paths[0], filename=filename,
+                                      bit_size=int(bitsize), **alice_args))
+        else:
+            with metrics.session(collector):
+                alice = Alice(circuit_paths[0], filename=filename, bit_size=int(bitsize),
+                              **alice_args, executor=executor)
+                alice.start()
+            alice.close()
     elif party == "bob":
-        bob = Bob(oblivious_transfer=oblivious_transfer,
-                  filename=filename)
-        bob.listen()
+        bob_args = dict(oblivious_transfer=oblivious_transfer,
+                        filename=filename, serializer=serializer)
+        if use_asyncio:
+            try:
+                asyncio.run(aio.run_bob(**bob_args))
+            except KeyboardInterrupt:
+                pass
+        else:
+            bob = Bob(**bob_args, executor=executor)
+            with metrics.session(collector):
+                bob.listen()
+    elif party == "server":
+        server = BobServer(oblivious_transfer=oblivious_transfer,
+                           filename=filename, serializer=serializer, workers=workers,
+                           metrics_path=metrics_path)
+        server.listen()
     elif party == "local":
-        local = LocalTest(circuit_path, print_mode=print_mode)
-        local.start()
+        with metrics.session(collector):
+            for path in circuit_paths:
+                local = LocalTest(path, print_mode=print_mode, scheme=scheme,
+                                  executor=executor, optimize=optimize)
+                local.start()
     else:
         logging.error(f"Unknown party '{party}'")
+    if executor:
+        executor.shutdown()
+    if collector:
+        collector.dump(metrics_path, metrics_format)
 
 
 if __name__ == '__main__':
@@ -54,14 +155,16 @@ if __name__ == '__main__':
 
         parser = argparse.ArgumentParser(description="Run Yao protocol.")
         parser.add_argument("party",
-                            choices=["alice", "bob", "local"],
+                            choices=["alice", "bob", "server", "local"],
                             help="the yao party to run")
         parser.add_argument(
             "-c",
             "--circuit",
             metavar="circuit.json",
+            nargs="+",
             default="src/circuits/4bit_max.json",
-            help=("the JSON circuit file for alice and local tests"),
+            help=("the JSON circuit files for alice and local tests, several files "
+                  "being run by alice over one session"),
         )
         parser.add_argument("--no-oblivious-transfer",
                             action="store_true",
@@ -69,7 +172,7 @@ if __name__ == '__main__':
         parser.add_argument(
             "-m",
             metavar="mode",
-            choices=["circuit", "table", "none"],
+            choices=["circuit", "table", "local", "batch", "none"],
             default=PRINTOUT,
             help=f"the print mode for local tests (default '{PRINTOUT}')")
         parser.add_argument("-l",
@@ -87,11 +190,110 @@ if __name__ == '__main__':
                             "--bitsize",
                             default=4,
                             help="size of input numbers in bits (default is 4)")
+        parser.add_argument("--cipher",
+                            choices=ciphers.CIPHERS.keys(),
+                            default=ciphers.DEFAULT_CIPHER,
+                            help=f"the garbling cipher for alice and local tests "
+                                 f"(default '{ciphers.DEFAULT_CIPHER}')")
+        parser.add_argument("--free-xor",
+                            action="store_true",
+                            help="garble XOR and XNOR gates with Free-XOR (no garbled table)")
+        parser.add_argument("--reduction",
+                            choices=["grr3", "halfgates"],
+                            default=None,
+                            help="compress garbled tables with row reduction or half-gates "
+                                 "(half-gates need --free-xor)")
+        parser.add_argument("--ot",
+                            choices=ot.OT_MODES,
+                            default="wire",
+                            help="the oblivious transfer mode for alice: one OT per Bob's wire "
+                                 "(default 'wire'), all wires in parallel or OT extension")
+        parser.add_argument("--group",
+                            type=int,
+                            choices=util.GROUPS.keys(),
+                            default=util.DEFAULT_GROUP,
+                            help=f"the ID of the prime group used by OTs for alice "
+                                 f"(default {util.DEFAULT_GROUP}, 14 is the RFC 3526 2048-bit group)")
+        parser.add_argument("--serializer",
+                            choices=codec.FORMATS.keys(),
+                            default="binary",
+                            help="the encoding of the messages between alice and bob "
+                                 "(default 'binary', 'pickle' for the legacy encoding)")
+        parser.add_argument("--stream",
+                            action="store_true",
+                            help="garble and send the circuit by chunks for alice, "
+                                 "bob evaluating each chunk on arrival (print mode 'none' or 'local')")
+        parser.add_argument("--workers",
+                            type=int,
+                            default=None,
+                            help="the number of worker processes of the server, or of the "
+                                 "garbling pool of alice (default is the number of CPUs)")
+        parser.add_argument("--asyncio",
+                            action="store_true",
+                            help="run alice or bob on an asyncio event loop (see aio.py)")
+        parser.add_argument("--pool",
+                            type=int,
+                            default=0,
+                            metavar="depth",
+                            help="for alice, number of garbled instances of each circuit "
+                                 "kept ready by background processes (default 0, no pool)")
+        parser.add_argument("--refill-rate",
+                            type=float,
+                            default=None,
+                            help="the maximum number of instances garbled per second "
+                                 "by each pool (default is no limit)")
+        parser.add_argument("--generate",
+                            choices=generator.OPERATIONS,
+                            default=None,
+                            metavar="operation",
+                            help=f"use a generated circuit of --bitsize bits instead of --circuit, "
+                                 f"one of {list(generator.OPERATIONS)} (see generator.py)")
+        parser.add_argument("--optimize",
+                            action="store_true",
+                            help="optimize the circuits before garbling them, for alice and "
+                                 "local tests (see optimizer.py)")
+        parser.add_argument("--parallel",
+                            action="store_true",
+                            help="garble (alice, local) or evaluate (bob) the wide levels of "
+                                 "the circuits in parallel by --workers processes")
+        parser.add_argument("--simd",
+                            action="store_true",
+                            help="for alice, answer one query per number of the data with one "
+                                 "replicated circuit, instead of the max of the data (print mode 'none')")
+        parser.add_argument("--metrics",
+                            metavar="path",
+                            default=None,
+                            help="write the durations of the phases and the message counters of "
+                                 "the run to a file (one JSON line per session for the server)")
+        parser.add_argument("--metrics-format",
+                            choices=["json", "prometheus"],
+                            default="json",
+                            help="the format of the --metrics file (default 'json')")
+        parser.add_argument("--session",
+                            metavar="path",
+                            default=None,
+                            help="for alice, run the queries of a file ('-' for stdin) over one "
+                                 "connection, one line of options -c, -f and -b per query")
+        parser.add_argument("--seed",
+                            default=None,
+                            help="for alice and local tests, derive the wire labels from this seed "
+                                 "instead of a fresh random one, for reproducible garbling (insecure)")
 
         main(party=parser.parse_args().party, circuit_path=parser.parse_args().circuit,
              oblivious_transfer=not parser.parse_args().no_oblivious_transfer, print_mode=parser.parse_args().m,
              loglevel=loglevels[parser.parse_args().loglevel], filename=parser.parse_args().filename,
-             bitsize=parser.parse_args().bitsize)
+             bitsize=parser.parse_args().bitsize, cipher=parser.parse_args().cipher,
+             free_xor=parser.parse_args().free_xor, reduction=parser.parse_args().reduction,
+             ot_mode=parser.parse_args().ot, group=parser.parse_args().group,
+             serializer=parser.parse_args().serializer, stream=parser.parse_args().stream,
+             workers=parser.parse_args().workers, use_asyncio=parser.parse_args().asyncio,
+             pool_depth=parser.parse_args().pool, refill_rate=parser.parse_args().refill_rate,
+             parallel=parser.parse_args().parallel, operation=parser.parse_args().generate,
+             optimize=parser.parse_args().optimize, simd=parser.parse_args().simd,
+             metrics_path=parser.parse_args().metrics,
+             metrics_format=parser.parse_args().metrics_format,
+             seed=parser.parse_args().seed,
+             session_path=parser.parse_args().session)
 
 
     init()
@@ -0,0 +1,200 @@
+"""Instrumentation of protocol runs: phase durations and message counters.
+
+A Metrics collector records the runs of a session (e.g. a Bob or an
+Alice) once activated with session(). The instrumented code calls the
+module functions (timer, observe, count, message), which record into the
+collector of the current context and do nothing when there is none, so
+that their overhead is a context variable lookup when metrics are
+disabled.
+
+Phases (see timer) are:
+
+* "garble": garbling of the gates, by level or by chunk,
+* "serialize" and "deserialize": encoding and decoding of messages,
+* "transfer": waiting for a message of the other party,
+* "oblivious_transfer": transfer of all Bob's keys of a run, by OT mode,
+* "ot": one public-key OT, as sender or receiver,
+* "evaluate": evaluation of the gates,
+* "ingest": reading of a party's data file (see ingest.py),
+* "query": one run of a circuit file in a session of Alice (see
+  session.py).
+
+Counters are the messages and bytes per direction, the round trips (a
+received message following a sent one), the OTs per mode, the gates
+evaluated and decryptions per gate type, the values read from data
+files and the queries of a session.
+
+Collectors are not shared between threads, and code running in other
+processes (e.g. parallel levels, see pool.py) or on an asyncio event loop
+(see aio.py) is not recorded.
+
+Example:
+    collector = metrics.Metrics("alice")
+    with metrics.session(collector):
+        alice.start()
+    print(collector.to_prometheus())
+"""
+import contextlib
+import contextvars
+import json
+import time
+
+PREFIX = "yao_"  # prefix of the Prometheus metric names
+_current = contextvars.ContextVar("metrics", default=None)
+
+
+class Metrics:
+    """Durations and counters recorded during a session.
+
+    Args:
+        name: Optional; the name of the session, e.g. the party.
+    """
+    def __init__(self, name=""):
+        self.name = name
+        self.timers = {}  # (phase, labels) -> [count, total seconds]
+        self.counters = {}  # (name, labels) -> value
+        self._last_direction = None
+
+    def observe(self, phase, seconds, **labels):
+        """Record a duration of a phase."""
+        timer = self.timers.setdefault((phase, _labels(labels)), [0, 0.0])
+        timer[0] += 1
+        timer[1] += seconds
+
+    def count(self, name, value=1, **labels):
+        """Add a value to a counter."""
+        key = (name, _labels(labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def message(self, direction, frames):
+        """Count a message, "sent" or "received", of the given frames."""
+        self.count("messages", direction=direction)
+        self.count("bytes", sum(len(frame) for frame in frames),
+                   direction=direction)
+        if direction == "received" and self._last_direction == "sent":
+            self.count("round_trips")
+        self._last_direction = direction
+
+    def summary(self):
+        """Return the recorded metrics as a dict of JSON values."""
+        return {
+            "session": self.name,
+            "timers": [
+                {"phase": phase, "labels": dict(labels), "count": count,
+                 "seconds": seconds}
+                for (phase, labels), (count, seconds) in self.timers.items()
+            ],
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in self.counters.items()
+            ],
+        }
+
+    def to_json(self):
+        """Return the recorded metrics as a JSON document."""
+        return json.dumps(self.summary(), indent=2)
+
+    def to_prometheus(self):
+        """Return the recorded metrics in the Prometheus text format.
+
+        Durations are the sum and count of a summary per phase, counters
+        are totals, both labelled with the session.
+        """
+        session = (("session", self.name), ) if self.name else ()
+        lines = [f"# TYPE {PREFIX}phase_seconds summary"]
+        for (phase, labels), (count, seconds) in self.timers.items():
+            labels = _format_labels(session + (("phase", phase), ) + labels)
+            lines.append(f"{PREFIX}phase_seconds_sum{labels} {seconds:.9f}")
+            lines.append(f"{PREFIX}phase_seconds_count{labels} {count}")
+        for name in dict.fromkeys(name for name, _ in self.counters):
+            lines.append(f"# TYPE {PREFIX}{name}_total counter")
+            lines.extend(
+                f"{PREFIX}{name}_total{_format_labels(session + labels)} {value}"
+                for (other, labels), value in self.counters.items()
+                if other == name)
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path, metrics_format="json"):
+        """Write the recorded metrics to a file, as "json" or
+        "prometheus"."""
+        with open(path, "w") as file:
+            file.write(self.to_json() + "\n" if metrics_format == "json"
+                       else self.to_prometheus())
+
+
+class _Timer:
+    """Context manager recording the duration of a phase."""
+    __slots__ = ("metrics", "phase", "labels", "start")
+
+    def __init__(self, metrics, phase, labels):
+        self.metrics = metrics
+        self.phase = phase
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.phase, time.perf_counter() - self.start,
+                             **self.labels)
+
+
+_NULL_TIMER = contextlib.nullcontext()
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+@contextlib.contextmanager
+def session(metrics):
+    """Record into a collector within the block, if it is not None."""
+    if metrics is None:
+        yield None
+        return
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+def enabled():
+    """Return True if a collector records the current context."""
+    return _current.get() is not None
+
+
+def timer(phase, **labels):
+    """Return a context manager recording the duration of a phase."""
+    metrics = _current.get()
+    if metrics is None:
+        return _NULL_TIMER
+    return _Timer(metrics, phase, labels)
+
+
+def observe(phase, seconds, **labels):
+    """Record a duration of a phase."""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.observe(phase, seconds, **labels)
+
+
+def count(name, value=1, **labels):
+    """Add a value to a counter."""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.count(name, value, **labels)
+
+
+def message(direction, frames):
+    """Count a message, "sent" or "received", of the given frames."""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.message(direction, frames)
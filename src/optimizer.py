@@ -0,0 +1,396 @@
+"""Optimization of circuits before garbling.
+
+The gates of a circuit are rewritten as AND, OR and XOR nodes over
+literals, a literal being a node and whether it is inverted, so that:
+
+* NOT gates disappear, inversions being absorbed into the gates reading
+  them (XNOR, NAND and NOR gates, or De Morgan's laws),
+* constants (e.g. x XOR x, x AND NOT x) are folded,
+* structurally identical gates are merged,
+* gates not reaching an output are dropped.
+
+A NOT gate is only left where an AND or OR gate reads a single inverted
+input, and NOT gates need no garbled table since they are garbled by
+relabelling their input keys (see yao.GarbledCircuit), with or without
+Free-XOR. Output wires keep their IDs, so that the optimized circuit is a
+drop-in replacement of the original one.
+
+Run as a script to optimize the circuits of a file, or to check the
+optimization of all shipped and generated circuits exhaustively (see
+check), e.g. with "make check":
+
+    python optimizer.py circuits/4bit_max.json --free-xor
+    python optimizer.py --check
+"""
+import logging
+import compiler
+import generator
+import simulator
+import util
+
+AND, OR, XOR, INPUT, CONST = "AND", "OR", "XOR", "INPUT", "CONST"
+# Gate types as (node operation, output inverted)
+NODES = {
+    "AND": (AND, 0),
+    "NAND": (AND, 1),
+    "OR": (OR, 0),
+    "NOR": (OR, 1),
+    "XOR": (XOR, 0),
+    "XNOR": (XOR, 1),
+}
+# Gate types of (node operation, output inverted)
+GATES = {node: gate_type for gate_type, node in NODES.items()}
+DUALS = {AND: OR, OR: AND}  # NOT a AND NOT b = NOT (a OR b), and conversely
+FREE_XOR_GATES = ("XOR", "XNOR")
+MAX_CHECK_INPUTS = 20  # circuits checked exhaustively by equivalent()
+# Circuits of check(): generated circuits of these bit sizes along with
+# the shipped ones (see generator.check_circuits), and a circuit listing
+# an output wire twice
+CHECK_BIT_SIZES = range(1, 9)
+DUPLICATE_OUTPUT_CIRCUIT = {
+    "id": "duplicate output",
+    "alice": [2, 3],
+    "bob": [],
+    "out": [4, 7, 4],
+    "gates": [
+        {"id": 4, "type": "OR", "in": [2, 2]},
+        {"id": 7, "type": "OR", "in": [4, 3]},
+        {"id": 8, "type": "AND", "in": [4, 7]},
+    ],
+}
+
+
+def optimize(circuit, free_xor=False):
+    """Optimize a circuit, keeping its inputs, outputs and results.
+
+    Args:
+        circuit: A dict containing circuit spec.
+        free_xor: Optional; True if the circuit is garbled with Free-XOR,
+            then XOR and XNOR gates need no garbled table.
+
+    Returns:
+        A new dict containing the optimized circuit spec, or the circuit
+        itself if the optimization needs more garbled tables.
+    """
+    optimized = _Optimizer(circuit).emit()
+    before, after = count_gates(circuit, free_xor), count_gates(optimized, free_xor)
+    if after[::-1] > before[::-1]:
+        logging.info(f"Optimization of {circuit['id']} does not pay off, "
+                     f"kept as is")
+        return circuit
+    logging.info(f"Optimized {circuit['id']}: {before[0]} -> {after[0]} gates, "
+                 f"{before[1]} -> {after[1]} garbled tables")
+    return optimized
+
+
+def count_gates(circuit, free_xor=False):
+    """Return the number of gates of a circuit, and of gates needing a
+    garbled table (NOT gates being relabelled)."""
+    gates = circuit["gates"]
+    free = ("NOT", ) + (FREE_XOR_GATES if free_xor else ())
+    return len(gates), sum(g["type"] not in free for g in gates)
+
+
+def equivalent(circuit, optimized):
+    """Return True if two circuits give the same outputs for all inputs.
+
+    Args:
+        circuit: A dict containing circuit spec.
+        optimized: A dict containing circuit spec, with the same inputs.
+
+    Raises:
+        ValueError: If the circuits have more than MAX_CHECK_INPUTS inputs.
+    """
+    program = compiler.compile_circuit(circuit)
+    other = compiler.compile_circuit(optimized)
+    num_inputs = len(program.alice) + len(program.bob)
+    if num_inputs > MAX_CHECK_INPUTS:
+        raise ValueError(f"Too many inputs to check {circuit['id']}: "
+                         f"{num_inputs} > {MAX_CHECK_INPUTS}")
+    total = 2**num_inputs
+    for start in range(0, total, simulator.CHUNK_SIZE):
+        stop = min(start + simulator.CHUNK_SIZE, total)
+        if not (simulator.truth_table(program, start, stop) ==
+                simulator.truth_table(other, start, stop)).all():
+            return False
+    return True
+
+
+def check(paths=None, bit_sizes=CHECK_BIT_SIZES):
+    """Check that optimize keeps the results of circuits, exhaustively.
+
+    The circuits of the files, the circuits made by generator.generate
+    for each operation and bit size and DUPLICATE_OUTPUT_CIRCUIT are
+    optimized with and without Free-XOR, and compared with their original
+    by equivalent.
+
+    Args:
+        paths: Optional; the JSON circuit files, the shipped circuits
+            (generator.CIRCUIT_FILES) by default.
+        bit_sizes: Optional; the bit sizes of the generated circuits.
+
+    Returns:
+        A list of (circuit ID, free_xor) pairs, one per optimized circuit
+        differing from its original, empty if all circuits pass.
+    """
+    circuits = generator.check_circuits(paths, bit_sizes)
+    circuits.append(DUPLICATE_OUTPUT_CIRCUIT)
+    failures = []
+    for circuit in circuits:
+        for free_xor in (False, True):
+            if not equivalent(circuit, optimize(circuit, free_xor)):
+                logging.error(f"Optimized {circuit['id']} (Free-XOR: "
+                              f"{free_xor}) differs from the original")
+                failures.append((circuit["id"], free_xor))
+    logging.info(f"Checked the optimization of {len(circuits)} circuits")
+    return failures
+
+
+class _Optimizer:
+    """Rewriting of a circuit into nodes, then back into gates.
+
+    Nodes are (operation, literal a, literal b) tuples, literals being
+    (node index, inverted) pairs. Node 0 is the constant 0.
+    """
+    def __init__(self, circuit):
+        self.circuit = circuit
+        self.nodes = [(CONST, None, None)]
+        self.origins = [None]  # ID of the gate which created each node
+        self.index = {}  # node -> its index, to merge identical gates
+        self.literals = {}  # wire -> literal
+        self.preferred = {}  # node -> inversion of its literal in the circuit
+
+        inputs = circuit.get("alice", []) + circuit.get("bob", [])
+        if not inputs:
+            raise ValueError(f"Circuit {circuit['id']} has no inputs")
+        for wire in inputs:
+            self.literals[wire] = (self._add((INPUT, wire, None), wire), 0)
+        for gate in compiler.topological_order(circuit["gates"]):
+            inputs = [self.literals[w] for w in gate["in"]]
+            if gate["type"] == "NOT":
+                node, inverted = inputs[0]
+                self.literals[gate["id"]] = (node, inverted ^ 1)
+                continue
+            operation, inverted = NODES[gate["type"]]
+            node, node_inverted = self._node(operation, *inputs, gate["id"])
+            self.literals[gate["id"]] = (node, node_inverted ^ inverted)
+            if self.origins[node] == gate["id"]:
+                self.preferred[node] = node_inverted ^ inverted
+
+    def _add(self, node, origin):
+        if node not in self.index:
+            self.index[node] = len(self.nodes)
+            self.nodes.append(node)
+            self.origins.append(origin)
+        return self.index[node]
+
+    def _node(self, operation, a, b, origin):
+        """Return the literal of 'a operation b', folding constants."""
+        if operation == XOR:
+            inverted = a[1] ^ b[1]
+            a, b = (a[0], 0), (b[0], 0)
+            if a[0] == 0:
+                return b[0], inverted
+            if b[0] == 0:
+                return a[0], inverted
+            if a == b:
+                return 0, inverted
+            return self._add((XOR, *sorted((a, b))), origin), inverted
+
+        # x AND 0 = 0 and x OR 1 = 1, the absorbing constants
+        absorbing = 0 if operation == AND else 1
+        if a[0] == 0:
+            return a if a[1] == absorbing else b
+        if b[0] == 0:
+            return b if b[1] == absorbing else a
+        if a == b:
+            return a
+        if a[0] == b[0]:  # x AND NOT x = 0, x OR NOT x = 1
+            return 0, absorbing
+        if a[1] and b[1]:
+            return self._add((DUALS[operation], (a[0], 0), (b[0], 0)),
+                             origin), 1
+        return self._add((operation, *sorted((a, b))), origin), 0
+
+    def emit(self):
+        """Return the circuit spec of the live nodes."""
+        # (node, inverted) of each output wire, once per wire if listed twice
+        outputs = {w: self.literals[w] for w in self.circuit["out"]}
+        live = set()
+        stack = [node for node, _ in outputs.values()]
+        while stack:
+            node = stack.pop()
+            if node not in live:
+                live.add(node)
+                operation, a, b = self.nodes[node]
+                if operation in (AND, OR, XOR):
+                    stack += [a[0], b[0]]
+        self.polarity = self._polarities(live, outputs.values())
+        self.wires = {}  # node -> wire of its gate
+        self.gates = []
+        self.inverted = {}  # wire -> wire of its inversion
+        self.constants = {}  # value -> wire of the constant
+        used_ids = {w for w in self.literals}
+        self.next_id = max(used_ids) + 1
+
+        # Output wires are the gates of their nodes when possible
+        out_ids = set(outputs)
+        for wire, (node, inverted) in outputs.items():
+            operation = self.nodes[node][0]
+            if (operation in (AND, OR, XOR) and node not in self.wires and
+                    self.polarity[node] == inverted):
+                self.wires[node] = wire
+        for node in sorted(live):
+            operation, a, b = self.nodes[node]
+            if operation == INPUT:
+                self.wires[node] = a
+            elif operation != CONST:
+                if node not in self.wires:
+                    origin = self.origins[node]
+                    self.wires[node] = (self._new_id() if origin in out_ids
+                                        else origin)
+                self._emit_node(node)
+
+        for wire, (node, inverted) in outputs.items():
+            if self.wires.get(node) == wire:
+                continue
+            if node == 0:
+                self._constant(inverted, wire)
+                continue
+            source = self.wires[node]
+            if inverted ^ self.polarity.get(node, 0):
+                self._invert(source, wire)
+            else:  # duplicated output or input wire, with two free NOT gates
+                self._invert(self._invert(source), wire)
+
+        return {
+            "id": self.circuit["id"],
+            "alice": self.circuit.get("alice", []),
+            "bob": self.circuit.get("bob", []),
+            "out": self.circuit["out"],
+            "gates": self.gates,
+        }
+
+    def _polarities(self, live, outputs):
+        """Choose which nodes are output inverted by their gate.
+
+        Each AND or OR gate reading one inverted input needs a NOT gate,
+        while inversions of both inputs are absorbed (De Morgan's laws),
+        so the polarities of its inputs should differ by the inversions of
+        its literals. Outputs should be the polarity of their literals,
+        and input wires are never inverted. These constraints are kept in
+        a union-find with parities, in this order, those contradicting
+        the previous ones costing a NOT gate. Free polarities are those of
+        the original gates.
+
+        Returns:
+            A dict mapping live nodes to 1 if their gate outputs them
+            inverted, else 0.
+        """
+        parents = {node: (node, 0) for node in live | {0}}
+
+        def find(node):
+            parent, parity = parents[node]
+            if parent == node:
+                return node, 0
+            root, root_parity = find(parent)
+            parents[node] = (root, parity ^ root_parity)
+            return parents[node]
+
+        def union(node_a, node_b, parity):
+            (root_a, parity_a), (root_b, parity_b) = find(node_a), find(node_b)
+            if root_a != root_b:
+                parents[root_a] = (root_b, parity_a ^ parity_b ^ parity)
+
+        constraints = [(node, 0, 0) for node in live
+                       if self.nodes[node][0] == INPUT]
+        for node in sorted(live):
+            operation, a, b = self.nodes[node]
+            if operation in (AND, OR):
+                constraints.append((a[0], b[0], a[1] ^ b[1]))
+        constraints += [(node, 0, inverted) for node, inverted in outputs]
+        constraints += [(node, 0, inverted)
+                        for node, inverted in self.preferred.items()
+                        if node in live]
+        for node_a, node_b, parity in constraints:
+            union(node_a, node_b, parity)
+
+        root_0, parity_0 = find(0)
+        polarity = {}
+        for node in live:
+            root, parity = find(node)
+            polarity[node] = parity ^ parity_0 if root == root_0 else parity
+        return polarity
+
+    def _emit_node(self, node):
+        operation, a, b = self.nodes[node]
+        wires = [self.wires[a[0]], self.wires[b[0]]]
+        # inversions of the input wires relative to the input literals
+        inverted = [a[1] ^ self.polarity[a[0]], b[1] ^ self.polarity[b[0]]]
+        output = self.polarity[node]
+        if operation == XOR:
+            output ^= inverted[0] ^ inverted[1]
+        elif inverted[0] and inverted[1]:
+            operation = DUALS[operation]
+            output ^= 1
+        elif inverted[0] or inverted[1]:
+            i = inverted.index(1)
+            wires[i] = self._invert(wires[i])
+        self._add_gate(GATES[operation, output], wires, self.wires[node])
+
+    def _invert(self, wire, gate_id=None):
+        """Return a wire holding the inversion of 'wire'."""
+        if wire in self.inverted and gate_id is None:
+            return self.inverted[wire]
+        gate_id = gate_id or self._new_id()
+        self._add_gate("NOT", [wire], gate_id)
+        self.inverted.setdefault(wire, gate_id)
+        return gate_id
+
+    def _constant(self, value, gate_id=None):
+        """Return a wire holding a constant, x XOR x or x XNOR x."""
+        if value in self.constants and gate_id is None:
+            return self.constants[value]
+        gate_id = gate_id or self._new_id()
+        wire = (self.circuit.get("alice", []) + self.circuit.get("bob", []))[0]
+        self._add_gate("XNOR" if value else "XOR", [wire, wire], gate_id)
+        self.constants.setdefault(value, gate_id)
+        return gate_id
+
+    def _add_gate(self, gate_type, inputs, gate_id):
+        self.gates.append({"id": gate_id, "type": gate_type, "in": inputs})
+
+    def _new_id(self):
+        self.next_id += 1
+        return self.next_id - 1
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(
+        description="Optimize the circuits of a file and check them.")
+    parser.add_argument("circuits", metavar="circuit.json", nargs="?",
+                        help="the JSON circuit file")
+    parser.add_argument("--free-xor", action="store_true",
+                        help="count and generate gates for Free-XOR")
+    parser.add_argument("--check", action="store_true",
+                        help="check the optimization of the shipped circuits (or of the "
+                             "given file) and of generated ones, with and without Free-XOR")
+    args = parser.parse_args()
+    if args.check:
+        logging.basicConfig(format="[%(levelname)s] %(message)s",
+                            level=logging.INFO)
+        failures = check(None if args.circuits is None else [args.circuits])
+        print(f"optimizer check: {len(failures)} failure(s)")
+        sys.exit(1 if failures else 0)
+    if args.circuits is None:
+        parser.error("a circuit file is needed without --check")
+    for circuit in util.parse_json(args.circuits)["circuits"]:
+        optimized = optimize(circuit, args.free_xor)
+        before = count_gates(circuit, args.free_xor)
+        after = count_gates(optimized, args.free_xor)
+        print(f"{circuit['id']}: {before[0]} -> {after[0]} gates, "
+              f"{before[1]} -> {after[1]} garbled tables, equivalent: "
+              f"{equivalent(circuit, optimized)}")
@@ -1,6 +1,9 @@
 import hashlib
 import logging
 import pickle
+import secrets
+import compiler
+import metrics
 import util
 import yao
 
@@ -8,57 +11,249 @@ import yao
 # Only change is applied to func send result,
 # which now also return the same value as is sent through channel
 
+# OT modes: one public-key OT per Bob's wire, all of them in parallel,
+# or OT extension
+OT_MODES = ("wire", "batch", "extension")
+OT_EXTENSION_BASE = 128  # number of base OTs of the OT extension
+OT_EXTENSION_SEED = 16  # size in bytes of the seeds sent with base OTs
+
 
 class ObliviousTransfer:
-    def __init__(self, socket, enabled=True):
+    """Transfer of Alice's inputs and of Bob's keys, Bob's evaluation.
+
+    Args:
+        socket: The socket connected to the other party.
+        enabled: Optional; enable the Oblivious Transfer protocol
+            (True by default).
+        mode: Optional; "wire" (the default) runs one public-key OT per
+            Bob's wire, "batch" runs the OTs of all Bob's wires in parallel
+            in two round trips, "extension" extends a fixed number of base
+            OTs into as many OTs as Bob has wires (IKNP).
+        group: Optional; the ID of the prime group of the OTs
+            (util.DEFAULT_GROUP by default). Groups are vetted in advance
+            and negotiated by ID, see util.GROUPS.
+        executor: Optional; a process pool evaluating the wide levels of
+            the circuits in parallel, for Bob's real query.
+    """
+    def __init__(self, socket, enabled=True, mode="wire",
+                 group=util.DEFAULT_GROUP, executor=None):
         self.socket = socket
         self.enabled = enabled
+        self.mode = mode
+        self.group = group
+        self.executor = executor
 
-    def get_result(self, a_inputs, b_keys):
+    def get_result(self, a_inputs, b_keys, chunks=None):
         """Send Alice's inputs and retrieve Bob's result of evaluation.
 
         Args:
             a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
             b_keys: A dict mapping each Bob's wire to a pair (key, encr_bit).
+            chunks: Optional; an iterable of messages streaming the garbled
+                tables after the inputs (see send_stream_result), the last
+                one holding the p-bits of outputs.
 
         Returns:
             The result of the yao circuit evaluation.
         """
         logging.debug("Sending inputs to Bob")
-        self.socket.send(a_inputs)
+        self.send_inputs(a_inputs, b_keys)
+        result = self.socket.receive()
 
-        for _ in range(len(b_keys)):
-            w = self.socket.receive()  # receive gate ID where to perform OT
-            logging.debug(f"Received gate ID {w}")
+        if chunks is not None:  # Bob is ready to evaluate
+            for chunk in chunks:
+                result = self.socket.send_wait(chunk)
 
-            if self.enabled:  # perform oblivious transfer
-                pair = (pickle.dumps(b_keys[w][0]), pickle.dumps(b_keys[w][1]))
-                self.ot_garbler(pair)
-            else:
-                to_send = (b_keys[w][0], b_keys[w][1])
-                self.socket.send(to_send)
+        return result
+
+    def send_inputs(self, a_inputs, b_keys):
+        """Send Alice's inputs and transfer Bob's keys, up to the last
+        message Bob answers once he has all his inputs."""
+        mode = self.mode if self.enabled else "disabled"
+        metrics.count("ots", len(b_keys), mode=mode)
+        with metrics.timer("oblivious_transfer", mode=mode):
+            if self.enabled and self.mode == "batch":
+                self.ot_batch_sender(a_inputs, b_keys)
+                return
 
-        return self.socket.receive()
+            self.socket.send(a_inputs)
 
-    def send_result(self, circuit, g_tables, pbits_out, b_inputs):
+            if self.enabled and self.mode == "extension":
+                self.ot_extension_sender(b_keys)
+                return
+
+            for _ in range(len(b_keys)):
+                w = self.socket.receive()  # receive gate ID where to perform OT
+                logging.debug(f"Received gate ID {w}")
+
+                if self.enabled:  # perform oblivious transfer
+                    pair = (pickle.dumps(b_keys[w][0]), pickle.dumps(b_keys[w][1]))
+                    self.ot_garbler(pair)
+                else:
+                    to_send = (b_keys[w][0], b_keys[w][1])
+                    self.socket.send(to_send)
+
+    def send_result(self, circuit, g_tables, pbits_out, b_inputs,
+                    scheme=None):
         """Evaluate circuit and send the result to Alice.
 
         Args:
-            circuit: A dict containing circuit spec.
+            circuit: A dict containing circuit spec, or the compiled circuit.
             g_tables: Garbled tables of yao circuit.
             pbits_out: p-bits of outputs.
             b_inputs: A dict mapping Bob's wires to (clear) input bits.
+            scheme: Optional; a dict of garbling options of the circuit,
+                passed to yao.evaluate.
 
         Returns:
             result: Output of the evaluation, formatted as dictionary {no_of_wire: bit}
                     It is the same value as is sent to the counterpart.
         """
-        # map from Alice's wires to (key, encr_bit) inputs
-        a_inputs = self.socket.receive()
-        # map from Bob's wires to (key, encr_bit) inputs
-        b_inputs_encr = {}
+        a_inputs, b_inputs_encr = self.receive_inputs(b_inputs)
 
-        logging.debug("Received Alice's inputs")
+        result = yao.evaluate(circuit, g_tables, pbits_out, a_inputs,
+                              b_inputs_encr, **(scheme or {}),
+                              executor=self.executor)
+
+        logging.debug("Sending circuit evaluation")
+        self.socket.send(result)
+        return result
+
+    def send_stream_result(self, circuit, b_inputs, scheme=None):
+        """Evaluate circuit as its garbled tables arrive and send the
+        result to Alice.
+
+        After the inputs, Alice sends messages {"gates": n,
+        "garbled_tables": tables} holding the tables of the next n gates in
+        evaluation order, then a last message {"pbits_out": pbits_out}.
+        Each chunk is acknowledged on receipt, so that Alice garbles the
+        next one while Bob evaluates it, and dropped once evaluated.
+
+        Args:
+            circuit: A dict containing circuit spec, or the compiled circuit.
+            b_inputs: A dict mapping Bob's wires to (clear) input bits.
+            scheme: Optional; a dict of garbling options of the circuit,
+                passed to yao.CircuitEvaluator.
+
+        Returns:
+            The output of the evaluation, as sent to Alice.
+        """
+        a_inputs, b_inputs_encr = self.receive_inputs(b_inputs)
+        evaluator = yao.CircuitEvaluator(circuit, a_inputs, b_inputs_encr,
+                                         **(scheme or {}),
+                                         executor=self.executor)
+        self.socket.send(True)  # ready for the garbled tables
+
+        while True:
+            chunk = self.socket.receive()
+            if "pbits_out" in chunk:
+                break
+            self.socket.send(True)
+            evaluator.run(chunk["garbled_tables"], chunk["gates"])
+        result = evaluator.get_result(chunk["pbits_out"])
+
+        logging.debug("Sending circuit evaluation")
+        self.socket.send(result)
+        return result
+
+    def receive_inputs(self, b_inputs):
+        """Receive Alice's inputs and get Bob's keys from Alice.
+
+        Args:
+            b_inputs: A dict mapping Bob's wires to (clear) input bits.
+
+        Returns:
+            A pair of dicts mapping Alice's and Bob's wires to
+            (key, encr_bit) inputs.
+        """
+        mode = self.mode if self.enabled else "disabled"
+        metrics.count("ots", len(b_inputs), mode=mode)
+        with metrics.timer("oblivious_transfer", mode=mode):
+            # map from Alice's wires to (key, encr_bit) inputs
+            a_inputs = self.socket.receive()
+            logging.debug("Received Alice's inputs")
+
+            # map from Bob's wires to (key, encr_bit) inputs
+            if self.enabled and self.mode == "batch":
+                # OT offers come with Alice's inputs
+                a_inputs, group_id, cs = a_inputs
+                b_inputs_encr = self.ot_batch_receiver(util.get_group(group_id),
+                                                       cs, b_inputs)
+            elif self.enabled and self.mode == "extension":
+                b_inputs_encr = self.ot_extension_receiver(b_inputs)
+            else:
+                b_inputs_encr = self.receive_keys(b_inputs)
+
+        return a_inputs, b_inputs_encr
+
+    def get_batch_result(self, a_keys, b_keys):
+        """Send the keys of all wires and retrieve Bob's results for every
+        combination of inputs, in a single round trip.
+
+        Used for the exhaustive printout only, where Bob would anyway
+        receive the keys of both values of each wire.
+
+        Args:
+            a_keys: A dict mapping each Alice's wire to a pair
+                ((key0, encr_bit0), (key1, encr_bit1)).
+            b_keys: A dict mapping each Bob's wire to a pair
+                ((key0, encr_bit0), (key1, encr_bit1)).
+
+        Returns:
+            The output bits of all combinations, as bytes (one byte per
+            output wire, combinations in the order of
+            util.input_combinations).
+        """
+        logging.debug("Sending all keys to Bob")
+        return self.socket.send_wait({"alice": a_keys, "bob": b_keys})
+
+    def send_batch_result(self, circuit, g_tables, pbits_out, scheme=None):
+        """Evaluate circuit for every combination of inputs and send all
+        results to Alice at once.
+
+        Args:
+            circuit: A dict containing circuit spec, or the compiled circuit.
+            g_tables: Garbled tables of yao circuit.
+            pbits_out: p-bits of outputs.
+            scheme: Optional; a dict of garbling options of the circuit,
+                passed to yao.evaluate.
+
+        Returns:
+            The output bits of all combinations, as sent to Alice.
+        """
+        program = compiler.compile_circuit(circuit)
+        keys = self.socket.receive()
+        results = bytearray()
+        logging.debug("Received all keys")
+
+        for bits_a, bits_b in util.input_combinations(len(program.alice),
+                                                      len(program.bob)):
+            a_inputs = {
+                w: keys["alice"][w][bit]
+                for w, bit in zip(program.alice, bits_a)
+            }
+            b_inputs = {
+                w: keys["bob"][w][bit]
+                for w, bit in zip(program.bob, bits_b)
+            }
+            result = yao.evaluate(program, g_tables, pbits_out, a_inputs,
+                                  b_inputs, **(scheme or {}))
+            results.extend(result[w] for w in program.out)
+
+        logging.debug("Sending all circuit evaluations")
+        self.socket.send(bytes(results))
+        return bytes(results)
+
+    def receive_keys(self, b_inputs):
+        """Retrieve the keys of Bob's inputs one wire at a time.
+
+        Args:
+            b_inputs: A dict mapping Bob's wires to (clear) input bits.
+
+        Returns:
+            A dict mapping Bob's wires to their (key, encr_bit) input.
+        """
+        b_inputs_encr = {}
 
         for w, b_input in b_inputs.items():
             logging.debug(f"Sending gate ID {w}")
@@ -71,12 +266,7 @@ class ObliviousTransfer:
                 logging.debug(f"Received key pair, key {b_input} selected")
                 b_inputs_encr[w] = pair[b_input]
 
-        result = yao.evaluate(circuit, g_tables, pbits_out, a_inputs,
-                              b_inputs_encr)
-
-        logging.debug("Sending circuit evaluation")
-        self.socket.send(result)
-        return result
+        return b_inputs_encr
 
     def ot_garbler(self, msgs):
         """Oblivious transfer, Alice's side.
@@ -85,19 +275,14 @@ class ObliviousTransfer:
             msgs: A pair (msg1, msg2) to suggest to Bob.
         """
         logging.debug("OT protocol started")
-        G = util.PrimeGroup()
-        self.socket.send_wait(G)
+        with metrics.timer("ot", role="sender"):
+            G = util.get_group(self.group)
+            self.socket.send_wait(G.id)
 
-        # OT protocol based on Nigel Smart’s "Cryptography Made Simple"
-        c = G.gen_pow(G.rand_int())
-        h0 = self.socket.send_wait(c)
-        h1 = G.mul(c, G.inv(h0))
-        k = G.rand_int()
-        c1 = G.gen_pow(k)
-        e0 = util.xor_bytes(msgs[0], self.ot_hash(G.pow(h0, k), len(msgs[0])))
-        e1 = util.xor_bytes(msgs[1], self.ot_hash(G.pow(h1, k), len(msgs[1])))
-
-        self.socket.send((c1, e0, e1))
+            # OT protocol based on Nigel Smart’s "Cryptography Made Simple"
+            c = G.gen_pow(G.rand_int())
+            h0 = self.socket.send_wait(c)
+            self.socket.send(self.ot_encrypt(G, c, h0, msgs))
         logging.debug("OT protocol ended")
 
     def ot_evaluator(self, b):
@@ -110,21 +295,173 @@ class ObliviousTransfer:
             The message selected by Bob.
         """
         logging.debug("OT protocol started")
-        G = self.socket.receive()
-        self.socket.send(True)
+        with metrics.timer("ot", role="receiver"):
+            G = util.get_group(self.socket.receive())
+            self.socket.send(True)
+
+            # OT protocol based on Nigel Smart’s "Cryptography Made Simple"
+            c = self.socket.receive()
+            x, h = self.ot_choose(G, c, b)
+            mb = self.ot_decrypt(G, x, b, self.socket.send_wait(h))
+
+        logging.debug("OT protocol ended")
+        return mb
+
+    def ot_batch_sender(self, a_inputs, b_keys):
+        """Oblivious transfers of all Bob's wires in parallel, Alice's side.
+
+        The OT offers are sent along with Alice's inputs, Bob answers all
+        of them at once and Alice sends all the encrypted pairs back.
+
+        Args:
+            a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
+            b_keys: A dict mapping each Bob's wire to a pair (key, encr_bit).
+        """
+        logging.debug("Batched OT protocol started")
+        G = util.get_group(self.group)
+        cs = {w: G.gen_pow(G.rand_int()) for w in b_keys}
+        hs = self.socket.send_wait((a_inputs, G.id, cs))
+
+        ciphertexts = {}
+        for w, (key0, key1) in b_keys.items():
+            pair = (pickle.dumps(key0), pickle.dumps(key1))
+            ciphertexts[w] = self.ot_encrypt(G, cs[w], hs[w], pair)
+        self.socket.send(ciphertexts)
+        logging.debug("Batched OT protocol ended")
+
+    def ot_batch_receiver(self, G, cs, b_inputs):
+        """Oblivious transfers of all Bob's wires in parallel, Bob's side.
+
+        Args:
+            G: The prime group of the OTs.
+            cs: A dict mapping Bob's wires to the OT offers of Alice.
+            b_inputs: A dict mapping Bob's wires to (clear) input bits.
+
+        Returns:
+            A dict mapping Bob's wires to their (key, encr_bit) input.
+        """
+        logging.debug("Batched OT protocol started")
+        chosen = {w: self.ot_choose(G, cs[w], b) for w, b in b_inputs.items()}
+        ciphertexts = self.socket.send_wait({w: h for w, (_, h) in chosen.items()})
+
+        b_inputs_encr = {}
+        for w, b in b_inputs.items():
+            msg = self.ot_decrypt(G, chosen[w][0], b, ciphertexts[w])
+            b_inputs_encr[w] = pickle.loads(msg)
+        logging.debug("Batched OT protocol ended")
+        return b_inputs_encr
+
+    def ot_extension_sender(self, b_keys):
+        """OT extension, Alice's side (IKNP).
+
+        Alice acts as the receiver of OT_EXTENSION_BASE base OTs with a
+        random secret choice s, then sends each pair of Bob's keys masked
+        with the rows of the extended matrix.
+
+        Args:
+            b_keys: A dict mapping each Bob's wire to a pair (key, encr_bit).
+        """
+        logging.debug("OT extension started")
+        # Bob's wires, in the order of his choices, and the base OTs offers
+        wires, group_id, cs = self.socket.receive()
+        G = util.get_group(group_id)
+        s = secrets.randbits(OT_EXTENSION_BASE)
+        choices = [(s >> i) & 1 for i in range(OT_EXTENSION_BASE)]
+
+        chosen = [self.ot_choose(G, c, b) for c, b in zip(cs, choices)]
+        base_cts, us = self.socket.send_wait([h for _, h in chosen])
+        columns = []
+        for (x, _), b, ct, u in zip(chosen, choices, base_cts, us):
+            seed = self.ot_decrypt(G, x, b, ct)
+            column = self.ot_prg(seed, len(wires))
+            columns.append(column ^ u if b else column)
+
+        ys = []
+        for j, row in enumerate(self.ot_transpose(columns, len(wires))):
+            pair = (pickle.dumps(b_keys[wires[j]][0]),
+                    pickle.dumps(b_keys[wires[j]][1]))
+            ys.append((
+                util.xor_bytes(pair[0], self.ot_row_hash(j, row, len(pair[0]))),
+                util.xor_bytes(pair[1],
+                               self.ot_row_hash(j, row ^ s, len(pair[1]))),
+            ))
+        self.socket.send(ys)
+        logging.debug("OT extension ended")
+
+    def ot_extension_receiver(self, b_inputs):
+        """OT extension, Bob's side (IKNP).
 
-        # OT protocol based on Nigel Smart’s "Cryptography Made Simple"
-        c = self.socket.receive()
+        Bob acts as the sender of OT_EXTENSION_BASE base OTs of random
+        seeds, which are expanded to mask his choices for all his wires.
+
+        Args:
+            b_inputs: A dict mapping Bob's wires to (clear) input bits.
+
+        Returns:
+            A dict mapping Bob's wires to their (key, encr_bit) input.
+        """
+        logging.debug("OT extension started")
+        wires, choices = list(b_inputs.keys()), list(b_inputs.values())
+        r = sum(b << j for j, b in enumerate(choices))
+        G = util.get_group(self.group)
+        cs = [G.gen_pow(G.rand_int()) for _ in range(OT_EXTENSION_BASE)]
+        seeds = [(secrets.token_bytes(OT_EXTENSION_SEED),
+                  secrets.token_bytes(OT_EXTENSION_SEED))
+                 for _ in range(OT_EXTENSION_BASE)]
+
+        hs = self.socket.send_wait((wires, G.id, cs))
+        base_cts, us, columns = [], [], []
+        for c, h0, pair in zip(cs, hs, seeds):
+            base_cts.append(self.ot_encrypt(G, c, h0, pair))
+            column = self.ot_prg(pair[0], len(wires))
+            columns.append(column)
+            us.append(column ^ self.ot_prg(pair[1], len(wires)) ^ r)
+
+        ys = self.socket.send_wait((base_cts, us))
+        b_inputs_encr = {}
+        for j, row in enumerate(self.ot_transpose(columns, len(wires))):
+            y = ys[j][choices[j]]
+            msg = util.xor_bytes(y, self.ot_row_hash(j, row, len(y)))
+            b_inputs_encr[wires[j]] = pickle.loads(msg)
+        logging.debug("OT extension ended")
+        return b_inputs_encr
+
+    def ot_encrypt(self, G, c, h0, msgs):
+        """Encrypt both messages of an OT, sender's side.
+
+        Args:
+            G: The prime group of the OT.
+            c: The random group element offered to the receiver.
+            h0: The receiver's answer.
+            msgs: The pair of messages to transfer.
+
+        Returns:
+            A triple (c1, e0, e1) for the receiver.
+        """
+        h1 = G.mul(c, G.inv(h0))
+        k = G.rand_int()
+        c1 = G.gen_pow(k)
+        e0 = util.xor_bytes(msgs[0], self.ot_hash(G.pow(h0, k), len(msgs[0])))
+        e1 = util.xor_bytes(msgs[1], self.ot_hash(G.pow(h1, k), len(msgs[1])))
+        return c1, e0, e1
+
+    def ot_choose(self, G, c, b):
+        """Choose one of the messages of an OT, receiver's side.
+
+        Returns:
+            A pair (x, h) of the secret exponent and the answer to send.
+        """
         x = G.rand_int()
         x_pow = G.gen_pow(x)
         h = (x_pow, G.mul(c, G.inv(x_pow)))
-        c1, e0, e1 = self.socket.send_wait(h[b])
+        return x, h[b]
+
+    def ot_decrypt(self, G, x, b, ciphertexts):
+        """Decrypt the chosen message of an OT, receiver's side."""
+        c1, e0, e1 = ciphertexts
         e = (e0, e1)
         ot_hash = self.ot_hash(G.pow(c1, x), len(e[b]))
-        mb = util.xor_bytes(e[b], ot_hash)
-
-        logging.debug("OT protocol ended")
-        return mb
+        return util.xor_bytes(e[b], ot_hash)
 
     @staticmethod
     def ot_hash(pub_key, msg_length):
@@ -132,3 +469,25 @@ class ObliviousTransfer:
         key_length = (pub_key.bit_length() + 7) // 8  # key length in bytes
         bytes = pub_key.to_bytes(key_length, byteorder="big")
         return hashlib.shake_256(bytes).digest(msg_length)
+
+    @staticmethod
+    def ot_prg(seed, num_bits):
+        """Expand a seed into a random number of 'num_bits' bits."""
+        num_bytes = (num_bits + 7) // 8
+        return int.from_bytes(hashlib.shake_256(seed).digest(num_bytes),
+                              byteorder="little")
+
+    @staticmethod
+    def ot_transpose(columns, num_rows):
+        """Return the rows of a bit matrix given as a list of columns."""
+        return [
+            sum(((column >> j) & 1) << i for i, column in enumerate(columns))
+            for j in range(num_rows)
+        ]
+
+    @staticmethod
+    def ot_row_hash(index, row, msg_length):
+        """Hash function for the rows of the OT extension matrix."""
+        data = (index.to_bytes(8, byteorder="big") +
+                row.to_bytes(OT_EXTENSION_BASE // 8, byteorder="big"))
+        return hashlib.shake_256(data).digest(msg_length)
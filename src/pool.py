@@ -0,0 +1,151 @@
+import collections
+import concurrent.futures
+import logging
+import multiprocessing
+import threading
+import time
+import compiler
+import garbler
+
+DEFAULT_DEPTH = 4  # number of instances kept ready by default
+
+
+def new_executor(workers=None):
+    """Return a process pool for garbling in the background.
+
+    Processes are spawned, so that they do not inherit the sockets of the
+    parent process.
+
+    Args:
+        workers: Optional; the number of processes (the number of CPUs by
+            default).
+    """
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"))
+
+
+class GarbledPool:
+    """A bounded pool of fresh garbled instances of a circuit.
+
+    Instances are garbled in the background by a process pool, so that the
+    garbling is done offline, before the query using it. Each instance is
+    given out once by get. A get finding an instance ready is a hit, a get
+    waiting for one to be garbled is a miss.
+
+    Args:
+        circuit: A dict containing circuit spec, or the compiled circuit.
+        scheme: Optional; a dict of garbling options of the circuit.
+        depth: Optional; the number of instances kept ready or being
+            garbled (DEFAULT_DEPTH by default).
+        workers: Optional; the number of processes of the pool's own
+            executor, if no executor is given.
+        refill_rate: Optional; the maximum number of instances garbled per
+            second (no limit by default).
+        executor: Optional; the executor garbling the instances, may be
+            shared by several pools (by default a new process pool).
+    """
+    def __init__(self, circuit, scheme=None, depth=DEFAULT_DEPTH, workers=None,
+                 refill_rate=None, executor=None):
+        if depth < 1:
+            raise ValueError(f"Pool depth must be at least 1, not {depth}")
+        self.circuit = compiler.compile_circuit(circuit)
+        self.scheme = scheme
+        self.depth = depth
+        self.refill_rate = refill_rate
+        self.own_executor = executor is None
+        self.executor = executor or new_executor(workers)
+        self.ready = collections.deque()  # garbled entries, oldest first
+        self.pending = 0  # number of instances being garbled
+        self.hits = 0
+        self.misses = 0
+        self.error = None  # exception raised while garbling, if any
+        self.closed = False
+        self.condition = threading.Condition()
+
+        self.thread = threading.Thread(target=self._refill, daemon=True)
+        self.thread.start()
+
+    def get(self):
+        """Take a fresh garbled instance out of the pool, waiting for one
+        if none is ready.
+
+        Returns:
+            A dict representing the garbled circuit, see
+            garbler.garble_circuit.
+        """
+        with self.condition:
+            if self.ready:
+                self.hits += 1
+            else:
+                self.misses += 1
+                logging.debug(f"Pool of {self.circuit.id} is empty, "
+                              f"waiting for garbling")
+                self.condition.wait_for(
+                    lambda: self.ready or self.error or self.closed)
+            if self.error:
+                raise self.error
+            if self.closed:
+                raise ValueError("Pool is closed")
+            entry = self.ready.popleft()
+            self.condition.notify_all()
+        return entry
+
+    def stats(self):
+        """Return a dict with the number of hits, misses, instances ready
+        and instances being garbled."""
+        with self.condition:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "ready": len(self.ready),
+                "pending": self.pending,
+            }
+
+    def close(self):
+        """Stop garbling new instances and drop the ready ones.
+
+        Pending instances are cancelled and the ones being garbled are
+        waited for, so that the worker processes are joined before the
+        interpreter exits.
+        """
+        with self.condition:
+            self.closed = True
+            self.ready.clear()
+            self.condition.notify_all()
+        self.thread.join()  # no instance is submitted any more
+        if self.own_executor:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def _refill(self):
+        """Keep 'depth' instances ready or being garbled, at most
+        'refill_rate' new ones per second."""
+        interval = 1 / self.refill_rate if self.refill_rate else 0
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: self.closed or self.error or
+                    len(self.ready) + self.pending < self.depth)
+                if self.closed or self.error:
+                    return
+                self.pending += 1
+            try:
+                future = self.executor.submit(garbler.garble_circuit,
+                                              self.circuit, self.scheme)
+            except RuntimeError:  # the executor was shut down
+                return
+            future.add_done_callback(self._add_instance)
+            time.sleep(interval)
+
+    def _add_instance(self, future):
+        with self.condition:
+            self.pending -= 1
+            if future.cancelled() or self.closed:
+                return
+            if future.exception() is not None:
+                logging.error(f"Garbling {self.circuit.id} failed: "
+                              f"{future.exception()!r}")
+                self.error = future.exception()
+            else:
+                self.ready.append(future.result())
+            self.condition.notify_all()
@@ -0,0 +1,107 @@
+"""Pseudorandom generation of wire labels and p-bits from a secret seed.
+
+All wire keys, p-bits and the Free-XOR offset of a garbled circuit are
+derived from one 128-bit seed with AES-128 in counter mode, the seed
+being the AES key. The keystream of wire w starts at block w times the
+number of blocks of a wire and holds its raw key for bit 0, its raw key
+for bit 1 and a byte whose lowest bit is its p-bit, so that the labels of
+any wire can be generated again on demand from the seed and the wire ID.
+The keys of consecutive wires are generated in bulk, with one AES call.
+
+A fresh random seed is drawn for each garbled circuit unless one is
+given, e.g. to reproduce the garbling of a benchmark. Labels must never
+be reused across runs of the protocol, so a fixed seed is for tests and
+benchmarks only.
+
+Example:
+    labels = prg.LabelGenerator(prg.to_seed("bench"))
+    key0, key1, pbit = labels.wire(5)
+"""
+import hashlib
+import secrets
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+SEED_SIZE = 16  # size of a seed in bytes, an AES-128 key
+BLOCK_SIZE = 16  # size of an AES block in bytes
+# Domains of the keystream, in the high 64 bits of the counter blocks
+WIRES, OFFSET = range(2)
+
+
+def new_seed():
+    """Return a fresh random seed."""
+    return secrets.token_bytes(SEED_SIZE)
+
+
+def to_seed(value):
+    """Return the seed of a value: a seed as is, or the hash of a str or
+    an int (e.g. a seed given on the command line)."""
+    if isinstance(value, (bytes, bytearray)) and len(value) == SEED_SIZE:
+        return bytes(value)
+    return hashlib.blake2b(str(value).encode(), digest_size=SEED_SIZE,
+                           person=b"yao-seed").digest()
+
+
+def derive_seed(seed, index):
+    """Return the seed of the index-th generator derived from a seed (see
+    to_seed), e.g. one per circuit of a file, so that no two circuits
+    share labels."""
+    return hashlib.blake2b(index.to_bytes(8, "little"), key=to_seed(seed),
+                           digest_size=SEED_SIZE).digest()
+
+
+class LabelGenerator:
+    """Generator of the raw wire keys and p-bits of a circuit.
+
+    Args:
+        seed: Optional; the secret seed, a fresh random one by default.
+        key_size: Optional; the size of a raw key in bytes (see
+            ciphers.Cipher.key_size).
+    """
+    __slots__ = ("seed", "key_size", "wire_blocks")
+
+    def __init__(self, seed=None, key_size=BLOCK_SIZE):
+        self.seed = new_seed() if seed is None else to_seed(seed)
+        self.key_size = key_size
+        # blocks of the keystream of a wire: two keys and a p-bit
+        self.wire_blocks = -(-(2 * key_size + 1) // BLOCK_SIZE)
+
+    def _stream(self, domain, block, size):
+        """Return 'size' bytes of the keystream starting at a block."""
+        counter = (domain << 64 | block).to_bytes(BLOCK_SIZE, "big")
+        encryptor = Cipher(algorithms.AES(self.seed),
+                           modes.CTR(counter)).encryptor()
+        return encryptor.update(bytes(size))
+
+    def offset(self):
+        """Return the raw global offset of Free-XOR keys."""
+        return self._stream(OFFSET, 0, self.key_size)
+
+    def wire(self, wire):
+        """Return the (raw key 0, raw key 1, p-bit) of a wire."""
+        return self._split(self._stream(WIRES, wire * self.wire_blocks,
+                                        self.wire_blocks * BLOCK_SIZE), 0)
+
+    def wires(self, wires):
+        """Return a dict mapping wires to their (raw key 0, raw key 1,
+        p-bit), the keystream of each run of consecutive wire IDs being
+        generated at once."""
+        wires = sorted(set(wires))
+        labels = {}
+        size = self.wire_blocks * BLOCK_SIZE
+        start = 0
+        for end in range(1, len(wires) + 1):
+            if end < len(wires) and wires[end] == wires[end - 1] + 1:
+                continue
+            first = wires[start]
+            stream = self._stream(WIRES, first * self.wire_blocks,
+                                  (end - start) * size)
+            for i in range(end - start):
+                labels[first + i] = self._split(stream, i * size)
+            start = end
+        return labels
+
+    def _split(self, stream, pos):
+        key_size = self.key_size
+        return (stream[pos:pos + key_size],
+                stream[pos + key_size:pos + 2 * key_size],
+                stream[pos + 2 * key_size] & 1)
@@ -0,0 +1,305 @@
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import zmq
+import codec
+import metrics
+import util
+import utli_karol
+from bob import Bob
+
+# Time in seconds after which an idle session is closed
+SESSION_TIMEOUT = 60
+READY = b"READY"  # message of a worker ready to serve sessions
+OUTBOX = "inproc://outbox"  # endpoint of the replies of sessions in a worker
+POLL_TIMEOUT = 100  # time in milliseconds between checks of a worker's stop
+
+
+class BobServer:
+    """A long-lived Bob serving many Alices concurrently.
+
+    Alices connect their usual REQ socket to a ROUTER socket, each
+    connection being a session identified by the ZMQ identity of Alice's
+    socket. Sessions are routed to a pool of worker processes (always the
+    same worker for a session), each worker running every session in its
+    own thread, so that protocols run concurrently without blocking each
+    other. Bob's data is read once and the private value is cached per bit
+    length by each worker.
+
+    Args:
+        oblivious_transfer: Optional; enable the Oblivious Transfer protocol
+            (True by default).
+        filename: Optional; path to the file, from which to read data.
+            Default is empty string, and data is read from console.
+        serializer: Optional; the encoding of the messages sent to Alices,
+            "binary" (the default) or "pickle", see codec.
+        workers: Optional; the number of worker processes
+            (the number of CPUs by default).
+        endpoint: Optional; the endpoint Alices connect to.
+        metrics_path: Optional; a file the metrics of each session are
+            appended to, as one JSON line per session (see metrics).
+    """
+    def __init__(self, oblivious_transfer=True, filename="", serializer="binary",
+                 workers=None, endpoint=f"tcp://*:{util.LOCAL_PORT}",
+                 metrics_path=None):
+        self.oblivious_transfer = oblivious_transfer
+        self.metrics_path = metrics_path
+        self.serializer = serializer
+        self.num_workers = workers or os.cpu_count() or 1
+        self.endpoint = endpoint
+        if filename == "":
+            self.data, _ = utli_karol.private_func("Bob")
+        else:
+            self.data, _ = utli_karol.private_func("Bob", file_read=True, filename=filename)
+
+    def listen(self):
+        """Start the workers and route messages between Alices and workers
+        until interrupted."""
+        context = zmq.Context()
+        frontend = context.socket(zmq.ROUTER)
+        frontend.bind(self.endpoint)
+        backend = context.socket(zmq.ROUTER)
+        backend_port = backend.bind_to_random_port("tcp://127.0.0.1")
+
+        # spawned, so that workers do not inherit the server's ZMQ context
+        processes = [
+            multiprocessing.get_context("spawn").Process(
+                target=run_worker,
+                args=(index, f"tcp://127.0.0.1:{backend_port}", self.data,
+                      self.oblivious_transfer, self.serializer,
+                      logging.getLogger().level, self.metrics_path),
+                daemon=True)
+            for index in range(self.num_workers)
+        ]
+        for process in processes:
+            process.start()
+
+        try:
+            # route sessions only to connected workers
+            workers = []
+            while len(workers) < self.num_workers:
+                worker_id, _ = backend.recv_multipart()
+                workers.append(worker_id)
+            workers.sort()
+            logging.info(f"Serving on {self.endpoint} with {len(workers)} workers")
+
+            poller = zmq.Poller()
+            poller.register(frontend, zmq.POLLIN)
+            poller.register(backend, zmq.POLLIN)
+            while True:
+                events = dict(poller.poll())
+                if frontend in events:
+                    # [session ID, empty delimiter, message frames...]
+                    frames = frontend.recv_multipart(copy=False)
+                    session_id = frames[0].bytes
+                    worker_id = workers[hash(session_id) % len(workers)]
+                    backend.send_multipart([worker_id, session_id] + frames[2:],
+                                           copy=False)
+                if backend in events:
+                    # [worker ID, session ID, message frames...]
+                    frames = backend.recv_multipart(copy=False)
+                    frontend.send_multipart([frames[1], b""] + frames[2:],
+                                            copy=False)
+        except KeyboardInterrupt:
+            logging.info("Stop listening")
+        finally:
+            for process in processes:
+                process.terminate()
+            frontend.close(linger=0)
+            backend.close(linger=0)
+
+
+class SessionClosed(Exception):
+    """Raised when a session stays idle for SESSION_TIMEOUT seconds."""
+    pass
+
+
+class SessionSocket:
+    """Socket of one session in a worker, with the interface of util.Socket.
+
+    Messages of the session are queued by the worker, replies are pushed
+    to the worker which sends them to the server.
+
+    Args:
+        session: The Session the socket belongs to.
+        context: The ZMQ context of the worker.
+        serializer: The encoding of the messages sent to Alice.
+    """
+    def __init__(self, session, context, serializer):
+        self.session = session
+        self.serializer = serializer
+        self.socket = context.socket(zmq.PUSH)
+        self.socket.connect(OUTBOX)
+
+    def send(self, msg):
+        with metrics.timer("serialize"):
+            frames = codec.encode(msg, self.serializer)
+        metrics.message("sent", frames)
+        self.socket.send_multipart([self.session.id] + frames, copy=False)
+
+    def receive(self):
+        with metrics.timer("transfer"):
+            frames = self.session.next_message()
+        metrics.message("received", frames)
+        with metrics.timer("deserialize"):
+            return codec.decode(frames)
+
+    def send_wait(self, msg):
+        self.send(msg)
+        return self.receive()
+
+    def poll_socket(self):
+        try:
+            while True:
+                yield self.receive()
+        except SessionClosed:
+            pass
+
+    def close(self):
+        self.socket.close()
+
+
+class Session(threading.Thread):
+    """A protocol run with one Alice, served by a Bob in its own thread.
+
+    Args:
+        session_id: The ZMQ identity of Alice's socket.
+        context: The ZMQ context of the worker.
+        bob_args: A dict of keyword arguments of the session's Bob.
+        serializer: The encoding of the messages sent to Alice.
+        metrics_path: Optional; the file the metrics of the session are
+            appended to.
+    """
+    def __init__(self, session_id, context, bob_args, serializer,
+                 metrics_path=None):
+        super().__init__(daemon=True)
+        self.id = session_id
+        self.context = context
+        self.bob_args = bob_args
+        self.serializer = serializer
+        self.metrics_path = metrics_path
+        self.collector = (metrics.Metrics(f"session-{session_id.hex()}")
+                          if metrics_path else None)
+        self.inbox = queue.Queue()
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def deliver(self, frames):
+        """Queue a message of the session.
+
+        Returns:
+            False if the session is closed, and the message was not queued.
+        """
+        with self.lock:
+            if self.closed:
+                return False
+            self.inbox.put(frames)
+            return True
+
+    def next_message(self):
+        """Return the frames of the next message, waiting at most
+        SESSION_TIMEOUT seconds."""
+        try:
+            return self.inbox.get(timeout=SESSION_TIMEOUT)
+        except queue.Empty:
+            with self.lock:
+                if self.inbox.empty():
+                    self.closed = True
+                    raise SessionClosed() from None
+            return self.inbox.get()
+
+    def run(self):
+        logging.info(f"Session {self.id.hex()} opened")
+        socket = SessionSocket(self, self.context, self.serializer)
+        try:
+            with metrics.session(self.collector):
+                Bob(socket=socket, **self.bob_args).listen()
+        except SessionClosed:
+            logging.warning(f"Session {self.id.hex()} timed out during a protocol")
+        except Exception:
+            logging.exception(f"Session {self.id.hex()} failed")
+        finally:
+            with self.lock:
+                self.closed = True
+            socket.close()
+            self.dump_metrics()
+            logging.info(f"Session {self.id.hex()} closed")
+
+    def dump_metrics(self):
+        """Append the metrics of the session to the metrics file, once."""
+        with self.lock:
+            if self.collector is None:
+                return
+            collector, self.collector = self.collector, None
+        # a single write per line, sessions append concurrently
+        with open(self.metrics_path, "a") as file:
+            file.write(json.dumps(collector.summary()) + "\n")
+
+
+def run_worker(index, backend, data, oblivious_transfer, serializer,
+               loglevel=logging.WARNING, metrics_path=None):
+    """Serve the sessions routed to a worker process.
+
+    Args:
+        index: The index of the worker.
+        backend: The endpoint of the server for workers.
+        data: Bob's list of inputs.
+        oblivious_transfer: Enable the Oblivious Transfer protocol.
+        serializer: The encoding of the messages sent to Alices.
+        loglevel: Optional; the log level of the worker.
+        metrics_path: Optional; the file the metrics of the sessions are
+            appended to.
+    """
+    logging.getLogger().setLevel(loglevel)
+    context = zmq.Context()
+    dealer = context.socket(zmq.DEALER)
+    dealer.setsockopt(zmq.IDENTITY, f"worker-{index}".encode())
+    dealer.connect(backend)
+    outbox = context.socket(zmq.PULL)
+    outbox.bind(OUTBOX)
+    # shared by the Bobs of all sessions of the worker
+    bob_args = {
+        "oblivious_transfer": oblivious_transfer,
+        "data": data,
+        "private_values": {},
+    }
+    sessions = {}  # session ID -> Session
+
+    poller = zmq.Poller()
+    poller.register(dealer, zmq.POLLIN)
+    poller.register(outbox, zmq.POLLIN)
+    dealer.send(READY)
+    # stopped by the server with SIGTERM, checked between polls
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    try:
+        while not stopped.is_set():
+            events = dict(poller.poll(POLL_TIMEOUT))
+            if dealer in events:
+                # [session ID, message frames...]
+                frames = dealer.recv_multipart(copy=False)
+                session_id = frames[0].bytes
+                session = sessions.get(session_id)
+                if session is None or not session.deliver(frames[1:]):
+                    session = Session(session_id, context, bob_args, serializer,
+                                      metrics_path)
+                    sessions[session_id] = session
+                    session.deliver(frames[1:])
+                    session.start()
+                # forget closed sessions
+                for closed_id in [s for s, other in sessions.items()
+                                  if other.closed]:
+                    del sessions[closed_id]
+            if outbox in events:
+                dealer.send_multipart(outbox.recv_multipart(copy=False),
+                                      copy=False)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # sessions still open when the worker stops
+        for session in sessions.values():
+            session.dump_metrics()
@@ -0,0 +1,197 @@
+"""Persistent sessions of Alice: many queries over one connection to Bob.
+
+A session keeps one socket connected to Bob and runs any number of
+queries on it back to back, so that the start-up of the process, the
+imports and the connection are paid once per session instead of once
+per query. A query is a list of circuit files, a data file and a bit
+size: each circuit of the files is garbled and evaluated with Bob as in
+one run of alice.Alice, on Alice's data read again for each query.
+
+State is reused across queries: the socket and, with pools, the garbler
+of each circuit file and bit size, whose pools keep garbling fresh
+instances in the background between queries. The compiled circuits (see
+cache.py) and the prime groups of the OTs (see util.get_group) are loaded
+once per process.
+
+Queries are read one per line of a stream (e.g. stdin), each line giving
+the options -c, -f and -b of the query (see parse_query), missing ones
+taking the values of the command line. Empty lines and lines starting
+with '#' are skipped. Queries failing before anything is sent to Bob
+(e.g. a missing file) are logged and the session goes on.
+
+Example:
+    printf -- '-c circuits/max.json\\n-c circuits/min.json -b 4\\n' |
+        python main.py alice --session - -f data/alice.in
+"""
+import argparse
+import logging
+import os
+import shlex
+import time
+import metrics
+import prg
+import util
+from alice import Alice
+
+
+class _QueryParser(argparse.ArgumentParser):
+    """Parser of the query lines, raising ValueError on errors instead of
+    exiting."""
+    def error(self, message):
+        raise ValueError(message)
+
+
+_QUERY_PARSER = _QueryParser(prog="query", add_help=False)
+_QUERY_PARSER.add_argument("-c", "--circuit", nargs="+", default=None)
+_QUERY_PARSER.add_argument("-f", "--filename", default=None)
+_QUERY_PARSER.add_argument("-b", "--bitsize", type=int, default=None)
+
+
+def parse_query(line, circuits, filename="", bit_size=4):
+    """Return the query of a line, or None for an empty or comment line.
+
+    Args:
+        line: The options of the query, e.g. "-c circuits/max.json -b 8".
+        circuits: The circuit files of the query if the line gives none.
+        filename: Optional; the data file if the line gives none.
+        bit_size: Optional; the bit size if the line gives none.
+
+    Returns:
+        A tuple (circuit files, data file, bit size).
+
+    Raises:
+        ValueError: if the line holds unknown options or arguments.
+    """
+    args = shlex.split(line, comments=True)
+    if not args:
+        return None
+    options = _QUERY_PARSER.parse_args(args)
+    return (options.circuit or circuits,
+            filename if options.filename is None else options.filename,
+            bit_size if options.bitsize is None else options.bitsize)
+
+
+def read_queries(lines, circuits, filename="", bit_size=4):
+    """Yield the queries of lines (see parse_query), logging and skipping
+    invalid lines."""
+    for number, line in enumerate(lines, 1):
+        try:
+            query = parse_query(line, circuits, filename, bit_size)
+        except ValueError as e:
+            logging.error(f"Skipping query line {number}: {e}")
+            continue
+        if query is not None:
+            yield query
+
+
+def _key(circuits, bit_size):
+    """Return the key of the garbler of a circuit file or content."""
+    return (circuits if isinstance(circuits, str) else id(circuits), bit_size)
+
+
+class AliceSession:
+    """One connection of Alice to Bob running any number of queries.
+
+    Args:
+        socket: Optional; the socket connected to Bob (by default a new
+            util.GarblerSocket).
+        serializer: Optional; the encoding of the messages sent to Bob,
+            "binary" (the default) or "pickle", see codec.
+        console: Optional; data may be read from console, i.e. queries
+            without data file are allowed (True by default). Set it to
+            False when the queries themselves are read from stdin.
+        **options: The options of alice.Alice common to all queries
+            (print mode, scheme, OT, pool options, executor...). A "seed"
+            of the scheme is derived into one seed per run (see
+            prg.derive_seed), so that no two runs share labels.
+    """
+    def __init__(self, socket=None, serializer="binary", console=True,
+                 **options):
+        self.socket = socket or util.GarblerSocket(serializer=serializer)
+        self.console = console
+        self.options = options
+        # garblers with pools, by (circuit file, bit size), kept across queries
+        self.garblers = {}
+        self.runs = 0  # number of circuit files run
+        self.failures = 0  # number of circuit files failing
+
+    def _garbler(self, circuits, filename, bit_size):
+        """Return an Alice ready to run a circuit file on the data of a
+        query, taken from the garblers kept across queries if any."""
+        options = self.options
+        if not options.get("pool_options") or options.get("simd"):
+            # fresh labels for each run, and SIMD circuits have one copy per number
+            scheme = options.get("scheme") or {}
+            if scheme.get("seed") is not None:
+                scheme = dict(scheme,
+                              seed=prg.derive_seed(scheme["seed"], self.runs))
+            return Alice(circuits, filename=filename, bit_size=bit_size,
+                         socket=self.socket, **dict(options, scheme=scheme))
+        alice = self.garblers.get(_key(circuits, bit_size))
+        if alice is None:
+            alice = Alice(circuits, filename=filename, bit_size=bit_size,
+                          socket=self.socket, **options)
+            self.garblers[_key(circuits, bit_size)] = alice
+        else:
+            alice.read_data(filename, bit_size)
+        return alice
+
+    def run(self, circuits, filename="", bit_size=4):
+        """Run a query: evaluate each circuit file with Bob on the data.
+
+        Args:
+            circuits: A circuit file, or a list of them. Circuits may also
+                be given by their content, e.g. made by generator.generate.
+            filename: Optional; the data file, data is read from console
+                if empty.
+            bit_size: Optional; size of input numbers in bits.
+
+        Returns:
+            A list of the results of the circuit files, a result being
+            the results of their last circuit (see Alice.general_max), or
+            None if the circuit file failed.
+        """
+        if isinstance(circuits, (str, dict)):
+            circuits = [circuits]
+        results = []
+        for path in circuits:
+            name = path if isinstance(path, str) else path["name"]
+            start = time.perf_counter()
+            try:
+                if filename == "" and not self.console:
+                    raise ValueError("Queries read from stdin need a data file (-f)")
+                if filename and not os.path.isfile(filename):
+                    raise FileNotFoundError(f"No data file {filename}")
+                alice = self._garbler(path, filename, bit_size)
+            except (OSError, ValueError, KeyError) as e:
+                # nothing was sent to Bob, the next queries can go on
+                logging.error(f"Query on {name} failed: {e}")
+                self.failures += 1
+                results.append(None)
+                continue
+            finally:
+                self.runs += 1
+            with metrics.timer("query"):
+                alice.start()
+            if _key(path, bit_size) not in self.garblers:
+                alice.close()
+            metrics.count("queries")
+            logging.info(f"Run {self.runs} of {name} done in "
+                         f"{(time.perf_counter() - start) * 1000:.1f} ms")
+            results.append(alice.general_max)
+        return results
+
+    def run_all(self, queries):
+        """Run queries (circuit files, data file, bit size) in turn, e.g.
+        read with read_queries."""
+        start = time.perf_counter()
+        for circuits, filename, bit_size in queries:
+            self.run(circuits, filename, bit_size)
+        logging.info(f"Session of {self.runs} runs ({self.failures} failed) "
+                     f"in {time.perf_counter() - start:.3f} s")
+
+    def close(self):
+        """Stop the pools of the garblers kept across queries."""
+        for alice in self.garblers.values():
+            alice.close()
+        self.garblers.clear()
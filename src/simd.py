@@ -0,0 +1,182 @@
+"""SIMD batching of independent queries into one circuit.
+
+A circuit replicated k times holds k independent copies of its gates,
+copy j using the wires of the original shifted by j times one more than
+the largest wire ID, so that the copies share no wire even if the
+circuit uses wire 0. Alice's, Bob's and output wires are those of the copies, copy
+after copy, so that query j reads its inputs from the j-th slice of each
+party's wires and writes its result to the j-th slice of the outputs.
+
+The replicated circuit is garbled once and all Bob's OTs of the batch run
+together, the fixed costs of a session (garbling setup, round trips, base
+OTs) being paid once per batch instead of once per query.
+
+Run as a script to check the copies of the shipped circuits (or of the
+circuits of a file) and of generated circuits against their evaluation
+in clear (see check), e.g. with "make check":
+
+    python simd.py
+
+Example:
+    circuit = simd.replicate(generator.max_circuit(8), 100)
+    bits_a = simd.input_bits(alice_values, 8)
+"""
+import logging
+import random
+import compiler
+import generator
+import simulator
+import util
+
+# Circuits of check(): generated circuits of these bit sizes along with
+# the shipped ones (see generator.check_circuits), and a circuit starting
+# at wire 0
+CHECK_BIT_SIZES = (1, 4, 8)
+WIRE_0_CIRCUIT = {
+    "id": "wire 0 AND",
+    "alice": [0],
+    "bob": [1],
+    "out": [2],
+    "gates": [{"id": 2, "type": "AND", "in": [0, 1]}],
+}
+
+
+def replicate(circuit, copies):
+    """Return a circuit made of independent copies of a circuit.
+
+    Args:
+        circuit: A dict containing circuit spec, or the compiled circuit.
+        copies: The number of copies, at least 1.
+
+    Returns:
+        A dict containing the spec of the replicated circuit.
+    """
+    if copies < 1:
+        raise ValueError(f"A circuit needs at least one copy, not {copies}")
+    circuit = compiler.circuit_spec(circuit)
+    gates = circuit["gates"]
+    alice, bob = circuit.get("alice", []), circuit.get("bob", [])
+    shift = max([*alice, *bob, *circuit["out"],
+                 *(gate["id"] for gate in gates),
+                 *(w for gate in gates for w in gate["in"])], default=0) + 1
+    offsets = [j * shift for j in range(copies)]
+    return {
+        "id": f"{circuit['id']} x{copies}",
+        "alice": [w + offset for offset in offsets for w in alice],
+        "bob": [w + offset for offset in offsets for w in bob],
+        "out": [w + offset for offset in offsets for w in circuit["out"]],
+        "gates": [
+            {"id": gate["id"] + offset, "type": gate["type"],
+             "in": [w + offset for w in gate["in"]]}
+            for offset in offsets for gate in gates
+        ],
+    }
+
+
+def input_bits(values, bit_size):
+    """Return the input bits of a batch of numbers, number after number.
+
+    Args:
+        values: The numbers of a party, one per copy of the circuit.
+        bit_size: The size of the numbers in bits.
+    """
+    return [bit for value in values for bit in util.bits(value, bit_size)]
+
+
+def split_result(result, outputs, copies):
+    """Split the result of a replicated circuit into one number per copy.
+
+    Args:
+        result: A dict mapping the output wires to their bit.
+        outputs: The output wires of the replicated circuit.
+        copies: The number of copies of the circuit.
+
+    Returns:
+        The list of the results of the copies, as numbers whose bits are
+        the outputs of the copy, most significant first.
+    """
+    width = len(outputs) // copies
+    return [
+        int("".join(str(result[w]) for w in outputs[j * width:(j + 1) * width]), 2)
+        for j in range(copies)
+    ]
+
+
+def check_copies(circuit, copies=3, trials=8, seed=0):
+    """Return True if each copy of a replicated circuit gives the results
+    of the circuit on its own inputs.
+
+    The replicated circuit is evaluated in clear on random inputs, other
+    for each copy, and the outputs of each copy are compared with
+    simulator.evaluate of the circuit on the inputs of the copy.
+
+    Args:
+        circuit: A dict containing circuit spec, or the compiled circuit.
+        copies: Optional; the number of copies.
+        trials: Optional; the number of random inputs of each copy.
+        seed: Optional; the seed of the random inputs.
+    """
+    circuit = compiler.circuit_spec(circuit)
+    replicated = replicate(circuit, copies)
+    num_a, num_b = len(circuit.get("alice", [])), len(circuit.get("bob", []))
+    width = len(circuit["out"])
+    rng = random.Random(seed)
+    for _ in range(trials):
+        inputs = [([rng.getrandbits(1) for _ in range(num_a)],
+                   [rng.getrandbits(1) for _ in range(num_b)])
+                  for _ in range(copies)]
+        result = simulator.evaluate(replicated,
+                                    [bit for bits_a, _ in inputs for bit in bits_a],
+                                    [bit for _, bits_b in inputs for bit in bits_b])
+        for j, (bits_a, bits_b) in enumerate(inputs):
+            expected = simulator.evaluate(circuit, bits_a, bits_b)
+            outputs = replicated["out"][j * width:(j + 1) * width]
+            if ([result[w] for w in outputs] !=
+                    [expected[w] for w in circuit["out"]]):
+                return False
+    return True
+
+
+def check(paths=None, bit_sizes=CHECK_BIT_SIZES, copies=3):
+    """Check the copies of circuits, see check_copies.
+
+    Args:
+        paths: Optional; the JSON circuit files, the shipped circuits
+            (generator.CIRCUIT_FILES) by default.
+        bit_sizes: Optional; the bit sizes of the circuits made by
+            generator.generate for each operation.
+        copies: Optional; the number of copies.
+
+    Returns:
+        The list of the IDs of the circuits whose copies are wrong, empty
+        if all circuits pass.
+    """
+    circuits = generator.check_circuits(paths, bit_sizes)
+    circuits.append(WIRE_0_CIRCUIT)
+    failures = []
+    for circuit in circuits:
+        if not check_copies(circuit, copies):
+            logging.error(f"Copies of {circuit['id']} differ from the circuit")
+            failures.append(circuit["id"])
+    logging.info(f"Checked the copies of {len(circuits)} circuits")
+    return failures
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(
+        description="Check replicated circuits against the originals.")
+    parser.add_argument("circuits", metavar="circuit.json", nargs="?",
+                        help="the JSON circuit file, checked with generated "
+                             "circuits (default: the shipped circuits)")
+    parser.add_argument("--copies", type=int, default=3,
+                        help="the number of copies (default 3)")
+    args = parser.parse_args()
+    logging.basicConfig(format="[%(levelname)s] %(message)s",
+                        level=logging.INFO)
+    failures = check(None if args.circuits is None else [args.circuits],
+                     copies=args.copies)
+    print(f"simd check: {len(failures)} failure(s)")
+    sys.exit(1 if failures else 0)
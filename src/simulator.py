@@ -0,0 +1,163 @@
+import numpy as np
+import compiler
+
+# Bit-sliced gate functions, indexed by opcode (see compiler.GATE_TYPES)
+OPERATIONS = (
+    lambda a, b: ~a,  # NOT
+    lambda a, b: a & b,  # AND
+    lambda a, b: a | b,  # OR
+    lambda a, b: a ^ b,  # XOR
+    lambda a, b: ~(a & b),  # NAND
+    lambda a, b: ~(a | b),  # NOR
+    lambda a, b: ~(a ^ b),  # XNOR
+)
+LANE_BITS = 64  # number of inputs evaluated by one uint64 lane
+CHUNK_SIZE = 1 << 16  # number of inputs evaluated at once by a truth table
+# Lanes of the combination number bits below 6: bit k of the lane is set
+# when bit 'position' of k is set
+LOW_BIT_LANES = [
+    sum(1 << k for k in range(LANE_BITS) if (k >> position) & 1)
+    for position in range(6)
+]
+
+
+def simulate(circuit, lanes):
+    """Evaluate a circuit in clear on many inputs at once.
+
+    Each wire holds an array of uint64 lanes, bit k of lane j being the
+    value of the wire for input number 64 * j + k.
+
+    Args:
+        circuit: A dict containing circuit spec, or a compiled circuit.
+        lanes: A dict mapping Alice's and Bob's wires to uint64 arrays.
+
+    Returns:
+        A dict mapping output wires to uint64 arrays.
+    """
+    program = compiler.compile_circuit(circuit)
+    slots = [None] * program.num_slots
+
+    for wire, slot in program.input_slots:
+        slots[slot] = lanes[wire]
+    for opcode, _, slot_a, slot_b, slot_out in program.ops:
+        slots[slot_out] = OPERATIONS[opcode](slots[slot_a], slots[slot_b])
+
+    return {out: slots[slot] for out, slot in program.output_slots}
+
+
+def combination_lanes(num_bits, position, start, stop):
+    """Return the lanes of one bit of the combination numbers.
+
+    Args:
+        num_bits: The number of bits of a combination.
+        position: The index of the bit, 0 being the most significant.
+        start: The first combination number, a multiple of 64.
+        stop: The combination number after the last one.
+
+    Returns:
+        A uint64 array, bit k of lane j being the bit of combination
+        start + 64 * j + k.
+    """
+    shift = num_bits - 1 - position
+    num_lanes = -(-(stop - start) // LANE_BITS)
+    if shift < 6:
+        return np.full(num_lanes, LOW_BIT_LANES[shift], dtype=np.uint64)
+    lane_ids = np.arange(start // LANE_BITS,
+                         start // LANE_BITS + num_lanes,
+                         dtype=np.uint64)
+    bit = (lane_ids >> np.uint64(shift - 6)) & np.uint64(1)
+    return np.uint64(0) - bit  # all ones if the bit is set
+
+
+def truth_table(circuit, start=0, stop=None):
+    """Compute the outputs of a circuit for a range of input combinations.
+
+    Combination number n gives Alice's and Bob's wires (in this order) the
+    bits of n, most significant bit first, as in the exhaustive printouts.
+
+    Args:
+        circuit: A dict containing circuit spec, or a compiled circuit.
+        start: Optional; the first combination, a multiple of 64.
+        stop: Optional; the combination after the last one
+            (all combinations by default).
+
+    Returns:
+        A uint8 array of shape (stop - start, number of outputs).
+    """
+    program = compiler.compile_circuit(circuit)
+    wires = program.alice + program.bob
+    if stop is None:
+        stop = 2**len(wires)
+    lanes = {
+        wire: combination_lanes(len(wires), position, start, stop)
+        for position, wire in enumerate(wires)
+    }
+    outputs = simulate(program, lanes)
+
+    columns = [
+        np.unpackbits(outputs[out].astype("<u8").view(np.uint8),
+                      bitorder="little")[:stop - start]
+        for out in program.out
+    ]
+    return np.stack(columns, axis=1)
+
+
+def iter_truth_table(circuit):
+    """Yield (combination number, output bits) for all input combinations,
+    computed by chunks of CHUNK_SIZE combinations."""
+    program = compiler.compile_circuit(circuit)
+    total = 2**(len(program.alice) + len(program.bob))
+    for start in range(0, total, CHUNK_SIZE):
+        table = truth_table(program, start, min(start + CHUNK_SIZE, total))
+        for n, row in enumerate(table.tolist(), start):
+            yield n, row
+
+
+def evaluate(circuit, a_bits, b_bits):
+    """Evaluate a circuit in clear on a single input.
+
+    Args:
+        circuit: A dict containing circuit spec, or a compiled circuit.
+        a_bits: The list of Alice's input bits, in the order of her wires.
+        b_bits: The list of Bob's input bits, in the order of his wires.
+
+    Returns:
+        A dict mapping output wires with their result bit, like
+        yao.evaluate.
+
+    Raises:
+        ValueError: if a party has not one bit per wire.
+    """
+    program = compiler.compile_circuit(circuit)
+    a_bits, b_bits = list(a_bits), list(b_bits)
+    if len(a_bits) != len(program.alice) or len(b_bits) != len(program.bob):
+        raise ValueError(f"{program.id} needs {len(program.alice)} bits of "
+                         f"Alice and {len(program.bob)} bits of Bob, not "
+                         f"{len(a_bits)} and {len(b_bits)}")
+    lanes = {
+        wire: np.full(1, -bit, dtype=np.int64).view(np.uint64)
+        for wires, bits in ((program.alice, a_bits), (program.bob, b_bits))
+        for wire, bit in zip(wires, bits)
+    }
+    outputs = simulate(program, lanes)
+    return {out: int(outputs[out][0] & np.uint64(1)) for out in program.out}
+
+
+def print_truth_table(circuit):
+    """Print the evaluation of a circuit in clear for all inputs, in the
+    same format as the garbled evaluation printouts."""
+    program = compiler.compile_circuit(circuit)
+    a_wires, b_wires, outputs = program.alice, program.bob, program.out
+    N = len(a_wires) + len(b_wires)
+
+    print(f"======== {program.id} ========")
+    for n, result in iter_truth_table(program):
+        bits = format(n, 'b').zfill(N)
+        str_bits_a = ' '.join(bits[:len(a_wires)])
+        str_bits_b = ' '.join(bits[len(a_wires):])
+        str_result = ' '.join([str(bit) for bit in result])
+
+        print(f"  Alice{a_wires} = {str_bits_a} "
+              f"Bob{b_wires} = {str_bits_b}  "
+              f"Outputs{outputs} = {str_result}")
+    print()
@@ -0,0 +1,172 @@
+"""Compact storage of the garbled tables of a circuit.
+
+The rows of all tables are stored in one contiguous byte buffer. Gates
+are indexed by their position in evaluation order (their slot in the
+compiled program, see compiler.Program.ops), each one with a header byte
+and the offset of its rows in the buffer, so that a gate costs 9 bytes
+on top of its rows instead of a dict of tuples and byte strings.
+
+The header of a gate is its layout (the row keys it may hold, see
+LAYOUTS) in the high nibble, and the mask of the rows it holds in the low
+nibble. A row is indexed by the permute bits of the gate inputs (or by
+the G and E halves of half-gates), and the rows of a gate all have the
+same size. Free gates hold no row, nor do rows left out by garbled row
+reduction.
+
+Example:
+    tables = GarbledTables()
+    tables.add({(0, 0): row00, (0, 1): row01, (1, 0): row10, (1, 1): row11})
+    tables.row(0, 0b10)  # row10
+"""
+import array
+import sys
+
+# Row keys of the tables of each layout, a row being indexed by its
+# position in the layout
+LAYOUTS = (
+    ((0, ), (1, )),  # NOT gate
+    ((0, 0), (0, 1), (1, 0), (1, 1)),  # 2-input gate
+    ("G", "E"),  # half-gates
+)
+NOT_LAYOUT, GATE_LAYOUT, HALF_LAYOUT = range(len(LAYOUTS))
+# (number of rows, position of the row among them) of a row index in the
+# table of a header, at header << 2 | row index, None if the row is missing
+RANKS = tuple(
+    (bin(header & 15).count("1"), bin(header & ((1 << row) - 1)).count("1"))
+    if header & (1 << row) else None
+    for header in range(256) for row in range(4))
+
+
+class GarbledTables:
+    """The garbled tables of consecutive gates of a circuit.
+
+    Args:
+        start: Optional; the position of the first gate in evaluation
+            order, e.g. for the tables of a chunk of gates.
+    """
+    __slots__ = ("start", "headers", "offsets", "rows")
+
+    def __init__(self, start=0):
+        self.start = start
+        self.headers = bytearray()  # one header byte per gate
+        # offset of the rows of each gate, then the end of the last gate
+        self.offsets = array.array("Q", [0])
+        self.rows = bytearray()
+
+    @classmethod
+    def from_buffers(cls, start, headers, offsets, rows):
+        """Return tables read in place from their buffers (e.g. received
+        frames), the offsets being little-endian 8-byte integers. No gate
+        can be added to them."""
+        tables = cls.__new__(cls)
+        tables.start = start
+        tables.headers = headers
+        if sys.byteorder == "little":
+            tables.offsets = memoryview(offsets).cast("B").cast("Q")
+        else:
+            tables.offsets = array.array("Q", bytes(offsets))
+            tables.offsets.byteswap()
+        tables.rows = rows
+        return tables
+
+    def __getstate__(self):
+        return (self.start, bytes(self.headers), self.offsets_bytes(),
+                bytes(self.rows))
+
+    def __setstate__(self, state):
+        start, headers, offsets, rows = state
+        self.start = start
+        self.headers = bytearray(headers)
+        self.offsets = array.array("Q", offsets)
+        if sys.byteorder != "little":
+            self.offsets.byteswap()
+        self.rows = bytearray(rows)
+
+    def offsets_bytes(self):
+        """Return the offsets as little-endian 8-byte integers."""
+        if sys.byteorder == "little":
+            return bytes(self.offsets)
+        offsets = array.array("Q", self.offsets)
+        offsets.byteswap()
+        return offsets.tobytes()
+
+    def add(self, table=None):
+        """Add the table of the next gate.
+
+        Args:
+            table: Optional; a dict mapping row keys of one of LAYOUTS to
+                rows of the same size, None or empty for a free gate.
+        """
+        header = 0
+        if table:
+            layout = (HALF_LAYOUT if "G" in table else
+                      NOT_LAYOUT if len(next(iter(table))) == 1 else
+                      GATE_LAYOUT)
+            header = layout << 4
+            for index, row_key in enumerate(LAYOUTS[layout]):
+                row = table.get(row_key)
+                if row is not None:
+                    header |= 1 << index
+                    self.rows += row
+        self.headers.append(header)
+        self.offsets.append(len(self.rows))
+
+    def extend(self, tables):
+        """Add the tables of the next gates, e.g. a chunk of gates."""
+        base = len(self.rows)
+        self.headers += tables.headers
+        self.offsets.extend(base + offset for offset in tables.offsets[1:])
+        self.rows += tables.rows
+
+    def row(self, index, row_index):
+        """Return a row of a gate, or None if the gate does not hold it.
+
+        Args:
+            index: The position of the gate in evaluation order.
+            row_index: The position of the row in the layout of the gate,
+                e.g. 2 * encr_bit_a + encr_bit_b for a 2-input gate.
+        """
+        index -= self.start
+        rank = RANKS[self.headers[index] << 2 | row_index]
+        if rank is None:
+            return None
+        offsets = self.offsets
+        start = offsets[index]
+        size = (offsets[index + 1] - start) // rank[0]
+        start += rank[1] * size
+        return self.rows[start:start + size]
+
+    def table(self, index):
+        """Return the table of a gate as a dict mapping its row keys to
+        its rows, empty for a free gate."""
+        header = self.headers[index - self.start]
+        return {
+            row_key: self.row(index, row_index)
+            for row_index, row_key in enumerate(LAYOUTS[header >> 4])
+            if header & (1 << row_index)
+        }
+
+    def slice(self, start, stop):
+        """Return a copy of the tables of the gates at positions start to
+        stop, e.g. to send them to another process."""
+        first, last = start - self.start, stop - self.start
+        base = self.offsets[first]
+        tables = GarbledTables(start)
+        tables.headers = bytearray(self.headers[first:last])
+        tables.offsets = array.array(
+            "Q", (offset - base for offset in self.offsets[first:last + 1]))
+        tables.rows = bytearray(self.rows[base:self.offsets[last]])
+        return tables
+
+    def num_gates(self):
+        """Return the number of gates, free gates included."""
+        return len(self.headers)
+
+    def size(self):
+        """Return the size in bytes of all rows."""
+        return self.offsets[len(self.headers)]
+
+    def __len__(self):
+        """Return the number of garbled tables, i.e. of gates holding at
+        least one row."""
+        return len(self.headers) - self.headers.count(0)
@@ -0,0 +1,56 @@
+import os
+import pytest
+import compiler
+import simd
+import util
+from bob import Bob
+
+CIRCUITS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        "circuits")
+
+
+class FakeSocket:
+    """A socket connected to no one, keeping the messages Bob sends."""
+    def __init__(self):
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append(msg)
+
+    def receive(self):
+        return True
+
+
+def _bob(circuit_file, bit_size, data, simd_values=None):
+    """Return Bob after evaluating the first circuit of a file on
+    numbers of 'bit_size' bits."""
+    bob = Bob(socket=FakeSocket(), data=data)
+    circuit = util.parse_json(os.path.join(CIRCUITS, circuit_file))["circuits"][0]
+    if simd_values is not None:
+        circuit = simd.replicate(circuit, len(simd_values))
+    bob.program = compiler.compile_circuit(circuit)
+    bob.bitlength = bit_size
+    bob.private_value = bob.get_private_value(bit_size)
+    bob.values = simd_values
+    return bob
+
+
+# min.json reads the 2 most significant bits of 4-bit numbers
+@pytest.mark.parametrize("alice_max,bob_data,expected", [
+    (13, [6, 2], 1),  # min(0b11, 0b01)
+    (4, [15], 1),  # min(0b01, 0b11)
+    (2, [9, 12], 0),  # min(0b00, 0b11)
+])
+def test_verify_narrow_circuit(alice_max, bob_data, expected):
+    bob = _bob("min.json", 4, bob_data)
+    bob.verify({"alice_max": alice_max, "general_max": expected})
+    assert bob.socket.sent == [True]
+    bob.verify({"alice_max": alice_max, "general_max": expected ^ 1})
+    assert bob.socket.sent == [True, False]
+
+
+def test_verify_simd_batch():
+    bob = _bob("max.json", 2, [0], simd_values=[1, 2, 0])
+    bob.verify({"alice_max": [3, 0, 2], "general_max": [3, 2, 2]})
+    bob.verify({"alice_max": [3, 0, 2], "general_max": [3, 2, 0]})
+    assert bob.socket.sent == [True, False]
@@ -0,0 +1,31 @@
+import generator
+import optimizer
+import simd
+
+
+def test_generated_circuits():
+    circuits = generator.check_circuits([], bit_sizes=[1, 4])
+    assert [c["id"] for c in circuits] == [
+        f"{bit_size}-bit {operation.upper()}"
+        for operation in generator.OPERATIONS for bit_size in (1, 4)
+    ]
+
+
+def test_optimizer():
+    assert optimizer.check() == []
+
+
+def test_optimizer_duplicate_output():
+    circuit = optimizer.DUPLICATE_OUTPUT_CIRCUIT
+    optimized = optimizer.optimize(circuit)
+    ids = [gate["id"] for gate in optimized["gates"]]
+    assert len(ids) == len(set(ids))
+    assert optimizer.equivalent(circuit, optimized)
+
+
+def test_simd():
+    assert simd.check() == []
+
+
+def test_simd_wire_0():
+    assert simd.check_copies(simd.WIRE_0_CIRCUIT, copies=4)
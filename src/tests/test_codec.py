@@ -0,0 +1,76 @@
+import pytest
+import codec
+import tables
+
+
+def _tables():
+    garbled_tables = tables.GarbledTables()
+    garbled_tables.add({(0, 0): b"a" * 17, (0, 1): b"b" * 17,
+                        (1, 0): b"c" * 17})  # row-reduced table
+    garbled_tables.add()  # free gate
+    garbled_tables.add({"G": b"g" * 16, "E": b"e" * 16})
+    garbled_tables.add({(0, ): b"n" * 17, (1, ): b"m" * 17})
+    return garbled_tables
+
+
+MESSAGE = {
+    "none": None,
+    "bools": [True, False],
+    "ints": [0, -5, 2**63, -2**200],
+    "float": 1.5,
+    "str": "circuit é",
+    "bytes": b"\x00\xff",
+    "large": bytes(range(256)) * 8,  # sent in its own frame
+    "tuple": (1, (2, b"k")),
+    7: {(1, 0): "tuple key"},
+}
+
+
+@pytest.mark.parametrize("serializer", ["binary", "pickle"])
+def test_round_trip(serializer):
+    decoded = codec.decode(codec.encode(MESSAGE, serializer))
+    assert decoded.keys() == MESSAGE.keys()
+    for key, value in MESSAGE.items():
+        if key == "large":
+            assert bytes(decoded[key]) == value
+        else:
+            assert decoded[key] == value
+            assert type(decoded[key]) is type(value)
+
+
+def test_large_bytes_in_frames():
+    frames = codec.encode(MESSAGE)
+    assert len(frames) == 2
+    assert bytes(frames[1]) == MESSAGE["large"]
+
+
+@pytest.mark.parametrize("serializer", ["binary", "pickle"])
+def test_tables_round_trip(serializer):
+    garbled_tables = _tables()
+    decoded = codec.decode(codec.encode({"tables": garbled_tables},
+                                        serializer))["tables"]
+    assert decoded.num_gates() == garbled_tables.num_gates()
+    assert len(decoded) == len(garbled_tables) == 3
+    for index in range(garbled_tables.num_gates()):
+        assert decoded.table(index) == garbled_tables.table(index)
+
+
+def test_tables_slice_round_trip():
+    garbled_tables = _tables()
+    decoded = codec.decode(codec.encode(garbled_tables.slice(2, 4)))
+    assert decoded.start == 2
+    for index in (2, 3):
+        assert decoded.table(index) == garbled_tables.table(index)
+
+
+def test_unsupported_object_pickled():
+    frames = codec.encode({"type": object})
+    assert frames[0][3] == codec.PICKLE
+    assert codec.decode(frames) == {"type": object}
+
+
+def test_unknown_encoding():
+    frames = codec.encode(MESSAGE)
+    frames[0][2] = codec.VERSION + 1
+    with pytest.raises(ValueError):
+        codec.decode(frames)
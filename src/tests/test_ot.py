@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import zmq
+import generator
+import ot
+import simulator
+import util
+import yao
+
+CIRCUIT = generator.max_circuit(3)
+INPUTS = [([0, 0, 0], [0, 0, 0]), ([1, 0, 1], [0, 1, 1]),
+          ([0, 1, 1], [1, 0, 1]), ([1, 1, 1], [1, 1, 0])]
+
+
+@pytest.fixture
+def sockets():
+    """Alice's and Bob's sockets, connected on a free local port."""
+    bob_socket = util.EvaluatorSocket("tcp://127.0.0.1:*")
+    endpoint = bob_socket.socket.getsockopt(zmq.LAST_ENDPOINT).decode()
+    alice_socket = util.GarblerSocket(endpoint)
+    yield alice_socket, bob_socket
+    alice_socket.socket.close(linger=0)
+    bob_socket.socket.close(linger=0)
+
+
+def _keys(garbled_circuit, wires):
+    """Return the pairs ((key0, encr_bit0), (key1, encr_bit1)) of wires."""
+    keys, pbits = garbled_circuit.get_keys(), garbled_circuit.get_pbits()
+    return {w: ((keys[w][0], pbits[w]), (keys[w][1], pbits[w] ^ 1))
+            for w in wires}
+
+
+@pytest.mark.parametrize("enabled,mode", [
+    (True, "wire"),
+    (True, "batch"),
+    (True, "extension"),
+    (False, "wire"),
+])
+@pytest.mark.parametrize("free_xor", [False, True])
+def test_evaluation(sockets, enabled, mode, free_xor):
+    alice_socket, bob_socket = sockets
+    alice_ot = ot.ObliviousTransfer(alice_socket, enabled=enabled, mode=mode)
+    bob_ot = ot.ObliviousTransfer(bob_socket, enabled=enabled, mode=mode)
+    garbled_circuit = yao.GarbledCircuit(CIRCUIT, free_xor=free_xor)
+    pbits = garbled_circuit.get_pbits()
+    pbits_out = {w: pbits[w] for w in CIRCUIT["out"]}
+    a_keys = _keys(garbled_circuit, CIRCUIT["alice"])
+    b_keys = _keys(garbled_circuit, CIRCUIT["bob"])
+
+    with ThreadPoolExecutor(1) as executor:
+        for bits_a, bits_b in INPUTS:
+            a_inputs = {w: a_keys[w][bit]
+                        for w, bit in zip(CIRCUIT["alice"], bits_a)}
+            alice_result = executor.submit(alice_ot.get_result, a_inputs,
+                                           b_keys)
+            bob_result = bob_ot.send_result(
+                CIRCUIT, garbled_circuit.get_garbled_tables(), pbits_out,
+                dict(zip(CIRCUIT["bob"], bits_b)),
+                garbled_circuit.get_scheme())
+            expected = simulator.evaluate(CIRCUIT, bits_a, bits_b)
+            assert alice_result.result(timeout=30) == bob_result
+            assert {w: bob_result[w] for w in CIRCUIT["out"]} == \
+                {w: expected[w] for w in CIRCUIT["out"]}
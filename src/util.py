@@ -1,9 +1,12 @@
+import functools
+import itertools
 import json
-import operator
 import random
 import secrets
 import sympy
 import zmq
+import codec
+import metrics
 
 # SOCKET
 LOCAL_PORT = 4080
@@ -13,16 +16,37 @@ SERVER_PORT = 4080
 
 
 class Socket:
-    def __init__(self, socket_type):
+    """A ZMQ socket exchanging messages encoded by the codec module.
+
+    Messages are sent as multipart messages and received without copy,
+    the decoder detects the format of each message so both serializers
+    can talk to each other.
+
+    Args:
+        socket_type: The ZMQ socket type.
+        serializer: Optional; "binary" (the default) or "pickle".
+    """
+    def __init__(self, socket_type, serializer="binary"):
+        if serializer not in codec.FORMATS:
+            raise ValueError(f"Unknown serializer '{serializer}', "
+                             f"must be in {list(codec.FORMATS.keys())}")
         self.socket = zmq.Context().socket(socket_type)
+        self.serializer = serializer
         self.poller = zmq.Poller()
         self.poller.register(self.socket, zmq.POLLIN)
 
     def send(self, msg):
-        self.socket.send_pyobj(msg)
+        with metrics.timer("serialize"):
+            frames = codec.encode(msg, self.serializer)
+        metrics.message("sent", frames)
+        self.socket.send_multipart(frames, copy=False)
 
     def receive(self):
-        return self.socket.recv_pyobj()
+        with metrics.timer("transfer"):
+            frames = self.socket.recv_multipart(copy=False)
+        metrics.message("received", frames)
+        with metrics.timer("deserialize"):
+            return codec.decode(frames)
 
     def send_wait(self, msg):
         self.send(msg)
@@ -37,25 +61,46 @@ class Socket:
             while True:
                 obj = dict(self.poller.poll(timetick))
                 if self.socket in obj and obj[self.socket] == zmq.POLLIN:
-                    yield self.socket.recv_pyobj()
+                    yield self.receive()
         except KeyboardInterrupt:
             pass
 
 
 class EvaluatorSocket(Socket):
-    def __init__(self, endpoint=f"tcp://*:{LOCAL_PORT}"):
-        super().__init__(zmq.REP)
+    def __init__(self, endpoint=f"tcp://*:{LOCAL_PORT}", serializer="binary"):
+        super().__init__(zmq.REP, serializer)
         self.socket.bind(endpoint)
 
 
 class GarblerSocket(Socket):
-    def __init__(self, endpoint=f"tcp://{SERVER_HOST}:{SERVER_PORT}"):
-        super().__init__(zmq.REQ)
+    def __init__(self,
+                 endpoint=f"tcp://{SERVER_HOST}:{SERVER_PORT}",
+                 serializer="binary"):
+        super().__init__(zmq.REQ, serializer)
         self.socket.connect(endpoint)
 
 
 # PRIME GROUP
 PRIME_BITS = 64  # order of magnitude of prime in base 2
+# Vetted groups negotiated by ID, as (prime, generator). All primes are
+# safe primes p = 2q + 1, checked with sympy.isprime for p and q
+GROUPS = {
+    1: (0x983b0910d2632f7f, 7),
+    2: (0x91cc21e95befa58f, 5),
+    3: (0x88a3dd94d60e070b, 2),
+    # RFC 3526 2048-bit MODP group
+    14: (int(
+        "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74"
+        "020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437"
+        "4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+        "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05"
+        "98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB"
+        "9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B"
+        "E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF695581718"
+        "3995497CEA956AE515D2261898FA051015728E5A8AACAA68FFFFFFFFFFFFFFFF",
+        16), 2),
+}
+DEFAULT_GROUP = 1
 
 
 def next_prime(num):
@@ -71,7 +116,10 @@ def gen_prime(num_bits):
 
 def xor_bytes(seq1, seq2):
     """XOR two byte sequence."""
-    return bytes(map(operator.xor, seq1, seq2))
+    length = min(len(seq1), len(seq2))
+    num = (int.from_bytes(seq1[:length], "big")
+           ^ int.from_bytes(seq2[:length], "big"))
+    return num.to_bytes(length, "big")
 
 
 def bits(num, width):
@@ -79,13 +127,43 @@ def bits(num, width):
     return [int(k) for k in f'{num:0{width}b}']
 
 
+def input_combinations(num_a, num_b):
+    """Yield all combinations of Alice's and Bob's input bits.
+
+    Combinations are generated one by one in the order of the exhaustive
+    printouts, as a pair (bits_a, bits_b) of tuples of bits.
+    """
+    for bits in itertools.product((0, 1), repeat=num_a + num_b):
+        yield bits[:num_a], bits[num_a:]
+
+
 class PrimeGroup:
-    """Cyclic abelian group of prime order 'prime'."""
-    def __init__(self, prime=None):
+    """Cyclic abelian group of prime order 'prime'.
+
+    Powers of the generator are computed with a fixed-base table, built
+    on the first call to gen_pow: row i holds the powers g^(d * 2^(w * i))
+    for all digits d of a window of w bits of the exponent.
+
+    Args:
+        prime: Optional; the prime of the group (random by default).
+        generator: Optional; a generator of the group (random by default).
+        group_id: Optional; the ID of the group in GROUPS, if any.
+    """
+    def __init__(self, prime=None, generator=None, group_id=None):
         self.prime = prime or gen_prime(num_bits=PRIME_BITS)
         self.prime_m1 = self.prime - 1
         self.prime_m2 = self.prime - 2
-        self.generator = self.find_generator()
+        self.generator = generator or self.find_generator()
+        self.id = group_id
+        # window size in bits of the fixed-base table, smaller windows
+        # keep the table of large groups in a few MB
+        self.window = 8 if self.prime.bit_length() <= 256 else 4
+        self.gen_table = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["gen_table"] = None  # rebuilt by the receiver if needed
+        return state
 
     def mul(self, num1, num2):
         "Multiply two elements." ""
@@ -97,11 +175,35 @@ class PrimeGroup:
 
     def gen_pow(self, exponent):  # generator exponentiation
         "Compute nth power of a generator." ""
-        return pow(self.generator, exponent, self.prime)
+        if self.gen_table is None:
+            self.gen_table = self.gen_fixed_base_table()
+        exponent %= self.prime_m1
+        mask = (1 << self.window) - 1
+        result = 1
+        for row in self.gen_table:
+            if not exponent:
+                break
+            digit = exponent & mask
+            if digit:
+                result = (result * row[digit]) % self.prime
+            exponent >>= self.window
+        return result
+
+    def gen_fixed_base_table(self):
+        """Return the table of powers of the generator used by gen_pow."""
+        table = []
+        base = self.generator
+        for _ in range(0, self.prime_m1.bit_length(), self.window):
+            row = [1]
+            for _ in range((1 << self.window) - 1):
+                row.append((row[-1] * base) % self.prime)
+            table.append(row)
+            base = (row[-1] * base) % self.prime  # base^(2^window)
+        return table
 
     def inv(self, num):
         "Multiplicative inverse of an element." ""
-        return pow(num, self.prime_m2, self.prime)
+        return pow(num, -1, self.prime)
 
     def rand_int(self):  # random int in [1, prime-1]
         "Return an random int in [1, prime - 1]." ""
@@ -120,6 +222,17 @@ class PrimeGroup:
                 return candidate
 
 
+@functools.lru_cache(maxsize=None)
+def get_group(group_id):
+    """Return the vetted group with ID 'group_id', created once per process
+    along with its fixed-base table."""
+    if group_id not in GROUPS:
+        raise ValueError(f"Unknown group {group_id}, "
+                         f"must be in {list(GROUPS.keys())}")
+    prime, generator = GROUPS[group_id]
+    return PrimeGroup(prime, generator, group_id=group_id)
+
+
 # HELPER FUNCTIONS
 def parse_json(json_path):
     with open(json_path) as json_file:
@@ -1,6 +1,8 @@
 """
 This file contains some useful functions needed in my implementation
 """
+import numpy as np
+import ingest
 
 def cleanup(line: [], lim: int = 16):
     """
@@ -11,11 +13,15 @@ def cleanup(line: [], lim: int = 16):
 
     Returns:
         list of the inputs, where all negative numbers, and number exceeding lim are skipped
+        (an array for an array of inputs)
     """
+    if isinstance(line, np.ndarray):
+        return ingest.clean(line, lim)
     return [num for num in line if 0 <= num < lim]
 
 
-def private_func(name: str = "", bit_size: int = 16, file_read: bool = False, filename=None, data: list = []):
+def private_func(name: str = "", bit_size: int = 16, file_read: bool = False, filename=None, data: list = [],
+                 keep_values: bool = True):
     """ Function done on private data, on the side of each parties.
         In the case of this exercise, the function returns max of given list.
         Function accepts the input from file or from console.
@@ -28,8 +34,10 @@ def private_func(name: str = "", bit_size: int = 16, file_read: bool = False, fi
         data: list of data to performa calculations on.
             If not empty, result is calculated on it, otherwise data is from input.
             Default is empty
+        keep_values: if false, a file is only reduced to its max in bounded memory
+            (see ingest.reduce_file) and line is None (default is true)
     Returns:
-        line: array of inputs
+        line: array of inputs (a NumPy array for a file, see ingest.py)
         local_max: maximum value of the input in cleaned binary form
                 (i.e. without '0b' and filled with leading zeros).
 
@@ -43,9 +51,13 @@ def private_func(name: str = "", bit_size: int = 16, file_read: bool = False, fi
             line = [*map(int, input().split())]
         else:  # file
             try:
-                f = open(filename, "r")
                 print("Reading data from file")
-                line = list(map(int, f.read().split(" ")))
+                if not keep_values:
+                    local_max, _ = ingest.reduce_file(filename, bit_size)
+                    if local_max is None:
+                        raise ValueError(f"No number of at most {bit_size} bits in {filename}")
+                    return None, bin(local_max)[2:].zfill(bit_size)
+                line = ingest.read_values(filename)
 
             except FileNotFoundError:
                 print("File does not exist")
@@ -54,7 +66,7 @@ def private_func(name: str = "", bit_size: int = 16, file_read: bool = False, fi
         line = data
     # common part, cleanup and calculation
     line = cleanup(line, lim=2 ** bit_size)
-    local_max = bin(max(line))[2:].zfill(bit_size)
+    local_max = bin(int(line.max() if isinstance(line, np.ndarray) else max(line)))[2:].zfill(bit_size)
     return line, local_max
 
 
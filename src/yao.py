@@ -1,245 +1,821 @@
-import pickle
-import random
-from cryptography.fernet import Fernet
+import collections
+import time
+import ciphers
+import compiler
+import metrics
+import prg
+import tables
+import util
+
+# Gates evaluated by XORing their input keys when Free-XOR is enabled
+FREE_XOR_GATES = ("XOR", "XNOR")
+# Table compression modes: garbled row reduction and half-gates
+REDUCTIONS = (None, "grr3", "halfgates")
+# Gates garbled with half-gates, as an AND gate with (input a, input b,
+# output) inverted or not
+HALF_GATES = {
+    "AND": (0, 0, 0),
+    "NAND": (0, 0, 1),
+    "OR": (1, 1, 1),
+    "NOR": (1, 1, 0),
+}
+# Ways of evaluating a gate: garbled table, Free-XOR, half-gates or
+# relabelled NOT gate
+TABLE_GATE, FREE_GATE, HALF_GATE, RELABEL_GATE = range(4)
+# Number of decryptions (or hashes) of the evaluation of each way
+DECRYPTIONS = {TABLE_GATE: 1, FREE_GATE: 0, HALF_GATE: 2, RELABEL_GATE: 0}
+# Missing row of a reduced garbled table
+ZERO_ROW = bytes(ciphers.LABEL_SIZE + 1)
+STREAM_CHUNK_SIZE = 1024  # number of gates garbled and sent at once
+# Levels of fewer gates are not processed in parallel, and wide levels are
+# split into tasks of PARALLEL_CHUNK_SIZE gates
+PARALLEL_MIN_GATES = 512
+PARALLEL_CHUNK_SIZE = 256
+
+
+def half_gate_tweaks(gate_id):
+    """Return the tweaks of the garbler and evaluator halves of a gate.
+
+    They are negative so that they never collide with the tweak of a
+    regular garbled table (the gate ID).
+    """
+    return -2 * gate_id - 1, -2 * gate_id - 2
+
 
+def half_gate_hash(cipher, key, tweak):
+    """Hash a key into a label extended with its encrypted bit."""
+    pad = cipher.pad((key[:ciphers.LABEL_SIZE], ), tweak)
+    return pad[:ciphers.LABEL_SIZE] + bytes((pad[ciphers.LABEL_SIZE] & 1, ))
 
-def encrypt(key, data):
-    """Encrypt a message.
+
+def evaluate(circuit, g_tables, pbits_out, a_inputs, b_inputs,
+             cipher=ciphers.DEFAULT_CIPHER, free_xor=False, reduction=None,
+             free_not=True, executor=None):
+    """Evaluate yao circuit with given inputs.
 
     Args:
-        key: The encryption key.
-        data: The message to encrypt.
+        circuit: A dict containing circuit spec, or the circuit compiled
+            with compiler.compile_circuit (faster for repeated evaluation).
+        g_tables: The yao circuit garbled tables, a tables.GarbledTables.
+        pbits_out: The pbits of outputs.
+        a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
+        b_inputs: A dict mapping Bob's wires to (key, encr_bit) inputs.
+        cipher: Optional; the name of the cipher the circuit was garbled with.
+        free_xor: Optional; True if XOR and XNOR gates were garbled with
+            Free-XOR and thus have no garbled table.
+        reduction: Optional; the table compression of the circuit, "grr3"
+            or "halfgates" (None by default).
+        free_not: Optional; True (the default, as in GarbledCircuit) if NOT
+            gates were garbled by relabelling their input keys and thus
+            have no garbled table.
+        executor: Optional; a process pool evaluating the wide levels of
+            the circuit in parallel.
 
     Returns:
-        The encrypted message as a byte stream.
+        A dict mapping output wires with their result bit.
     """
-    f = Fernet(key)
-    return f.encrypt(data)
+    evaluator = CircuitEvaluator(circuit, a_inputs, b_inputs, cipher=cipher,
+                                 free_xor=free_xor, reduction=reduction,
+                                 free_not=free_not, executor=executor)
+    evaluator.run(g_tables)
+    return evaluator.get_result(pbits_out)
+
 
+class CircuitEvaluator:
+    """Evaluation of a yao circuit, gate by gate in evaluation order.
 
-def decrypt(key, data):
-    """Decrypt a message.
+    Gates can be evaluated in several runs, each with the garbled tables
+    of its gates only, so that tables received by chunks are evaluated as
+    they arrive and dropped afterwards.
 
     Args:
-        key: The decryption key.
-        data: The message to decrypt.
+        circuit: A dict containing circuit spec, or the compiled circuit.
+        a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
+        b_inputs: A dict mapping Bob's wires to (key, encr_bit) inputs.
+        cipher: Optional; the name of the cipher the circuit was garbled with.
+        free_xor: Optional; True if the circuit was garbled with Free-XOR.
+        reduction: Optional; the table compression of the circuit.
+        free_not: Optional; True (the default) if NOT gates were relabelled.
+        executor: Optional; a process pool evaluating the wide levels of
+            the circuit in parallel (see pool.new_executor).
+    """
+    def __init__(self, circuit, a_inputs, b_inputs,
+                 cipher=ciphers.DEFAULT_CIPHER, free_xor=False,
+                 reduction=None, free_not=True, executor=None):
+        self.program = compiler.compile_circuit(circuit)
+        self.executor = executor
+        self.cipher = ciphers.get_cipher(cipher)
+        # How each opcode is evaluated with the garbling scheme of the circuit
+        self.kinds = [
+            _gate_kind(gate_type, free_xor, reduction, free_not)
+            for gate_type in compiler.GATE_TYPES
+        ]
+        self.position = 0  # index of the next gate to evaluate
+        # (key, encr_bit) held by each slot
+        self.slots = [None] * self.program.num_slots
+
+        # Load Alice and Bob inputs
+        for wire, slot in self.program.input_slots:
+            self.slots[slot] = (a_inputs[wire]
+                                if wire in a_inputs else b_inputs[wire])
+
+    def run(self, g_tables, num_gates=None):
+        """Evaluate the next gates of the circuit.
 
-    Returns:
-        The decrypted message as a byte stream.
+        Args:
+            g_tables: The tables.GarbledTables of the gates to evaluate
+                (or of more gates).
+            num_gates: Optional; the number of gates to evaluate
+                (all remaining gates by default).
+        """
+        stop = (len(self.program.ops) if num_gates is None
+                else self.position + num_gates)
+        if metrics.enabled():
+            self._count_gates(self.program.ops[self.position:stop])
+        with metrics.timer("evaluate"):
+            if self.executor is None:
+                _evaluate_ops(self.program.ops[self.position:stop],
+                              self.position, self.slots, g_tables, self.cipher,
+                              self.kinds)
+            else:
+                for level_start, level_stop in self.program.levels:
+                    level_start = max(level_start, self.position)
+                    level_stop = min(level_stop, stop)
+                    if level_start < level_stop:
+                        self._run_level(level_start, level_stop, g_tables)
+        self.position = stop
+
+    def _count_gates(self, ops):
+        """Count the gates evaluated and their decryptions per gate type,
+        see metrics."""
+        for opcode, num in collections.Counter(op[0] for op in ops).items():
+            gate_type = compiler.GATE_TYPES[opcode]
+            metrics.count("gates_evaluated", num, gate=gate_type)
+            decryptions = num * DECRYPTIONS[self.kinds[opcode]]
+            if decryptions:
+                metrics.count("decryptions", decryptions, gate=gate_type)
+
+    def _run_level(self, start, stop, g_tables):
+        """Evaluate the ops start to stop of a level, in parallel if the
+        level is wide enough.
+
+        The gates of a level only read slots written by previous levels,
+        so each task gets the labels it reads and returns the ones it
+        writes.
+        """
+        ops = self.program.ops[start:stop]
+        if len(ops) < PARALLEL_MIN_GATES:
+            _evaluate_ops(ops, start, self.slots, g_tables, self.cipher,
+                          self.kinds)
+            return
+        futures = []
+        for chunk_start in range(start, stop, PARALLEL_CHUNK_SIZE):
+            chunk_stop = min(chunk_start + PARALLEL_CHUNK_SIZE, stop)
+            chunk = self.program.ops[chunk_start:chunk_stop]
+            slots = {}
+            for _, _, slot_a, slot_b, _ in chunk:
+                slots[slot_a] = self.slots[slot_a]
+                if slot_b != compiler.NO_WIRE:
+                    slots[slot_b] = self.slots[slot_b]
+            futures.append(
+                self.executor.submit(evaluate_gates, chunk, chunk_start, slots,
+                                     g_tables.slice(chunk_start, chunk_stop),
+                                     self.cipher, self.kinds))
+        for future in futures:
+            for slot, label in future.result().items():
+                self.slots[slot] = label
+
+    def get_result(self, pbits_out):
+        """Return a dict mapping output wires with their result bit, once
+        all gates have been evaluated."""
+        if self.position != len(self.program.ops):
+            raise ValueError(f"{len(self.program.ops) - self.position} gates "
+                             f"of {self.program.id} were not evaluated")
+        return {
+            out: self.slots[slot][1] ^ pbits_out[out]
+            for out, slot in self.program.output_slots
+        }
+
+
+def _evaluate_ops(ops, start, slots, g_tables, cipher, kinds):
+    """Evaluate compiled gates, reading and writing the labels in 'slots'.
+
+    Args:
+        ops: The (opcode, gate ID, slot_a, slot_b, slot_out) tuples of the
+            gates, in evaluation order.
+        start: The position of the first gate in evaluation order.
+        slots: A list, or a dict, mapping slots to (key, encr_bit) labels.
+        g_tables: The tables.GarbledTables of the gates.
+        cipher: The Cipher of the circuit.
+        kinds: How each opcode is evaluated (see _gate_kind).
     """
-    f = Fernet(key)
-    return f.decrypt(data)
+    row = g_tables.row
+    # Iterate over the gates, in evaluation order
+    for index, (opcode, gate_id, slot_a, slot_b, slot_out) in enumerate(ops, start):
+        kind = kinds[opcode]
+        key_a, encr_bit_a = slots[slot_a]
+        # Free-XOR gates are evaluated by XORing keys and encrypted bits
+        if kind == FREE_GATE:
+            key_b, encr_bit_b = slots[slot_b]
+            msg = (util.xor_bytes(key_a, key_b), encr_bit_a ^ encr_bit_b)
+        # Relabelled NOT gates pass their input label on
+        elif kind == RELABEL_GATE:
+            msg = (key_a, encr_bit_a)
+        # Half-gates: one hash per input, selected rows are XORed in
+        elif kind == HALF_GATE:
+            key_b, encr_bit_b = slots[slot_b]
+            table_g, table_e = row(index, 0), row(index, 1)
+            tweak_g, tweak_e = half_gate_tweaks(gate_id)
+            label_g = half_gate_hash(cipher, key_a, tweak_g)
+            if encr_bit_a:
+                label_g = util.xor_bytes(label_g, table_g)
+            label_e = half_gate_hash(cipher, key_b, tweak_e)
+            if encr_bit_b:
+                label_a = key_a + bytes((encr_bit_a, ))
+                label_e = util.xor_bytes(label_e,
+                                         util.xor_bytes(table_e, label_a))
+            label = util.xor_bytes(label_g, label_e)
+            msg = (label[:ciphers.LABEL_SIZE], label[ciphers.LABEL_SIZE])
+        # Special case if it's a NOT gate
+        elif slot_b == compiler.NO_WIRE:
+            # Fetch the encrypted message in the gate's garbled table,
+            # the row left out by row reduction is all zeros
+            encr_msg = row(index, encr_bit_a)
+            # Decrypt message
+            msg = cipher.decrypt((key_a, ), gate_id,
+                                 ZERO_ROW if encr_msg is None else encr_msg)
+        # Else the gate has two input wires (same model)
+        else:
+            key_b, encr_bit_b = slots[slot_b]
+            encr_msg = row(index, encr_bit_a << 1 | encr_bit_b)
+            msg = cipher.decrypt((key_a, key_b), gate_id,
+                                 ZERO_ROW if encr_msg is None else encr_msg)
+        slots[slot_out] = msg
 
 
-def evaluate(circuit, g_tables, pbits_out, a_inputs, b_inputs):
-    """Evaluate yao circuit with given inputs.
+def evaluate_gates(ops, start, slots, g_tables, cipher, kinds):
+    """Evaluate gates of one level in a worker process.
 
     Args:
-        circuit: A dict containing circuit spec.
-        g_tables: The yao circuit garbled tables.
-        pbits_out: The pbits of outputs.
-        a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
-        b_inputs: A dict mapping Bob's wires to (key, encr_bit) inputs.
+        ops: The compiled gates, see _evaluate_ops.
+        start: The position of the first gate in evaluation order.
+        slots: A dict mapping the slots read by the gates to their labels.
+        g_tables: The tables.GarbledTables of the gates.
+        cipher: The Cipher of the circuit.
+        kinds: How each opcode is evaluated.
 
     Returns:
-        A dict mapping output wires with their result bit.
+        A dict mapping the slots written by the gates to their labels.
     """
-    gates = circuit["gates"]  # dict containing circuit gates
-    wire_outputs = circuit["out"]  # list of output wires
-    wire_inputs = {}  # dict containing Alice and Bob inputs
-    evaluation = {}  # dict containing result of evaluation
+    _evaluate_ops(ops, start, slots, g_tables, cipher, kinds)
+    return {op[4]: slots[op[4]] for op in ops}
 
-    wire_inputs.update(a_inputs)
-    wire_inputs.update(b_inputs)
 
-    # Iterate over all gates
-    for gate in sorted(gates, key=lambda g: g["id"]):
-        gate_id, gate_in, msg = gate["id"], gate["in"], None
-        # Special case if it's a NOT gate
-        if (len(gate_in) < 2) and (gate_in[0] in wire_inputs):
-            # Fetch input key associated with the gate's input wire
-            key_in, encr_bit_in = wire_inputs[gate_in[0]]
-            # Fetch the encrypted message in the gate's garbled table
-            encr_msg = g_tables[gate_id][(encr_bit_in, )]
-            # Decrypt message
-            msg = decrypt(key_in, encr_msg)
-        # Else the gate has two input wires (same model)
-        elif (gate_in[0] in wire_inputs) and (gate_in[1] in wire_inputs):
-            key_a, encr_bit_a = wire_inputs[gate_in[0]]
-            key_b, encr_bit_b = wire_inputs[gate_in[1]]
-            encr_msg = g_tables[gate_id][(encr_bit_a, encr_bit_b)]
-            msg = decrypt(key_b, decrypt(key_a, encr_msg))
-        if msg:
-            wire_inputs[gate_id] = pickle.loads(msg)
+def garble_gates(gates, keys, pbits, cipher, offset, reduction, labels=None):
+    """Garble gates of one level in a worker process.
 
-    # After all gates have been evaluated, we populate the dict of results
-    for out in wire_outputs:
-        evaluation[out] = wire_inputs[out][1] ^ pbits_out[out]
+    Args:
+        gates: The gate specs, reading only wires of previous levels.
+        keys: A dict mapping the wires of the gates to their keys.
+        pbits: A dict mapping the wires of the gates to their p-bits.
+        cipher: The Cipher of the circuit.
+        offset: The Free-XOR offset, if any.
+        reduction: The table compression of the circuit.
+        labels: Optional; the prg.LabelGenerator of the circuit.
 
-    return evaluation
+    Returns:
+        A tuple (garbled tables, keys, p-bits) of the gate outputs.
+    """
+    garbled_tables = {}
+    for gate in gates:
+        garbled_gate = GarbledGate(gate, keys, pbits, cipher, offset,
+                                   reduction, labels)
+        garbled_tables[gate["id"]] = garbled_gate.get_garbled_table()
+    outputs = [gate["id"] for gate in gates]
+    return (garbled_tables, {w: keys[w] for w in outputs},
+            {w: pbits[w] for w in outputs})
+
+
+def _gate_kind(gate_type, free_xor, reduction, free_not):
+    """Return how a gate type is evaluated with a garbling scheme."""
+    if free_not and gate_type == "NOT":
+        return RELABEL_GATE
+    if free_xor and gate_type in FREE_XOR_GATES:
+        return FREE_GATE
+    if reduction == "halfgates" and gate_type in HALF_GATES:
+        return HALF_GATE
+    return TABLE_GATE
+
+
+# Logical function of each 2-input gate type
+OPERATORS = {
+    "OR": lambda b1, b2: b1 or b2,
+    "AND": lambda b1, b2: b1 and b2,
+    "XOR": lambda b1, b2: b1 ^ b2,
+    "NOR": lambda b1, b2: not (b1 or b2),
+    "NAND": lambda b1, b2: not (b1 and b2),
+    "XNOR": lambda b1, b2: not (b1 ^ b2)
+}
 
 
 class GarbledGate:
     """A representation of a garbled gate.
 
+    The gate only keeps its spec and garbled table, the keys and p-bits
+    are read (and derived) while garbling.
+
     Args:
         gate: A dict containing gate spec.
         keys: A dict mapping each wire to a pair of keys.
         pbits: A dict mapping each wire to its p-bit.
+        cipher: Optional; the cipher used to encrypt the garbled table.
+        offset: Optional; the global offset of Free-XOR keys.
+        reduction: Optional; the table compression, "grr3" or "halfgates".
+            With a reduction, the keys and p-bit of the output wire are
+            derived from the input keys if they are not in 'keys' yet.
+        labels: Optional; the prg.LabelGenerator of the circuit, giving
+            the output key not derived by a reduction without Free-XOR
+            (a fresh random key by default).
     """
-    def __init__(self, gate, keys, pbits):
-        self.keys = keys  # dict of yao circuit keys
-        self.pbits = pbits  # dict of p-bits
+    __slots__ = ("cipher", "offset", "reduction", "labels", "input",
+                 "output", "gate_type", "garbled_table")
+
+    def __init__(self, gate, keys, pbits, cipher=ciphers.DEFAULT_CIPHER,
+                 offset=None, reduction=None, labels=None):
+        self.cipher = ciphers.get_cipher(cipher)  # garbling cipher backend
+        self.offset = offset  # global offset of Free-XOR keys
+        self.reduction = reduction  # table compression mode
+        self.labels = labels  # generator of the wire keys
         self.input = gate["in"]  # list of inputs'ID
         self.output = gate["id"]  # ID of output
         self.gate_type = gate["type"]  # Gate type: OR, AND, ...
         self.garbled_table = {}  # The garbled table of the gate
-        # A clear representation of the garbled table for debugging purposes
-        self.clear_garbled_table = {}
-
-        # Create the garbled table according to the gate type
-        switch = {
-            "OR": lambda b1, b2: b1 or b2,
-            "AND": lambda b1, b2: b1 and b2,
-            "XOR": lambda b1, b2: b1 ^ b2,
-            "NOR": lambda b1, b2: not (b1 or b2),
-            "NAND": lambda b1, b2: not (b1 and b2),
-            "XNOR": lambda b1, b2: not (b1 ^ b2)
-        }
 
         # NOT gate is a special case since it has only one input
         if (self.gate_type == "NOT"):
-            self._gen_garbled_table_not()
+            self._gen_garbled_table_not(keys, pbits)
+        elif reduction == "halfgates" and self.gate_type in HALF_GATES:
+            self._gen_half_gates(keys, pbits)
         else:
-            operator = switch[self.gate_type]
-            self._gen_garbled_table(operator)
+            self._gen_garbled_table(keys, pbits, OPERATORS[self.gate_type])
 
-    def _gen_garbled_table_not(self):
+    def _gen_reduced_keys(self, keys, pbits, keys_in, bit_out):
+        """Derive the output keys from the first row of the garbled table.
+
+        The key of the first row is the pad of its input keys, so that the
+        row encrypts to zeros and is not sent (garbled row reduction).
+
+        Args:
+            keys: The dict of keys of the circuit.
+            pbits: The dict of p-bits of the circuit.
+            keys_in: The input keys of the first row.
+            bit_out: The output bit of the first row.
+        """
+        out = self.output
+        if out in keys:
+            return
+        pad = self.cipher.pad(keys_in, out)
+        key = pad[:ciphers.LABEL_SIZE]
+        if self.offset:
+            other_key = util.xor_bytes(key, self.offset)
+        elif self.labels:
+            other_key = self.cipher.make_key(self.labels.wire(out)[1])
+        else:
+            other_key = self.cipher.gen_key()
+        keys[out] = (key, other_key) if bit_out == 0 else (other_key, key)
+        pbits[out] = (pad[ciphers.LABEL_SIZE] & 1) ^ bit_out
+
+    def _gen_garbled_table_not(self, keys, pbits):
         """Create the garbled table of a NOT gate."""
         inp, out = self.input[0], self.output
 
+        if self.reduction:
+            bit_in = pbits[inp]
+            self._gen_reduced_keys(keys, pbits, (keys[inp][bit_in], ),
+                                   int(not (bit_in)))
+
         # For each entry in the garbled table
         for encr_bit_in in (0, 1):
             # Retrieve original bit
-            bit_in = encr_bit_in ^ self.pbits[inp]
+            bit_in = encr_bit_in ^ pbits[inp]
             # Compute output bit according to the gate type
             bit_out = int(not (bit_in))
             # Compute encrypted bit with the p-bit table
-            encr_bit_out = bit_out ^ self.pbits[out]
+            encr_bit_out = bit_out ^ pbits[out]
             # Retrieve related keys
-            key_in = self.keys[inp][bit_in]
-            key_out = self.keys[out][bit_out]
-
-            # Serialize the output key along with the encrypted bit
-            msg = pickle.dumps((key_out, encr_bit_out))
-            # Encrypt message and add it to the garbled table
-            self.garbled_table[(encr_bit_in, )] = encrypt(key_in, msg)
-            # Add to the clear table indexes of each keys
-            self.clear_garbled_table[(encr_bit_in, )] = [(inp, bit_in),
-                                                         (out, bit_out),
-                                                         encr_bit_out]
-
-    def _gen_garbled_table(self, operator):
+            key_in = keys[inp][bit_in]
+            key_out = keys[out][bit_out]
+
+            # Encrypt the output key along with the encrypted bit
+            # and add it to the garbled table, except for a reduced row
+            if not (self.reduction and encr_bit_in == 0):
+                self.garbled_table[(encr_bit_in, )] = self.cipher.encrypt(
+                    (key_in, ), out, key_out, encr_bit_out)
+
+    def _gen_garbled_table(self, keys, pbits, operator):
         """Create the garbled table of a 2-input gate.
 
         Args:
+            keys: The dict of keys of the circuit.
+            pbits: The dict of p-bits of the circuit.
             operator: The logical function of to the 2-input gate type.
         """
         in_a, in_b, out = self.input[0], self.input[1], self.output
 
+        if self.reduction:
+            bit_a, bit_b = pbits[in_a], pbits[in_b]
+            self._gen_reduced_keys(
+                keys, pbits, (keys[in_a][bit_a], keys[in_b][bit_b]),
+                int(operator(bit_a, bit_b)))
+
         # Same model as for the NOT gate except for 2 inputs instead of 1
         for encr_bit_a in (0, 1):
             for encr_bit_b in (0, 1):
-                bit_a = encr_bit_a ^ self.pbits[in_a]
-                bit_b = encr_bit_b ^ self.pbits[in_b]
+                bit_a = encr_bit_a ^ pbits[in_a]
+                bit_b = encr_bit_b ^ pbits[in_b]
                 bit_out = int(operator(bit_a, bit_b))
-                encr_bit_out = bit_out ^ self.pbits[out]
-                key_a = self.keys[in_a][bit_a]
-                key_b = self.keys[in_b][bit_b]
-                key_out = self.keys[out][bit_out]
-
-                msg = pickle.dumps((key_out, encr_bit_out))
-                self.garbled_table[(encr_bit_a, encr_bit_b)] = encrypt(
-                    key_a, encrypt(key_b, msg))
-                self.clear_garbled_table[(encr_bit_a, encr_bit_b)] = [
-                    (in_a, bit_a), (in_b, bit_b), (out, bit_out), encr_bit_out
-                ]
-
-    def print_garbled_table(self):
-        """Print a clear representation of the garbled table."""
-        print(f"GATE: {self.output}, TYPE: {self.gate_type}")
-        for k, v in self.clear_garbled_table.items():
-            # If it's a 2-input gate
-            if len(k) > 1:
-                key_a, key_b, key_out = v[0], v[1], v[2]
-                encr_bit_out = v[3]
-                print(f"[{k[0]}, {k[1]}]: "
-                      f"[{key_a[0]}, {key_a[1]}][{key_b[0]}, {key_b[1]}]"
-                      f"([{key_out[0]}, {key_out[1]}], {encr_bit_out})")
-            # Else it's a NOT gate
-            else:
-                key_in, key_out = v[0], v[1]
-                encr_bit_out = v[2]
-                print(f"[{k[0]}]: "
-                      f"[{key_in[0]}, {key_in[1]}]"
-                      f"([{key_out[0]}, {key_out[1]}], {encr_bit_out})")
+                encr_bit_out = bit_out ^ pbits[out]
+                key_a = keys[in_a][bit_a]
+                key_b = keys[in_b][bit_b]
+                key_out = keys[out][bit_out]
+
+                if not (self.reduction and encr_bit_a == encr_bit_b == 0):
+                    self.garbled_table[(encr_bit_a, encr_bit_b)] = \
+                        self.cipher.encrypt((key_a, key_b), out, key_out,
+                                            encr_bit_out)
+
+    def _gen_half_gates(self, keys, pbits):
+        """Create the two rows of an AND-like gate with half-gates.
+
+        The gate is computed as an AND gate with inverted inputs and output
+        (see HALF_GATES). Requires Free-XOR keys.
+
+        Args:
+            keys: The dict of keys of the circuit.
+            pbits: The dict of p-bits of the circuit.
+        """
+        in_a, in_b, out = self.input[0], self.input[1], self.output
+        inv_a, inv_b, inv_out = HALF_GATES[self.gate_type]
+        offset = self.offset + b"\x01"  # offset of the extended labels
+        tweak_g, tweak_e = half_gate_tweaks(out)
+
+        # Labels of the false value of the AND gate inputs,
+        # keys extended with their encrypted bit
+        label_a0 = keys[in_a][inv_a] + bytes((inv_a ^ pbits[in_a], ))
+        label_b0 = keys[in_b][inv_b] + bytes((inv_b ^ pbits[in_b], ))
+        color_a, color_b = label_a0[-1], label_b0[-1]
+
+        # Garbler half gate
+        hash_a0 = half_gate_hash(self.cipher, label_a0, tweak_g)
+        hash_a1 = half_gate_hash(self.cipher,
+                                 util.xor_bytes(label_a0, offset), tweak_g)
+        table_g = util.xor_bytes(hash_a0, hash_a1)
+        if color_b:
+            table_g = util.xor_bytes(table_g, offset)
+        label_g0 = util.xor_bytes(hash_a0, table_g) if color_a else hash_a0
+
+        # Evaluator half gate
+        hash_b0 = half_gate_hash(self.cipher, label_b0, tweak_e)
+        hash_b1 = half_gate_hash(self.cipher,
+                                 util.xor_bytes(label_b0, offset), tweak_e)
+        table_e = util.xor_bytes(util.xor_bytes(hash_b0, hash_b1), label_a0)
+        label_e0 = hash_b1 if color_b else hash_b0
+
+        label_out0 = util.xor_bytes(label_g0, label_e0)
+        if inv_out:
+            label_out0 = util.xor_bytes(label_out0, offset)
+        if out not in keys:
+            key0 = label_out0[:ciphers.LABEL_SIZE]
+            keys[out] = (key0, util.xor_bytes(key0, self.offset))
+            pbits[out] = label_out0[ciphers.LABEL_SIZE]
+
+        self.garbled_table = {"G": table_g, "E": table_e}
+
+    def print_garbled_table(self, pbits):
+        """Print a clear representation of the garbled table.
+
+        Args:
+            pbits: The dict of p-bits of the circuit.
+        """
+        print_clear_table({"id": self.output, "type": self.gate_type,
+                           "in": self.input}, pbits)
 
     def get_garbled_table(self):
         """Return the garbled table of the gate."""
         return self.garbled_table
 
 
+def clear_table(gate, pbits):
+    """Return a clear representation of the garbled table of a gate, for
+    debugging purposes.
+
+    It is built from the p-bits only, when printed, and lists the rows of
+    the full table whether they are sent or not.
+
+    Args:
+        gate: A dict containing gate spec.
+        pbits: The dict of p-bits of the circuit.
+
+    Returns:
+        A dict mapping the encrypted input bits of each row to the
+        (wire, bit) pairs of its inputs and output, and to its encrypted
+        output bit.
+    """
+    out = gate["id"]
+    if gate["type"] == "NOT":
+        inp = gate["in"][0]
+        table = {}
+        for encr_bit_in in (0, 1):
+            bit_in = encr_bit_in ^ pbits[inp]
+            bit_out = int(not (bit_in))
+            table[(encr_bit_in, )] = [(inp, bit_in), (out, bit_out),
+                                      bit_out ^ pbits[out]]
+        return table
+
+    in_a, in_b = gate["in"]
+    operator = OPERATORS[gate["type"]]
+    table = {}
+    for encr_bit_a in (0, 1):
+        for encr_bit_b in (0, 1):
+            bit_a = encr_bit_a ^ pbits[in_a]
+            bit_b = encr_bit_b ^ pbits[in_b]
+            bit_out = int(operator(bit_a, bit_b))
+            table[(encr_bit_a, encr_bit_b)] = [
+                (in_a, bit_a), (in_b, bit_b), (out, bit_out),
+                bit_out ^ pbits[out]
+            ]
+    return table
+
+
+def print_clear_table(gate, pbits):
+    """Print a clear representation of the garbled table of a gate, see
+    clear_table."""
+    print(f"GATE: {gate['id']}, TYPE: {gate['type']}")
+    for k, v in clear_table(gate, pbits).items():
+        # If it's a 2-input gate
+        if len(k) > 1:
+            key_a, key_b, key_out = v[0], v[1], v[2]
+            encr_bit_out = v[3]
+            print(f"[{k[0]}, {k[1]}]: "
+                  f"[{key_a[0]}, {key_a[1]}][{key_b[0]}, {key_b[1]}]"
+                  f"([{key_out[0]}, {key_out[1]}], {encr_bit_out})")
+        # Else it's a NOT gate
+        else:
+            key_in, key_out = v[0], v[1]
+            encr_bit_out = v[2]
+            print(f"[{k[0]}]: "
+                  f"[{key_in[0]}, {key_in[1]}]"
+                  f"([{key_out[0]}, {key_out[1]}], {encr_bit_out})")
+
+
 class GarbledCircuit:
     """A representation of a garbled circuit.
 
     Args:
-        circuit: A dict containing circuit spec.
+        circuit: A dict containing circuit spec, or the compiled circuit
+            (e.g. loaded by cache.load_circuits).
         pbits: Optional; a dict of p-bits for the given circuit.
+        cipher: Optional; the name of the cipher used to garble the circuit.
+        free_xor: Optional; derive all keys from a global offset so that
+            XOR and XNOR gates need no garbled table (False by default).
+        reduction: Optional; compress the garbled tables with garbled row
+            reduction ("grr3") or half-gates ("halfgates", needs Free-XOR).
+        free_not: Optional; garble NOT gates by relabelling (True by
+            default): the keys of the output are the input keys swapped
+            and its p-bit is the flipped input p-bit, so that the evaluator
+            passes the input label on and the gate needs no garbled table.
+        garble: Optional; garble all gates at once (True by default). If
+            False, only the keys and p-bits of the input wires are created
+            and the circuit is garbled by gen_garbled_chunks.
+        executor: Optional; a process pool garbling the wide levels of the
+            circuit in parallel (see pool.new_executor).
+        seed: Optional; the secret seed of the keys and p-bits (see
+            prg.LabelGenerator), a fresh random one by default. A fixed
+            seed makes the garbling reproducible, for tests and benchmarks.
     """
-    def __init__(self, circuit, pbits={}):
-        self.circuit = circuit
-        self.gates = circuit["gates"]  # list of gates
-        self.wires = set()  # list of circuit wires
+    def __init__(self, circuit, pbits={}, cipher=ciphers.DEFAULT_CIPHER,
+                 free_xor=False, reduction=None, garble=True, executor=None,
+                 seed=None, free_not=True):
+        self.program = compiler.compile_circuit(circuit)
+        self.cipher = ciphers.get_cipher(cipher)  # garbling cipher backend
+        self.free_xor = free_xor
+        self.reduction = reduction
+        self.free_not = free_not
+        self.executor = executor
+        if reduction not in REDUCTIONS:
+            raise ValueError(f"Unknown reduction '{reduction}', "
+                             f"must be in {list(REDUCTIONS)}")
+        if (free_xor or reduction) and not self.cipher.raw:
+            raise ValueError(f"Free-XOR and row reduction need raw keys, "
+                             f"not supported by cipher '{self.cipher.name}'")
+        if reduction == "halfgates" and not free_xor:
+            raise ValueError("Half-gates need Free-XOR")
+        self.gates = self.program.gates  # list of gates, in evaluation order
 
         self.pbits = {}  # dict of p-bits
         self.keys = {}  # dict of keys
-        self.garbled_tables = {}  # dict of garbled tables
-
-        # Retrieve all wire IDs from the circuit
-        for gate in self.gates:
-            self.wires.add(gate["id"])
-            self.wires.update(set(gate["in"]))
-        self.wires = list(self.wires)
-
-        self._gen_pbits(pbits)
-        self._gen_keys()
-        self._gen_garbled_tables()
+        # garbled tables, indexed by gate position in evaluation order
+        self.garbled_tables = tables.GarbledTables()
+        # generator of the keys and p-bits
+        self.labels = prg.LabelGenerator(seed, self.cipher.key_size)
+        # global offset R of Free-XOR keys
+        self.offset = (self.cipher.make_key(self.labels.offset())
+                       if free_xor else None)
+
+        # All wire IDs of the circuit, inputs read by no gate included
+        # (e.g. after optimizer.optimize)
+        self.wires = (self.program.alice + self.program.bob +
+                      [op[1] for op in self.program.ops])
+
+        wire_labels = self.labels.wires(self.wires)
+        self._gen_pbits(pbits, wire_labels)
+        self._gen_keys(wire_labels)
+        if garble:
+            self._gen_garbled_tables()
+
+    def _gen_pbits(self, pbits, wire_labels):
+        """Create a dict mapping each wire to a pseudorandom p-bit.
 
-    def _gen_pbits(self, pbits):
-        """Create a dict mapping each wire to a random p-bit."""
+        Args:
+            pbits: The p-bits given to the circuit, if any.
+            wire_labels: The labels of the wires (see
+                prg.LabelGenerator.wires).
+        """
         if pbits:
             self.pbits = pbits
         else:
-            self.pbits = {wire: random.randint(0, 1) for wire in self.wires}
+            self.pbits = {wire: wire_labels[wire][2] for wire in self.wires}
+
+    def _gen_keys(self, wire_labels):
+        """Create pair of keys for each wire, from its labels.
+
+        Keys of the gates which derive their output keys from their input
+        keys (Free-XOR gates and reduced tables) are created while garbling.
+        """
+        derived = {gate["id"] for gate in self.gates if self._is_derived(gate)}
+        make_key = self.cipher.make_key
 
-    def _gen_keys(self):
-        """Create pair of keys for each wire."""
         for wire in self.wires:
-            self.keys[wire] = (Fernet.generate_key(), Fernet.generate_key())
+            if wire in derived:
+                continue
+            key0, key1, _ = wire_labels[wire]
+            key0 = make_key(key0)
+            if self.free_xor:
+                self.keys[wire] = (key0, util.xor_bytes(key0, self.offset))
+            else:
+                self.keys[wire] = (key0, make_key(key1))
+
+    def _gen_free_keys(self, gate):
+        """Derive the keys and p-bit of a free gate output, a relabelled
+        NOT gate or a Free-XOR gate."""
+        if gate["type"] == "NOT":
+            self._gen_not_keys(gate)
+        else:
+            self._gen_free_xor_keys(gate)
+
+    def _gen_not_keys(self, gate):
+        """Derive the keys and p-bit of a relabelled NOT gate output.
+
+        The key of each output bit is the key of the opposite input bit,
+        and the flipped p-bit keeps the encrypted bit of the label, so the
+        evaluator passes the input label on as is.
+        """
+        inp, out = gate["in"][0], gate["id"]
+        key0, key1 = self.keys[inp]
+        self.keys[out] = (key1, key0)
+        self.pbits[out] = self.pbits[inp] ^ 1
+
+    def _gen_free_xor_keys(self, gate):
+        """Derive the keys and p-bit of a Free-XOR gate output.
+
+        The evaluator then only has to XOR its input keys and encrypted bits.
+        """
+        in_a, in_b, out = gate["in"][0], gate["in"][1], gate["id"]
+        key0 = util.xor_bytes(self.keys[in_a][0], self.keys[in_b][0])
+        pbit = self.pbits[in_a] ^ self.pbits[in_b]
+        # XNOR outputs 0 when the XOR of its inputs is 1
+        if gate["type"] == "XNOR":
+            key0 = util.xor_bytes(key0, self.offset)
+            pbit ^= 1
+        self.keys[out] = (key0, util.xor_bytes(key0, self.offset))
+        self.pbits[out] = pbit
+
+    def _is_free(self, gate):
+        """Return True if the gate has no garbled table."""
+        if gate["type"] == "NOT":
+            return self.free_not
+        return self.free_xor and gate["type"] in FREE_XOR_GATES
+
+    def _is_derived(self, gate):
+        """Return True if the output keys of the gate are derived."""
+        return self._is_free(gate) or self.reduction is not None
 
     def _gen_garbled_tables(self):
-        """Create the garbled table of each gate."""
+        """Create the garbled table of each gate, in evaluation order."""
+        if self.executor is not None:
+            for start, stop in self.program.levels:
+                with metrics.timer("garble"):
+                    self._gen_garbled_level(self.gates[start:stop])
+            return
+        for _, garbled_tables in self.gen_garbled_chunks():
+            self.garbled_tables.extend(garbled_tables)
+
+    def _gen_garbled_level(self, level):
+        """Create the garbled tables of the gates of a level, in parallel
+        if the level is wide enough.
+
+        Each task gets the keys and p-bits of the wires of its gates and
+        returns the tables, keys and p-bits of the gate outputs. Tables are
+        added in evaluation order once the level is garbled.
+        """
+        gates = []
+        for gate in level:
+            if self._is_free(gate):
+                self._gen_free_keys(gate)
+            else:
+                gates.append(gate)
+        if len(gates) < PARALLEL_MIN_GATES:
+            garbled_tables = garble_gates(gates, self.keys, self.pbits,
+                                          self.cipher, self.offset,
+                                          self.reduction, self.labels)[0]
+            self._add_level_tables(level, garbled_tables)
+            return
+
+        garbled_tables = {}
+        futures = []
+        for start in range(0, len(gates), PARALLEL_CHUNK_SIZE):
+            chunk = gates[start:start + PARALLEL_CHUNK_SIZE]
+            wires = {w for gate in chunk for w in gate["in"] + [gate["id"]]}
+            futures.append(
+                self.executor.submit(
+                    garble_gates, chunk,
+                    {w: self.keys[w] for w in wires if w in self.keys},
+                    {w: self.pbits[w] for w in wires}, self.cipher,
+                    self.offset, self.reduction, self.labels))
+        for future in futures:
+            chunk_tables, keys, pbits = future.result()
+            garbled_tables.update(chunk_tables)
+            self.keys.update(keys)
+            self.pbits.update(pbits)
+        self._add_level_tables(level, garbled_tables)
+
+    def _add_level_tables(self, level, garbled_tables):
+        """Add the tables of the gates of a level, free gates included."""
+        for gate in level:
+            self.garbled_tables.add(garbled_tables.get(gate["id"]))
+
+    def gen_garbled_chunks(self, chunk_size=STREAM_CHUNK_SIZE):
+        """Garble the circuit by chunks of gates, in evaluation order.
+
+        The garbled tables of a chunk are not kept by the circuit. Keys
+        and p-bits of the gate outputs derived while garbling (see
+        _gen_keys) are known once their chunk has been yielded.
+
+        Args:
+            chunk_size: Optional; the number of gates of a chunk.
+
+        Yields:
+            A pair (number of gates, tables.GarbledTables) per chunk, free
+            gates having an empty table.
+        """
+        position = 0
+        garbled_tables = tables.GarbledTables(position)
+        num_gates = 0
+        start = time.perf_counter()  # garbling time of the chunk, see metrics
         for gate in self.gates:
-            garbled_gate = GarbledGate(gate, self.keys, self.pbits)
-            self.garbled_tables[gate["id"]] = garbled_gate.get_garbled_table()
+            num_gates += 1
+            if self._is_free(gate):
+                self._gen_free_keys(gate)
+                garbled_tables.add()
+            else:
+                garbled_gate = GarbledGate(gate, self.keys, self.pbits,
+                                           self.cipher, self.offset,
+                                           self.reduction, self.labels)
+                garbled_tables.add(garbled_gate.get_garbled_table())
+            if num_gates == chunk_size:
+                metrics.observe("garble", time.perf_counter() - start)
+                yield num_gates, garbled_tables
+                position += num_gates
+                garbled_tables = tables.GarbledTables(position)
+                num_gates = 0
+                start = time.perf_counter()
+        if num_gates:
+            metrics.observe("garble", time.perf_counter() - start)
+            yield num_gates, garbled_tables
 
     def print_garbled_tables(self):
-        """Print p-bits and a clear representation of all garbled tables."""
-        print(f"======== {self.circuit['id']} ========")
+        """Print p-bits and a clear representation of all garbled tables.
+
+        The clear tables are built from the p-bits, the circuit must have
+        been garbled (all p-bits being known).
+        """
+        print(f"======== {self.program.id} ========")
         print(f"P-BITS: {self.pbits}")
         for gate in self.gates:
-            garbled_table = GarbledGate(gate, self.keys, self.pbits)
-            garbled_table.print_garbled_table()
+            if self._is_free(gate):
+                print(f"GATE: {gate['id']}, TYPE: {gate['type']} (free)")
+                continue
+            print_clear_table(gate, self.pbits)
         print()
 
     def get_pbits(self):
@@ -247,9 +823,24 @@ class GarbledCircuit:
         return self.pbits
 
     def get_garbled_tables(self):
-        """Return dict mapping each gate to its garbled table."""
+        """Return the garbled tables of the gates, a tables.GarbledTables
+        indexed by gate position in evaluation order."""
         return self.garbled_tables
 
+    def get_scheme(self):
+        """Return the garbling options the evaluator needs, as a dict of
+        keyword arguments for evaluate()."""
+        return {
+            "cipher": self.cipher.name,
+            "free_xor": self.free_xor,
+            "reduction": self.reduction,
+            "free_not": self.free_not
+        }
+
+    def get_table_size(self):
+        """Return the size in bytes of all garbled tables."""
+        return self.garbled_tables.size()
+
     def get_keys(self):
         """Return dict mapping each wire to its pair of keys."""
         return self.keys